@@ -0,0 +1,245 @@
+"""Geração do antibiograma sem interface gráfica (sem Streamlit nem plotly).
+
+Lê um ou mais ficheiros exportados pelo laboratório, remove os duplicados, calcula o perfil de
+resistências e escreve os relatórios em Excel, CSV, HTML e/ou PNG. Cada ficheiro (um por
+hospital/local) é processado num processo separado.
+
+Exemplos:
+    python batch.py exportacoes/ -o relatorios
+    python batch.py a.xlsx b.xlsx -f xlsx png -j 4
+    python batch.py exportacoes/*.xlsx --merge --name trimestre
+"""
+import argparse
+import logging
+import os
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from resis import (
+    MIN_ISOLATES, RESISTANCE_BANDS, SparseResults, cleaning_summary, df_clean, format_resistance, gram_resistance_counts,
+    period_counts, read_workbooks_in_process, resistance_bands, resistance_by_class, resistance_percentages,
+    resistance_statistics, resistance_trend,
+)
+
+FORMATS = ['xlsx', 'csv', 'html', 'png']
+INPUT_EXTENSIONS = ('.xlsx', '.xls', '.csv')
+
+
+def expand_inputs(paths):
+    """Substituir as pastas pelos ficheiros .xlsx/.xls/.csv que contêm."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                if name.lower().endswith(INPUT_EXTENSIONS) and not name.startswith('~$')))
+        else:
+            files.append(path)
+    return files
+
+
+def report_jobs(paths):
+    """Um relatório por ficheiro, com o nome do ficheiro sem extensão; quando dois ficheiros só diferem na
+    extensão, esta fica no nome (a.xlsx e a.csv → a_xlsx e a_csv).
+
+    ValueError se dois ficheiros continuarem com o mesmo nome (por exemplo, de pastas diferentes), para que
+    nenhum relatório escreva por cima de outro.
+    """
+    stems = Counter(os.path.splitext(os.path.basename(path))[0].casefold() for path in paths)
+    jobs, claimed = {}, {}
+    for path in paths:
+        stem, extension = os.path.splitext(os.path.basename(path))
+        name = stem if stems[stem.casefold()] == 1 else f"{stem}_{extension.lstrip('.').lower()}"
+        # comparação sem maiúsculas: no Windows A.xlsx e a.xlsx seriam o mesmo relatório
+        if name.casefold() in claimed:
+            raise ValueError(f"{path} e {claimed[name.casefold()]} dariam o mesmo relatório '{name}'; "
+                             f"mude o nome de um deles ou use --merge")
+        claimed[name.casefold()] = path
+        jobs[name] = [path]
+    return jobs
+
+
+def build_report(df, min_isolates=MIN_ISOLATES):
+    """Limpar os dados e calcular as tabelas do antibiograma."""
+    df_cleaned, df_duplicates = df_clean(df)
+    results = SparseResults(df_cleaned)
+    counts = gram_resistance_counts(df_cleaned, results)
+    percentages = resistance_percentages(*counts, min_isolates)
+    has_dates = pd.api.types.is_datetime64_any_dtype(df_cleaned['Data Colheita'])
+    return {
+        'summary': cleaning_summary(df, df_cleaned),
+        'percentages': percentages,
+        'resistance': format_resistance(percentages) if not percentages.empty else percentages,
+        'classes': resistance_by_class(percentages),
+        'statistics': resistance_statistics(*counts[:2], min_isolates),
+        'trends': resistance_trend(period_counts(df_cleaned, results), 'Q') if has_dates else pd.DataFrame(),
+        'duplicates': len(df_duplicates),
+    }
+
+
+def heatmap_labels(index):
+    return [' | '.join(map(str, row)) if isinstance(row, tuple) else str(row) for row in index]
+
+
+def write_excel(report, path):
+    summary = pd.Series(report['summary'], name='Valor').rename_axis('Indicador').reset_index()
+    trends = report['trends']
+    with pd.ExcelWriter(path) as writer:
+        summary.to_excel(writer, sheet_name='Resumo', index=False)
+        report['percentages'].to_excel(writer, sheet_name='Resistência')
+        report['classes'].to_excel(writer, sheet_name='Classes', index=False)
+        report['statistics'].to_excel(writer, sheet_name='Contagens e IC', index=False)
+        if not trends.empty:
+            trends.assign(Período=trends['Período'].astype(str)).to_excel(writer, sheet_name='Tendências', index=False)
+
+
+def write_csv(report, stem):
+    paths = [f"{stem}_resistencia.csv", f"{stem}_classes.csv", f"{stem}_contagens.csv"]
+    report['percentages'].to_csv(paths[0], encoding='utf-8-sig')
+    report['classes'].to_csv(paths[1], index=False, encoding='utf-8-sig')
+    report['statistics'].to_csv(paths[2], index=False, encoding='utf-8-sig')
+    if not report['trends'].empty:
+        paths.append(f"{stem}_tendencias.csv")
+        report['trends'].to_csv(paths[-1], index=False, encoding='utf-8-sig')
+    return paths
+
+
+def write_html(report, path, title):
+    """Tabela de resistências com as cores das três faixas, calculadas de uma só vez."""
+    percentages = report['percentages']
+    styles = np.array([f'background-color: {colour}; color: black' for colour, _ in RESISTANCE_BANDS] + [''])
+    bands = resistance_bands(percentages).fillna(len(RESISTANCE_BANDS)).astype(int).to_numpy()
+    css = pd.DataFrame(styles[bands], index=percentages.index, columns=percentages.columns)
+    table = report['resistance'].style.apply(lambda _: css, axis=None).format(na_rep='').to_html()
+
+    summary = report['summary']
+    legend = ''.join(f'<li><span style="background-color: {colour}">&emsp;</span> {label}</li>'
+                     for colour, label in RESISTANCE_BANDS)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title></head>
+<body>
+<h1>Perfil de resistência: {title}</h1>
+<p>Casos antes da remoção de duplicados: {summary['before_count']}<br>
+Casos após a remoção de duplicados: {summary['after_count']}</p>
+<ul>{legend}</ul>
+{table}
+</body></html>
+""")
+
+
+def write_png(report, path, title):
+    """Mapa de calor em PNG com o matplotlib (importado só quando é pedido)."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import ListedColormap
+
+    percentages = report['percentages']
+    bands = np.ma.masked_invalid(resistance_bands(percentages).to_numpy())
+    text = report['resistance'].fillna('').to_numpy()
+    rows, cols = percentages.shape
+
+    fig, ax = plt.subplots(figsize=(max(8, 0.45 * cols + 4), max(3, 0.35 * rows + 2)))
+    ax.imshow(bands, cmap=ListedColormap([colour for colour, _ in RESISTANCE_BANDS]),
+              vmin=-0.5, vmax=len(RESISTANCE_BANDS) - 0.5, aspect='auto')
+    for (i, j), value in np.ndenumerate(text):
+        if value:
+            ax.text(j, i, value, ha='center', va='center', fontsize=7)
+    ax.set_xticks(range(cols), labels=list(percentages.columns), rotation=90, fontsize=8)
+    ax.set_yticks(range(rows), labels=heatmap_labels(percentages.index), fontsize=8)
+    ax.xaxis.tick_top()
+    ax.set_title(title, pad=20)
+    fig.tight_layout()
+    fig.savefig(path, dpi=150)
+    plt.close(fig)
+
+
+def write_outputs(report, output_dir, name, formats):
+    """Escrever os relatórios pedidos; devolve a lista de ficheiros criados."""
+    os.makedirs(output_dir, exist_ok=True)
+    stem = os.path.join(output_dir, name)
+    written = []
+    if 'xlsx' in formats:
+        write_excel(report, f"{stem}.xlsx")
+        written.append(f"{stem}.xlsx")
+    if 'csv' in formats:
+        written.extend(write_csv(report, stem))
+    if report['percentages'].empty:
+        logging.warning(f"{name}: sem resistências para os microorganismos relevantes; HTML/PNG não gerados")
+        return written
+    if 'html' in formats:
+        write_html(report, f"{stem}.html", name)
+        written.append(f"{stem}.html")
+    if 'png' in formats:
+        write_png(report, f"{stem}.png", name)
+        written.append(f"{stem}.png")
+    return written
+
+
+def process_files(paths, output_dir, name, formats, min_isolates=MIN_ISOLATES):
+    """Ler os ficheiros como um só conjunto de dados e escrever o respetivo relatório."""
+    files = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            files.append((os.path.basename(path), f.read()))
+    df, errors = read_workbooks_in_process(files)
+    for error in errors:
+        logging.warning(f"Folha ignorada: {error}")
+    if df is None:
+        raise ValueError('; '.join(errors) or "sem dados")
+    return write_outputs(build_report(df, min_isolates), output_dir, name, formats)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Gerar o antibiograma sem abrir a interface Streamlit.")
+    parser.add_argument('inputs', nargs='+', help="ficheiros .xlsx/.xls/.csv ou pastas que os contêm")
+    parser.add_argument('-o', '--output-dir', default='relatorios', help="pasta dos relatórios (default: relatorios)")
+    parser.add_argument('-f', '--formats', nargs='+', choices=FORMATS, default=FORMATS, help="formatos a escrever")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help="ficheiros processados em paralelo")
+    parser.add_argument('--merge', action='store_true', help="juntar todos os ficheiros num só relatório")
+    parser.add_argument('--name', default='antibiograma', help="nome do relatório com --merge")
+    parser.add_argument('--min-isolates', type=int, default=MIN_ISOLATES,
+                        help=f"mínimo de isolados testados para apresentar uma percentagem (default: {MIN_ISOLATES})")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+    args = parse_args(argv)
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        logging.error("Nenhum ficheiro de entrada encontrado")
+        return 1
+
+    if args.merge:
+        jobs = {args.name: paths}
+    else:
+        try:
+            jobs = report_jobs(paths)
+        except ValueError as e:
+            logging.error(e)
+            return 1
+
+    failed = 0
+    workers = min(len(jobs), max(args.jobs, 1))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(process_files, job_paths, args.output_dir, name, args.formats, args.min_isolates): name
+                   for name, job_paths in jobs.items()}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                written = future.result()
+            except Exception as e:
+                failed += 1
+                logging.error(f"{name}: {e}")
+                continue
+            logging.info(f"{name}: {', '.join(written)}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,278 @@
+"""Benchmark do pipeline (leitura, limpeza, resistências e gráficos) com dados sintéticos.
+
+Gera exportações realistas e determinísticas (microorganismos relevantes com as grafias do
+laboratório, antibióticos de ANTIBIOTICS, duplicados dentro de 15 dias, vários serviços e
+produtos), mede o tempo e o pico de memória de cada etapa e compara com a referência guardada.
+Termina com código 1 se alguma etapa piorar mais do que o limite.
+
+Exemplos:
+    python bench.py                                   # 10k e 100k linhas, compara com bench_baseline.json
+    python bench.py --sizes 10k 100k 1M --save-baseline   # 1M só a pedido: ~3 min e ~2,7 GB de pico
+    python bench.py --sizes 10k --input-format xlsx --skip-ui
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from resis import (
+    ANTIBIOTICS, RELEVANT_MICROORGANISMS, GRAM_POSITIVO, GRAM_NEGATIVO, calculate_resistance, df_clean,
+    read_workbooks,
+)
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+STAGES = ['read', 'clean', 'resistance', 'plots']
+EXCEL_MAX_ROWS = 1_048_575
+
+# Grafias do laboratório para os microorganismos relevantes (passam pelo normalizador)
+LAB_SPELLINGS = {
+    'Citrobacter species': ['Citrobacter freundii', 'Citrobacter koseri'],
+    'Enterobacter species': ['Enterobacter cloacae complex', 'Enterobacter aerogenes'],
+    'Salmonella species': ['Salmonella enteritidis', 'Salmonella typhimurium'],
+    'Providencia species': ['Providencia stuartii', 'Providencia rettgeri'],
+    'Escherichia coli': ['Escherichia coli', 'Escherichia coli ESBL'],
+    'Klebsiella pneumoniae': ['Klebsiella pneumoniae', 'Klebsiella pneumoniae ESBL'],
+    'Staphylococcus aureus': ['Staphylococcus aureus', 'Staphylococcus aureus MRSA'],
+    'Enterococcus faecium': ['Enterococcus faecium', 'Enterococcus faecium VRE'],
+}
+OTHER_ORGANISMS = ['Candida albicans', 'Proteus vulgaris', 'Streptococcus pyogenes', 'Corynebacterium striatum']
+SERVICES = ['Medicina Interna', 'Cirurgia Geral', 'UCI', 'Urgência', 'Pediatria', 'Ortopedia', 'Urologia',
+            'Nefrologia', 'Hematologia', 'Oncologia', 'Cardiologia', 'Neonatologia', 'Ginecologia',
+            'Consulta Externa', 'Centro de Saúde']
+PRODUCTS = ['Urina', 'Sangue', 'Expectoração', 'Pus', 'Exsudado', 'Líquido pleural', 'Cateter', 'Fezes']
+# Colunas da exportação antes dos resultados: 26 descritivas e o Microorganismo
+LEAD_COLUMNS = ['Nº Processo', 'Nome', 'Data Nasc.', 'Nº Benef.', 'Nº SNS', 'Sexo', 'Idade', 'Serviço',
+                'Produto', 'Data Colheita', 'Nº Amostra', 'Episódio', 'Tipo Episódio', 'Cama', 'Médico',
+                'Data Registo', 'Data Validação', 'Técnico', 'Método', 'Equipamento', 'Quantificação',
+                'Observações', 'Local', 'Proveniência', 'Prioridade', 'Estado']
+PANEL_SIZE = 18
+
+
+def parse_size(text):
+    """'10k' -> 10000, '1M' -> 1000000."""
+    text = text.strip().lower()
+    factor = {'k': 1_000, 'm': 1_000_000}.get(text[-1], 1)
+    return int(float(text.rstrip('km')) * factor)
+
+
+def generate_export(n_rows, seed=0):
+    """Exportação sintética com `n_rows` linhas, das quais ~10% são cópias do mesmo isolado em 15 dias."""
+    rng = np.random.default_rng(seed)
+    n_duplicates = n_rows // 10
+    n_isolates = n_rows - n_duplicates
+
+    spellings = [(canonical, raw) for canonical in RELEVANT_MICROORGANISMS
+                 for raw in LAB_SPELLINGS.get(canonical, [canonical])]
+    organisms = np.array([raw for _, raw in spellings] + OTHER_ORGANISMS, dtype=object)
+    organism_weights = rng.zipf(1.6, len(organisms)).astype(float)
+    organism_ids = rng.choice(len(organisms), n_isolates, p=organism_weights / organism_weights.sum())
+
+    # cada microorganismo tem o seu painel de antibióticos e a sua taxa de resistência por antibiótico
+    antibiotic_index = {ab: i for i, ab in enumerate(ANTIBIOTICS)}
+    panels = np.zeros((len(organisms), len(ANTIBIOTICS)), dtype=bool)
+    for i in range(len(organisms)):
+        panels[i, rng.choice(len(ANTIBIOTICS), PANEL_SIZE, replace=False)] = True
+    resistance_rates = rng.beta(1.2, 3.0, (len(organisms), len(ANTIBIOTICS)))
+
+    service_weights = rng.zipf(1.8, len(SERVICES)).astype(float)
+    product_weights = rng.zipf(1.5, len(PRODUCTS)).astype(float)
+    dates = pd.Timestamp('2023-01-01') + pd.to_timedelta(rng.integers(0, 730, n_isolates), unit='D')
+
+    df = pd.DataFrame({
+        'Nº Processo': rng.integers(1, max(n_isolates // 3, 2), n_isolates),
+        'Nome': 'Anónimo',
+        'Data Nasc.': '01/01/1950',
+        'Nº Benef.': 0,
+        'Nº SNS': 0,
+        'Sexo': rng.choice(['M', 'F'], n_isolates),
+        'Idade': rng.integers(0, 100, n_isolates),
+        'Serviço': rng.choice(SERVICES, n_isolates, p=service_weights / service_weights.sum()),
+        'Produto': rng.choice(PRODUCTS, n_isolates, p=product_weights / product_weights.sum()),
+        'Data Colheita': dates,
+    })
+    for col in LEAD_COLUMNS[len(df.columns):]:
+        df[col] = rng.integers(0, 1000, n_isolates)
+    df.loc[rng.random(n_isolates) < 0.03, 'Serviço'] = None
+    df['Microorganismo'] = organisms[organism_ids]
+
+    results = np.array(['Resistente', 'Sensível', 'Sensível, com maior exposição.'], dtype=object)
+    for ab, j in antibiotic_index.items():
+        draw = rng.random(n_isolates)
+        rate = resistance_rates[organism_ids, j]
+        values = np.where(draw < rate, 0, np.where(draw < rate + (1 - rate) * 0.9, 1, 2))
+        column = results[values]
+        column[~panels[organism_ids, j] | (rng.random(n_isolates) < 0.1)] = None
+        df[ab] = column
+
+    # cópias do mesmo isolado (mesmo processo, microorganismo e resultados) até 15 dias depois
+    copies = df.iloc[rng.choice(n_isolates, n_duplicates)].copy()
+    copies['Data Colheita'] += pd.to_timedelta(rng.integers(0, 16, n_duplicates), unit='D')
+    df = pd.concat([df, copies], ignore_index=True)
+    df = df.iloc[rng.permutation(len(df))].reset_index(drop=True)
+    df['Data Colheita'] = df['Data Colheita'].dt.strftime('%d/%m/%Y')
+    return df
+
+
+def write_export(df, directory, input_format):
+    path = os.path.join(directory, f"export_{len(df)}.{input_format}")
+    if input_format == 'xlsx':
+        df.to_excel(path, index=False)
+    else:
+        df.to_csv(path, index=False, sep=';', encoding='utf-8-sig')
+    return path
+
+
+def measure(stage, prepare, repeat):
+    """Pico de memória (tracemalloc) numa primeira execução e melhor tempo em `repeat` execuções."""
+    arg = prepare()
+    tracemalloc.start()
+    stage(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        # libertar o resultado anterior antes de medir outra vez
+        arg = result = None
+        arg = prepare()
+        start = time.perf_counter()
+        result = stage(arg)
+        best = min(best, time.perf_counter() - start)
+    return result, {'seconds': round(best, 4), 'peak_mb': round(peak / 2 ** 20, 1)}
+
+
+def load_ui():
+    """Importar a interface em modo bare (sem servidor) para medir process_and_plot_data."""
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+    import st2
+    return st2
+
+
+def measure_read(path, repeat):
+    with open(path, 'rb') as f:
+        files = [(os.path.basename(path), f.read())]
+    return measure(lambda files: read_workbooks(files)[0], lambda: files, repeat)
+
+
+def run_size(n_rows, args, directory):
+    raw = generate_export(n_rows, args.seed)
+    path = write_export(raw, directory, args.input_format)
+    del raw
+
+    results = {}
+    df, results['read'] = measure_read(path, args.repeat)
+    (df_cleaned, _), results['clean'] = measure(df_clean, df.copy, args.repeat)
+    del df
+    _, results['resistance'] = measure(calculate_resistance, df_cleaned.copy, args.repeat)
+    if not args.skip_ui:
+        ui = load_ui()
+        _, results['plots'] = measure(
+            lambda df: ui.process_and_plot_data(df, GRAM_POSITIVO, GRAM_NEGATIVO, RELEVANT_MICROORGANISMS),
+            df_cleaned.copy, args.repeat)
+    return results
+
+
+def compare(results, baseline, threshold, min_seconds, min_mb):
+    """Lista das etapas que pioraram mais do que `threshold` (e mais do que os mínimos absolutos)."""
+    regressions = []
+    for size, stages in results.items():
+        for stage, current in stages.items():
+            reference = baseline.get(size, {}).get(stage)
+            if reference is None:
+                continue
+            for metric, floor in (('seconds', min_seconds), ('peak_mb', min_mb)):
+                limit = reference[metric] * (1 + threshold)
+                if current[metric] > limit and current[metric] - reference[metric] > floor:
+                    regressions.append(f"{size} linhas, {stage}: {metric} {current[metric]} > {limit:.4g} "
+                                       f"(referência {reference[metric]})")
+    return regressions
+
+
+def print_table(results, baseline):
+    print(f"{'linhas':>9} {'etapa':<11} {'tempo (s)':>10} {'ref. (s)':>9} {'pico (MB)':>10} {'ref. (MB)':>10}")
+    for size, stages in results.items():
+        for stage, current in stages.items():
+            reference = baseline.get(size, {}).get(stage, {})
+            print(f"{size:>9} {stage:<11} {current['seconds']:>10.3f} {reference.get('seconds', float('nan')):>9.3f} "
+                  f"{current['peak_mb']:>10.1f} {reference.get('peak_mb', float('nan')):>10.1f}")
+
+
+def cpu_model():
+    """Modelo do processador; no Linux platform.processor() vem vazio e lê-se /proc/cpuinfo."""
+    if platform.processor():
+        return platform.processor()
+    try:
+        with open('/proc/cpuinfo', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return platform.machine()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline com exportações sintéticas.")
+    parser.add_argument('--sizes', nargs='+', default=['10k', '100k'],
+                        help="número de linhas (default: 10k 100k; 1M só a pedido, precisa de ~3 GB de memória)")
+    parser.add_argument('--repeat', type=int, default=3, help="execuções por etapa (conta a melhor)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--input-format', choices=['csv', 'xlsx'], default='csv', help="formato do ficheiro lido")
+    parser.add_argument('--skip-ui', action='store_true', help="não medir process_and_plot_data (importa streamlit)")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="ficheiro JSON com a referência")
+    parser.add_argument('--save-baseline', action='store_true', help="gravar os resultados como nova referência")
+    parser.add_argument('--threshold', type=float, default=0.25, help="piora relativa tolerada (0.25 = 25%%)")
+    parser.add_argument('--min-seconds', type=float, default=0.05, help="diferença mínima de tempo a considerar")
+    parser.add_argument('--min-mb', type=float, default=5.0, help="diferença mínima de memória a considerar")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.WARNING)
+    args = parse_args(argv)
+    sizes = [parse_size(size) for size in args.sizes]
+    if args.input_format == 'xlsx' and max(sizes) > EXCEL_MAX_ROWS:
+        sys.exit(f"O Excel só tem {EXCEL_MAX_ROWS} linhas; use --input-format csv")
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for n_rows in sizes:
+            results[str(n_rows)] = run_size(n_rows, args, directory)
+
+    print_table(results, baseline)
+    if args.save_baseline:
+        saved = {**baseline, **results}
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({
+                # as referências só são comparáveis na mesma máquina
+                'machine': {'system': platform.platform(), 'processor': cpu_model(), 'cpus': os.cpu_count(),
+                            'python': platform.python_version(), 'pandas': pd.__version__,
+                            'recorded': time.strftime('%Y-%m-%d')},
+                'input_format': args.input_format,
+                'results': saved,
+            }, f, indent=2)
+        print(f"Referência gravada em {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.threshold, args.min_seconds, args.min_mb)
+    for regression in regressions:
+        print(f"PIOROU: {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2209 @@
+"""Leitura e normalização dos ficheiros exportados pelo laboratório.
+
+Módulo sem dependências da interface, para poder ser importado pelos processos de leitura em paralelo.
+"""
+import io
+import os
+import re
+import json
+import time
+import weakref
+import hashlib
+import logging
+import functools
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from types import MappingProxyType
+
+import numpy as np
+import pandas as pd
+from pandas.util import hash_array
+
+def _row_count(value):
+    """Número de linhas de um DataFrame/Series (ou do primeiro elemento de um tuplo), None nos restantes casos."""
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    return None
+
+
+class StageTimings:
+    """Medição opcional do tempo, das linhas e da variação de memória (RSS) de cada etapa.
+
+    Só regista depois de begin(True) e apenas na thread que o chamou (no Streamlit, a execução do
+    script da sessão); cada etapa é também escrita no logger 'resis.timings' como JSON.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self.logger = logging.getLogger('resis.timings')
+
+    def begin(self, enabled=True):
+        self._local.records = [] if enabled else None
+        self._local.depth = 0
+
+    @property
+    def enabled(self):
+        return getattr(self._local, 'records', None) is not None
+
+    @property
+    def records(self):
+        return list(getattr(self._local, 'records', None) or [])
+
+    @contextmanager
+    def measure(self, name, rows_in=None):
+        """Medir um bloco; o registo devolvido pode receber 'rows_out'."""
+        if not self.enabled:
+            yield {}
+            return
+        import psutil
+
+        process = psutil.Process()
+        record = {'stage': name, 'depth': self._local.depth, 'rows_in': rows_in, 'rows_out': None}
+        # registado à entrada, para as etapas aparecerem pela ordem de início
+        self._local.records.append(record)
+        self._local.depth += 1
+        rss = process.memory_info().rss
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = round(time.perf_counter() - start, 4)
+            record['rss_delta_mb'] = round((process.memory_info().rss - rss) / 2 ** 20, 1)
+            self._local.depth -= 1
+            self.logger.info(json.dumps(record, ensure_ascii=False))
+
+    def stage(self, func):
+        """Decorador: medir cada chamada de `func` (linhas de entrada do 1º argumento e do resultado)."""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            with self.measure(func.__name__, _row_count(args[0]) if args else None) as record:
+                result = func(*args, **kwargs)
+                record['rows_out'] = _row_count(result)
+                return result
+        return wrapper
+
+
+TIMINGS = StageTimings()
+
+
+# Original list of antibiotics
+ANTIBIOTICS = [
+    "Amicacina", "Amoxicillina/Ac. Clavulânico", "Ampicillina", "Ampicillina/sulbactam",
+    "Aztreonam", "Cefepima", "Cefotaxima", "Ceftazidima", "Ceftriaxone", "Cefuroxima",
+    "Cefuroxima - Axetil", "Cefuroxima - Sódica", "Cloranfenicol", "Ciprofloxacina",
+    "Clindamicina", "Doxycycline", "Eritromicina", "Fosfomicina", "Ácido Fusídico",
+    "Gentamicina", "Gentamicina (alta concentr.)", "Imipenem", "Meropenem",
+    "Nitrofurantoína", "Oxacillin MIC", "Penicillina", "Piperacillina/Tazobactam",
+    "Rifampicina", "Estreptomicina (alta concentr.)", "Teicoplanina", "Tetraciclina",
+    "Tobramicina", "Cotrimoxazol", "Vancomicina", "Levofloxacina",
+    "Quinupristina/Dalfopristina", "Oxacillina", "Mupirocina", "Linezolid",
+    "Tigeciclina", "Ertapenem", "Fluconazol", "Anfotericina B", "Amoxicilina",
+    "Moxifloxacina", "ESBL", "Beta Lactamase", "Colistina", "Caspofungina",
+    "Voricanazol", "Micafungina", "Benzylpenicilina", "Ceftolozane/Tazobactam",
+    "Etambutol", "Isoniazida", "Estreptomicina", "Pirazinamida", "Daptomicina",
+    "ESBL (Neg)", "tericin B", "Ceftazidime/Avibactam",
+    "Amoxicillina/Ac. Clavulânico (oral)", "Amoxicillina/Ac. Clavulânico (intravenoso)",
+    "Gentamicina (tópico)", "Imipenem/Relebactam"
+]
+
+# mudar "Amphotericin B" com "Anfotericina"
+ANTIBIOTICS = ["Anfotericina B" if ab == "Amphotericin B" else ab for ab in ANTIBIOTICS]
+
+
+def detect_antibiotic_columns(df):
+    """Identificar as colunas de antibióticos."""
+    return [col for col in df.columns if col in ANTIBIOTICS]
+
+
+# Resultados de sensibilidade (S/I/R) nas colunas de antibióticos
+SENSIVEL = 'Sensível'
+SENSIVEL_MAIOR_EXPOSICAO = 'Sensível, com maior exposição.'
+RESISTENTE = 'Resistente'
+RESULT_CATEGORIES = [SENSIVEL, SENSIVEL_MAIOR_EXPOSICAO, RESISTENTE]
+
+# Variantes de escrita dos resultados, comparadas em minúsculas e sem pontuação
+RESULT_ALIASES = {
+    's': SENSIVEL,
+    'sensível': SENSIVEL,
+    'sensivel': SENSIVEL,
+    'i': SENSIVEL_MAIOR_EXPOSICAO,
+    'sensível com maior exposição': SENSIVEL_MAIOR_EXPOSICAO,
+    'sensivel com maior exposicao': SENSIVEL_MAIOR_EXPOSICAO,
+    'intermédio': SENSIVEL_MAIOR_EXPOSICAO,
+    'intermedio': SENSIVEL_MAIOR_EXPOSICAO,
+    'r': RESISTENTE,
+    'resistente': RESISTENTE,
+}
+
+# Coluna com o ficheiro (e folha) de origem de cada linha
+SOURCE_COLUMN = 'Origem'
+
+# Colunas descritivas guardadas como Categorical
+CATEGORICAL_COLUMNS = ['Microorganismo', 'Serviço', 'Produto', 'Sexo', SOURCE_COLUMN]
+
+# Colunas numéricas (as restantes são lidas como texto no modo streaming)
+NUMERIC_COLUMNS = ['Idade']
+
+
+def _result_key(value):
+    return re.sub(r'[\s,.]+', ' ', str(value)).strip().lower()
+
+
+def _as_text(col):
+    """Garantir que uma coluna de objetos só contém texto (ou vazios)."""
+    if pd.api.types.infer_dtype(col, skipna=True) in ('string', 'empty'):
+        return col
+    return col.map(_to_text, na_action='ignore')
+
+
+def _to_text(value):
+    """Converter um valor de uma coluna mista em texto, mantendo as datas no formato do ficheiro."""
+    if hasattr(value, 'strftime'):
+        return value.strftime('%d/%m/%Y')
+    return str(value)
+
+
+def normalise_results(col):
+    """Converter uma coluna de resultados num Categorical com as categorias S/I/R fixas.
+
+    Valores fora do conjunto S/I/R (p.ex. 'Positivo' no ESBL) são mantidos como categorias extra.
+    """
+    codes, uniques = pd.factorize(col)
+    labels = [RESULT_ALIASES.get(_result_key(value), value) for value in uniques]
+    extra = sorted({str(label) for label in labels} - set(RESULT_CATEGORIES))
+    categories = pd.Index(RESULT_CATEGORIES + extra)
+    remap = np.append(categories.get_indexer([str(label) for label in labels]), -1)
+    return pd.Categorical.from_codes(remap[codes], categories=categories)
+
+
+def apply_dtype_schema(df):
+    """Aplicar o esquema de tipos: colunas descritivas e de antibióticos como Categorical."""
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns and df[col].dtype == object:
+            df[col] = _as_text(df[col]).astype('category')
+    for col in detect_antibiotic_columns(df):
+        if not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = normalise_results(df[col])
+    return df
+
+
+def normalise_columns(df):
+    """Normalizar os nomes das colunas e retirar as colunas com informação privada."""
+    COLUMN_MAPPING = {}
+
+    for col in df.columns:
+        if "Piperacillina" in col:
+            COLUMN_MAPPING[col] = "Piperacillina/Tazobactam"
+
+        if "Ceftriax" in col:
+            COLUMN_MAPPING[col] = "Ceftriaxona"
+
+    df.rename(columns=COLUMN_MAPPING, inplace=True)
+    # Limpeza dos nomes das colunas
+    df.columns = (df.columns.str.strip().str.replace(r'\s+', ' ', regex=True).str.replace(';', '', regex=False).str.replace('\n', '', regex=False))
+
+    sensitive_columns = ['Nº Benef.', 'Nº SNS', 'Data Nasc.', 'Nome']
+    df.drop(columns=sensitive_columns, errors='ignore', inplace=True)
+    return df
+
+
+# Padrões (sem distinção de maiúsculas) aplicados por ordem aos nomes dos microorganismos
+ORGANISM_PATTERNS = {
+    r'Enterococcus faecium.*': 'Enterococcus faecium',
+    r'Enterococcus faecalis.*': 'Enterococcus faecalis',
+    r'Staphylococcus aureus.*': 'Staphylococcus aureus',
+    r'Staphylococcus epidermidis.*': 'Staphylococcus epidermidis',
+    r'Klebsiella pneumoniae.*': 'Klebsiella pneumoniae',
+    r'Escherichia coli.*': 'Escherichia coli',
+    r'Pseudomonas aeruginosa.*': 'Pseudomonas aeruginosa',
+    r'Acinetobacter baumannii.*': 'Acinetobacter baumannii',
+    r'Enterobacter.*': 'Enterobacter species',
+    r'Citrobacter.*': 'Citrobacter species',
+    r'Salmonella.*': 'Salmonella species',
+    r'Providencia.*': 'Providencia species',
+}
+
+# Tabela de sinónimos do laboratório (CSV com as colunas nome;canonico)
+SYNONYMS_FILE = os.environ.get("RESIS_SYNONYMS_FILE", os.path.join(os.path.expanduser("~"), ".resis", "sinonimos.csv"))
+
+
+def _synonym_key(name):
+    return ' '.join(name.split()).casefold()
+
+
+class OrganismNormaliser:
+    """Uniformizar os nomes dos microorganismos (p.ex. 'Enterobacter cloacae' -> 'Enterobacter species').
+
+    Cada nome distinto é resolvido uma só vez (sinónimos exatos primeiro, depois os padrões) e o
+    resultado fica memorizado; a coluna é reconstruída a partir dos códigos do Categorical.
+    """
+
+    def __init__(self, synonyms=None, patterns=ORGANISM_PATTERNS):
+        self.synonyms = {_synonym_key(name): canonical for name, canonical in (synonyms or {}).items()}
+        self.patterns = [(re.compile(pattern, re.IGNORECASE), replacement) for pattern, replacement in patterns.items()]
+        # nomes já conhecidos: alvos dos sinónimos e dos padrões e os microorganismos relevantes
+        self.canonical = set(self.synonyms.values()) | set(patterns.values()) | set(RELEVANT_MICROORGANISMS)
+        # muda com os sinónimos ou os padrões; entra na chave dos conjuntos limpos
+        self.version = hashlib.sha256(json.dumps([sorted(self.synonyms.items()), sorted(patterns.items())],
+                                                 ensure_ascii=False).encode()).hexdigest()[:16]
+        self._memo = {}
+
+    @classmethod
+    def from_file(cls, path=SYNONYMS_FILE):
+        """Criar o normalizador com a tabela de sinónimos em `path`, se existir."""
+        if not os.path.exists(path):
+            return cls()
+        table = pd.read_csv(path, sep=None, engine='python', dtype=str, encoding='utf-8-sig').dropna()
+        return cls(dict(zip(table.iloc[:, 0], table.iloc[:, 1])))
+
+    def normalise(self, name):
+        if not isinstance(name, str):
+            return np.nan
+        result = self._memo.get(name)
+        if result is None:
+            result = self.synonyms.get(_synonym_key(name))
+            if result is None:
+                result = name
+                for pattern, replacement in self.patterns:
+                    result = pattern.sub(replacement, result)
+            self._memo[name] = result
+        return result
+
+    def __call__(self, organisms):
+        codes, uniques = pd.factorize(organisms)
+        mapped = pd.Index([self.normalise(name) for name in uniques], dtype=object)
+        categories = mapped.dropna().unique().sort_values()
+        lookup = np.append(categories.get_indexer(mapped), -1)
+        return pd.Series(pd.Categorical.from_codes(lookup[codes], categories=categories),
+                         index=organisms.index, name=organisms.name)
+
+    def unmapped(self, organisms):
+        """Nomes desconhecidos (sem sinónimo, padrão nem entrada em RELEVANT_MICROORGANISMS), com o número de ocorrências."""
+        counts = organisms.value_counts()
+        return counts[[name not in self.canonical for name in counts.index.astype(str)]]
+
+
+_normaliser = None
+
+
+def get_normaliser():
+    """Normalizador partilhado, recarregado quando a tabela de sinónimos muda."""
+    global _normaliser
+    version = os.path.getmtime(SYNONYMS_FILE) if os.path.exists(SYNONYMS_FILE) else None
+    if _normaliser is None or _normaliser[0] != version:
+        _normaliser = (version, OrganismNormaliser.from_file())
+    return _normaliser[1]
+
+
+def map_organisms(organisms):
+    """Uniformizar os nomes dos microorganismos com o normalizador partilhado."""
+    return get_normaliser()(organisms)
+
+
+def normalise_frame(df):
+    """Normalizar os nomes das colunas e dos microorganismos, retirar a informação privada e aplicar o esquema de tipos."""
+    df = normalise_columns(df)
+    df['Microorganismo'] = map_organisms(df['Microorganismo'])
+    apply_dtype_schema(df)
+    return df
+
+
+def read_data(uploaded_file):
+    """Ler e processar dados do Excel."""
+    try:
+        df = pd.read_excel(uploaded_file)
+        return normalise_frame(df), None
+
+    except Exception as e:
+        return None, str(e)
+
+
+def concat_frames(frames):
+    """Concatenar DataFrames mantendo as colunas Categorical (com a união das categorias)."""
+    frames = [frame.copy() for frame in frames]
+    for col in frames[0].columns:
+        columns = [frame[col] for frame in frames if col in frame.columns]
+        if len(columns) == len(frames) and all(isinstance(c.dtype, pd.CategoricalDtype) for c in columns):
+            categories = frames[0][col].cat.categories
+            for c in columns[1:]:
+                categories = categories.append(c.cat.categories.difference(categories))
+            for frame in frames:
+                frame[col] = frame[col].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+
+# Versão do formato guardado em disco; alterar sempre que a normalização em read_data mudar
+STORE_SCHEMA_VERSION = 3
+STORE_DIR = os.environ.get("RESIS_STORE_DIR", os.path.join(os.path.expanduser("~"), ".resis", "store"))
+# Pasta dos conjuntos limpos partilhados pelas sessões e processos do servidor
+SHARED_DIR = os.environ.get("RESIS_SHARED_DIR", os.path.join(STORE_DIR, "shared"))
+# Os ficheiros guardados têm dados dos doentes: só o utilizador os pode ler
+STORE_FILE_MODE = 0o600
+STORE_DIR_MODE = 0o700
+# Espaço máximo das cópias colunares e dos conjuntos partilhados (os usados há mais tempo são apagados)
+STORE_MAX_MB = float(os.environ.get("RESIS_STORE_MAX_MB", 2048))
+SHARED_MAX_MB = float(os.environ.get("RESIS_SHARED_MAX_MB", 2048))
+
+
+def private_dir(path):
+    """Criar a pasta (se não existir) só com acesso do utilizador."""
+    os.makedirs(path, mode=STORE_DIR_MODE, exist_ok=True)
+    try:
+        os.chmod(path, STORE_DIR_MODE)
+    except OSError:  # pasta de outro utilizador
+        pass
+
+
+def publish_file(tmp_path, path):
+    """Dar ao ficheiro temporário as permissões privadas e colocá-lo no lugar de `path`."""
+    os.chmod(tmp_path, STORE_FILE_MODE)
+    os.replace(tmp_path, path)
+
+
+def touch(path):
+    """Marcar o ficheiro como usado agora (a remoção por espaço começa pelos usados há mais tempo)."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def prune_files(groups, max_bytes, keep=()):
+    """Apagar os grupos de ficheiros usados há mais tempo até o total caber em `max_bytes`.
+
+    `groups` é {nome: [caminhos]}; a data de uso de um grupo é a última modificação (ver touch) dos
+    seus ficheiros. Os grupos em `keep` nunca são apagados. Devolve os nomes apagados.
+    """
+    sizes, used = {}, {}
+    for name, paths in groups.items():
+        stats = []
+        for path in paths:
+            try:
+                stats.append(os.stat(path))
+            except OSError:
+                pass
+        sizes[name] = sum(st.st_size for st in stats)
+        used[name] = max((st.st_mtime for st in stats), default=0)
+    total = sum(sizes.values())
+    removed = []
+    for name in sorted(groups, key=used.get):
+        if total <= max_bytes:
+            break
+        if name in keep:
+            continue
+        for path in groups[name]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total -= sizes[name]
+        removed.append(name)
+    return removed
+
+
+class ColumnarStore:
+    """Cópia colunar (Feather sem compressão) dos dados normalizados, indexada pelo hash do ficheiro original.
+
+    Guarda também os conjuntos de dados acumulados do modo incremental (ver append_export).
+    """
+
+    def __init__(self, root=STORE_DIR, max_bytes=int(STORE_MAX_MB * 2 ** 20)):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return os.path.join(self.root, f"{key}.feather")
+
+    def prune(self, keep=()):
+        """Apagar as cópias colunares usadas há mais tempo acima de max_bytes (os conjuntos acumulados ficam)."""
+        if not os.path.isdir(self.root):
+            return []
+        groups = {name[:-len('.feather')]: [os.path.join(self.root, name)]
+                  for name in os.listdir(self.root) if name.endswith('.feather')}
+        return prune_files(groups, self.max_bytes, keep)
+
+    def dataset_path(self, name, part='cleaned'):
+        safe_name = re.sub(r'[^\w-]+', '_', name)
+        return os.path.join(self.root, 'datasets', f"{safe_name}.{part}.feather")
+
+    def _read(self, path):
+        """Ler um ficheiro com memory mapping; devolve (df, metadados) ou (None, None)."""
+        import pyarrow as pa
+        import pyarrow.feather as feather
+        if not os.path.exists(path):
+            return None, None
+        try:
+            table = feather.read_table(path, memory_map=True)
+        except (OSError, pa.ArrowInvalid) as e:
+            logging.warning(f"Cópia colunar ilegível {path}: {e}")
+            return None, None
+        metadata = {k.decode(): v.decode() for k, v in (table.schema.metadata or {}).items()}
+        if metadata.get('resis.schema_version') != str(STORE_SCHEMA_VERSION):
+            return None, None
+        return table.to_pandas(), metadata
+
+    def _write(self, path, df, metadata):
+        import pyarrow as pa
+        import pyarrow.feather as feather
+        df = df.copy()
+        for col in df.columns[df.dtypes == object]:
+            df[col] = _as_text(df[col])
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        schema_metadata = dict(table.schema.metadata or {})
+        schema_metadata[b'resis.schema_version'] = str(STORE_SCHEMA_VERSION).encode()
+        schema_metadata.update({k.encode(): v.encode() for k, v in metadata.items()})
+        table = table.replace_schema_metadata(schema_metadata)
+
+        private_dir(self.root)
+        private_dir(os.path.dirname(path))
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        feather.write_feather(table, tmp_path, compression='uncompressed')
+        publish_file(tmp_path, path)
+
+    def load(self, key):
+        """Carregar com memory mapping; devolve None se não existir ou for de outra versão do esquema."""
+        df, metadata = self._read(self.path(key))
+        if df is None or metadata.get('resis.source_sha256') != key:
+            return None
+        streamed = metadata.get('resis.streamed')
+        if streamed == '1':
+            # cópia do modo streaming antigo, toda em texto: volta a ser convertida
+            return None
+        if streamed == '2':
+            df = _finish_streamed(df)
+        # aplicar os sinónimos acrescentados depois de a cópia ter sido gravada
+        df['Microorganismo'] = map_organisms(df['Microorganismo'])
+        touch(self.path(key))
+        return df
+
+    def save(self, key, df):
+        """Guardar os dados com a versão do esquema e o hash do ficheiro de origem nos metadados."""
+        self._write(self.path(key), df, {'resis.source_sha256': key})
+        self.prune(keep={key})
+
+    def dataset_sources(self, name):
+        """Ficheiros de origem de um conjunto acumulado, lidos só dos metadados; None se não existir."""
+        import pyarrow as pa
+        path = self.dataset_path(name)
+        if not os.path.exists(path):
+            return None
+        try:
+            with pa.memory_map(path) as source:
+                metadata = pa.ipc.open_file(source).schema.metadata or {}
+        except (OSError, pa.ArrowInvalid) as e:
+            logging.warning(f"Cópia colunar ilegível {path}: {e}")
+            return None
+        if metadata.get(b'resis.schema_version') != str(STORE_SCHEMA_VERSION).encode():
+            return None
+        return json.loads(metadata[b'resis.sources'])
+
+    def load_dataset(self, name):
+        """Carregar um conjunto acumulado: dados limpos, duplicados, cópias removidas, contagens e ficheiros de origem."""
+        cleaned, metadata = self._read(self.dataset_path(name))
+        duplicates, _ = self._read(self.dataset_path(name, 'duplicates'))
+        dropped, _ = self._read(self.dataset_path(name, 'dropped'))
+        if cleaned is None or duplicates is None or dropped is None:
+            return None
+        counts = json.loads(metadata['resis.counts'])
+        # conjuntos gravados antes de o cubo e as contagens mensais serem guardados não os têm
+        aggregates = {}
+        cube = [self._read_counts(name, f'cube.{part}') for part in CUBE_PARTS]
+        if all(part is not None for part in cube):
+            aggregates['cube'] = dict(zip(CUBE_PARTS, cube), **cube_selectors(cube[2]))
+        periods = [self._read_counts(name, f'periods.{part}') for part in ('tested', 'resistant')]
+        if all(part is not None for part in periods):
+            aggregates['period_counts'] = tuple(periods)
+        return {
+            **aggregates,
+            'cleaned': cleaned,
+            'duplicates': duplicates,
+            'dropped': dropped,
+            'counts': (
+                pd.read_json(io.StringIO(counts['tested']), orient='split'),
+                pd.read_json(io.StringIO(counts['resistant']), orient='split'),
+                pd.read_json(io.StringIO(counts['isolates']), orient='split', typ='series'),
+            ),
+            'sources': json.loads(metadata['resis.sources']),
+            'summary': json.loads(metadata['resis.summary']),
+        }
+
+    def _write_counts(self, name, part, table):
+        """Gravar uma tabela (ou série) de contagens com índice, como tabela plana."""
+        frame = table.to_frame('isolates') if isinstance(table, pd.Series) else table
+        frame = frame.reset_index()
+        if 'Período' in frame.columns:
+            frame['Período'] = frame['Período'].astype(str)
+        self._write(self.dataset_path(name, part), frame, {
+            'resis.levels': json.dumps(list(table.index.names)),
+            'resis.series': '1' if isinstance(table, pd.Series) else '0',
+        })
+
+    def _read_counts(self, name, part):
+        frame, metadata = self._read(self.dataset_path(name, part))
+        if frame is None:
+            return None
+        levels = json.loads(metadata['resis.levels'])
+        if 'Período' in levels:
+            frame['Período'] = pd.PeriodIndex(frame['Período'], freq='M')
+        frame = frame.set_index(levels)
+        return frame['isolates'].rename(None) if metadata['resis.series'] == '1' else frame
+
+    def save_dataset(self, name, dataset):
+        # os dados limpos são gravados por último e marcam o conjunto como completo
+        self._write(self.dataset_path(name, 'duplicates'), dataset['duplicates'], {})
+        self._write(self.dataset_path(name, 'dropped'), dataset['dropped'], {})
+        for part in CUBE_PARTS:
+            self._write_counts(name, f'cube.{part}', dataset['cube'][part])
+        for part, table in zip(('tested', 'resistant'), dataset['period_counts']):
+            self._write_counts(name, f'periods.{part}', table)
+        tested, resistant, isolates = dataset['counts']
+        self._write(self.dataset_path(name), dataset['cleaned'], {
+            'resis.counts': json.dumps({
+                'tested': tested.to_json(orient='split'),
+                'resistant': resistant.to_json(orient='split'),
+                'isolates': isolates.to_json(orient='split'),
+            }),
+            'resis.sources': json.dumps(dataset['sources']),
+            'resis.summary': json.dumps(dataset['summary']),
+        })
+
+
+def _encode_frame(df):
+    """Tabela Arrow só com colunas de largura fixa e sem máscara de nulos (categorias como códigos,
+    datas como int64), para poderem ser lidas de volta sem cópia; texto livre fica como texto."""
+    import pyarrow as pa
+    arrays = {'index': pa.array(df.index.to_numpy())}
+    columns = []
+    for i, (name, col) in enumerate(df.items()):
+        spec = {'name': name}
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            values = col.cat.codes.to_numpy()
+            spec.update(kind='category', categories=col.cat.categories.tolist(), ordered=bool(col.cat.ordered))
+        elif col.dtype.kind == 'M':
+            values = col.to_numpy().view('i8')
+            spec.update(kind='datetime', dtype=str(col.dtype))
+        elif col.dtype.kind in 'biuf':
+            values = col.to_numpy()
+            spec.update(kind='values')
+        else:
+            values = pa.array(_as_text(col), from_pandas=True)
+            spec.update(kind='text')
+        arrays[f'c{i}'] = values
+        columns.append(spec)
+    table = pa.table(arrays)
+    return table.replace_schema_metadata({
+        b'resis.schema_version': str(STORE_SCHEMA_VERSION).encode(),
+        b'resis.columns': json.dumps({'index': df.index.name, 'columns': columns}).encode(),
+    })
+
+
+def _column_values(column):
+    if column.num_chunks == 1:
+        return column.chunk(0).to_numpy(zero_copy_only=True)
+    return column.to_numpy()
+
+
+def _decode_frame(table):
+    """DataFrame cujas colunas (exceto o texto livre) são vistas, só de leitura, dos buffers da tabela."""
+    layout = json.loads(table.schema.metadata[b'resis.columns'])
+    data = {}
+    for i, spec in enumerate(layout['columns']):
+        column = table.column(f'c{i}')
+        if spec['kind'] == 'text':
+            values = column.to_pandas().to_numpy(dtype=object)
+            values[pd.isna(values)] = np.nan
+            data[spec['name']] = values
+            continue
+        values = _column_values(column)
+        if spec['kind'] == 'category':
+            values = pd.Categorical.from_codes(values, dtype=pd.CategoricalDtype(spec['categories'], spec['ordered']))
+        elif spec['kind'] == 'datetime':
+            values = values.view(spec['dtype'])
+        data[spec['name']] = values
+    index = pd.Index(_column_values(table.column('index')), name=layout['index'])
+    return pd.DataFrame(data, index=index, columns=[spec['name'] for spec in layout['columns']], copy=False)
+
+
+class SharedDatasetStore:
+    """Conjuntos de dados limpos partilhados entre sessões e processos do servidor, indexados pelo hash do conteúdo.
+
+    Cada parte (df, df_cleaned, df_duplicates) é gravada uma vez num ficheiro Arrow sem compressão e
+    lida com memory mapping: as colunas são vistas dos mesmos buffers, pelo que os processos que abrem o
+    mesmo ficheiro partilham as páginas de memória. Num processo, cada parte é aberta uma só vez e
+    mantida enquanto alguma sessão (ou a cache de ingestão) a referir; a última referência liberta-a.
+    """
+
+    PARTS = ('df_duplicates', 'df', 'df_cleaned')
+
+    def __init__(self, root=SHARED_DIR, max_bytes=int(SHARED_MAX_MB * 2 ** 20)):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._frames = weakref.WeakValueDictionary()
+        self._summaries = {}
+        self._lock = threading.Lock()
+
+    def path(self, key, part):
+        return os.path.join(self.root, f"{key}.{part}.arrow")
+
+    def save(self, key, frames, summary):
+        """Gravar as partes de um conjunto; df_cleaned é gravado por último e marca o conjunto como completo."""
+        import pyarrow.feather as feather
+        private_dir(self.root)
+        for part in self.PARTS:
+            table = _encode_frame(frames[part])
+            if part == 'df_cleaned':
+                metadata = dict(table.schema.metadata)
+                metadata[b'resis.summary'] = json.dumps(summary).encode()
+                table = table.replace_schema_metadata(metadata)
+            tmp_path = f"{self.path(key, part)}.{os.getpid()}.tmp"
+            # um só bloco por coluna, para cada coluna ser um único buffer contínuo
+            feather.write_feather(table, tmp_path, compression='uncompressed', chunksize=max(len(table), 1))
+            publish_file(tmp_path, self.path(key, part))
+        self.prune(keep={key})
+
+    def prune(self, keep=()):
+        """Apagar os conjuntos usados há mais tempo acima de max_bytes.
+
+        Os processos que já têm as partes abertas continuam a lê-las (o mapeamento mantém-se).
+        """
+        groups = {}
+        for name in os.listdir(self.root):
+            if name.endswith('.arrow'):
+                groups.setdefault(name.rsplit('.', 2)[0], []).append(os.path.join(self.root, name))
+        return prune_files(groups, self.max_bytes, keep)
+
+    def _open_part(self, key, part):
+        import pyarrow.feather as feather
+        frame = self._frames.get((key, part))
+        if frame is None:
+            table = feather.read_table(self.path(key, part), memory_map=True)
+            if table.schema.metadata.get(b'resis.schema_version') != str(STORE_SCHEMA_VERSION).encode():
+                raise ValueError("versão do esquema diferente")
+            frame = _decode_frame(table)
+            if part == 'df_cleaned':
+                self._summaries[key] = json.loads(table.schema.metadata[b'resis.summary'])
+            self._frames[(key, part)] = frame
+        return frame
+
+    def open(self, key):
+        """Partes do conjunto e resumo da limpeza, ou None se o conjunto não estiver (completo) na pasta."""
+        import pyarrow as pa
+        if not os.path.exists(self.path(key, 'df_cleaned')):
+            return None
+        with self._lock:
+            try:
+                frames = {part: self._open_part(key, part) for part in self.PARTS}
+            except (OSError, ValueError, KeyError, pa.ArrowException) as e:
+                logging.warning(f"Conjunto partilhado ilegível {key}: {e}")
+                return None
+        touch(self.path(key, 'df_cleaned'))
+        frames['summary'] = self._summaries[key]
+        return frames
+
+    def open_count(self):
+        """Número de partes abertas neste processo (ainda referidas por alguma sessão)."""
+        return len(self._frames)
+
+
+def list_sheets(data):
+    """Nomes das folhas de um livro Excel em bytes."""
+    with pd.ExcelFile(io.BytesIO(data)) as workbook:
+        return workbook.sheet_names
+
+
+def read_sheet(data, source, sheet_name=0, workbook=None):
+    """Ler e normalizar uma folha de um livro Excel (ou um CSV) em bytes, identificando a origem das linhas.
+
+    `workbook` (um pd.ExcelFile já aberto com `data`) evita voltar a ler o livro inteiro para cada folha.
+    """
+    if is_csv(source):
+        # tipos inferidos pelo read_csv, como no read_excel (ler tudo como texto gasta muito mais memória)
+        source_file = io.BytesIO(data)
+        raw = pd.read_csv(source_file, sep=csv_separator(source_file), encoding='utf-8-sig', low_memory=False)
+    else:
+        raw = pd.read_excel(workbook if workbook is not None else io.BytesIO(data), sheet_name=sheet_name)
+    df = normalise_frame(raw)
+    df[SOURCE_COLUMN] = pd.Categorical.from_codes(np.zeros(len(df), dtype=int), categories=[source])
+    return df
+
+
+@TIMINGS.stage
+def read_workbooks(files, max_workers=None, progress=None):
+    """Ler várias folhas de vários livros em paralelo (um processo por folha) e juntar os resultados.
+
+    `files` é uma lista de pares (nome, bytes); `progress(origem, lidas, total)` é chamado a cada folha lida.
+    Com max_workers=1 as folhas são lidas no próprio processo (ver read_workbooks_in_process).
+    Devolve (df, erros), com df None se nenhuma folha puder ser lida.
+    """
+    if max_workers == 1:
+        return read_workbooks_in_process(files, progress)
+
+    jobs = []
+    errors = []
+    for name, data in files:
+        try:
+            sheets = [0] if is_csv(name) else list_sheets(data)
+        except Exception as e:
+            errors.append(f"{name}: {e}")
+            continue
+        for sheet in sheets:
+            jobs.append((data, name if len(sheets) == 1 else f"{name} [{sheet}]", sheet))
+
+    frames = {}
+    if len(jobs) == 1:
+        data, source, sheet = jobs[0]
+        try:
+            frames[source] = read_sheet(data, source, sheet)
+        except Exception as e:
+            errors.append(f"{source}: {e}")
+        if progress:
+            progress(source, 1, 1)
+    elif jobs:
+        workers = min(len(jobs), max_workers or os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(read_sheet, data, source, sheet): source for data, source, sheet in jobs}
+            for done, future in enumerate(as_completed(futures), start=1):
+                source = futures[future]
+                try:
+                    frames[source] = future.result()
+                except Exception as e:
+                    errors.append(f"{source}: {e}")
+                if progress:
+                    progress(source, done, len(jobs))
+
+    if not frames:
+        return None, errors
+    # manter a ordem em que os ficheiros foram indicados
+    ordered = [frames[source] for _, source, _ in jobs if source in frames]
+    return concat_frames(ordered), errors
+
+
+def read_workbooks_in_process(files, progress=None):
+    """Ler as folhas dos livros uma a uma no próprio processo, sem criar processos (p.ex. dentro de um
+    processo do batch); cada livro é aberto uma só vez para todas as suas folhas.
+
+    `progress(origem, lidos, total)` é chamado a cada livro lido. Devolve (df, erros) como read_workbooks.
+    """
+    frames = []
+    errors = []
+    for done, (name, data) in enumerate(files, start=1):
+        try:
+            if is_csv(name):
+                frames.append(read_sheet(data, name))
+            else:
+                with pd.ExcelFile(io.BytesIO(data)) as workbook:
+                    sheets = workbook.sheet_names
+                    for sheet in sheets:
+                        source = name if len(sheets) == 1 else f"{name} [{sheet}]"
+                        try:
+                            frames.append(read_sheet(data, source, sheet, workbook))
+                        except Exception as e:
+                            errors.append(f"{source}: {e}")
+        except Exception as e:
+            errors.append(f"{name}: {e}")
+        if progress:
+            progress(name, done, len(files))
+
+    if not frames:
+        return None, errors
+    return concat_frames(frames), errors
+
+
+# Número de linhas lidas de cada vez no modo streaming
+STREAM_CHUNK_ROWS = 50_000
+
+
+def is_csv(name):
+    return name.lower().endswith('.csv')
+
+
+def csv_separator(source):
+    """Separador de um CSV (caminho ou ficheiro binário): ';' ou ',', pelo cabeçalho."""
+    if hasattr(source, 'readline'):
+        first_line = source.readline().decode('utf-8-sig', errors='replace')
+        source.seek(0)
+    else:
+        with open(source, encoding='utf-8-sig', errors='replace') as f:
+            first_line = f.readline()
+    return ';' if first_line.count(';') > first_line.count(',') else ','
+
+
+def iter_csv_chunks(source, chunksize=STREAM_CHUNK_ROWS):
+    """Ler um CSV (caminho ou ficheiro binário) em blocos, com todas as colunas como texto."""
+    yield from pd.read_csv(source, sep=csv_separator(source), dtype=str, encoding='utf-8-sig', chunksize=chunksize)
+
+
+def iter_excel_chunks(source, chunksize=STREAM_CHUNK_ROWS):
+    """Ler a primeira folha de um livro .xlsx em blocos, com o openpyxl em modo read-only."""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = [str(col) if col is not None else f"Unnamed: {i}" for i, col in enumerate(next(rows))]
+        batch = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            batch.append(row[:len(header)])
+            if len(batch) == chunksize:
+                yield pd.DataFrame(batch, columns=header)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=header)
+    finally:
+        workbook.close()
+
+
+# Colunas sempre guardadas como texto no modo streaming (as datas ficam no formato do ficheiro)
+STREAM_TEXT_COLUMNS = frozenset({'Data Colheita'})
+
+
+class _NumericColumnChanged(Exception):
+    """Uma coluna gravada como numérica nos primeiros blocos tem texto num bloco seguinte."""
+
+    def __init__(self, column):
+        super().__init__(column)
+        self.column = column
+
+
+def _typed_chunk(chunk, schema, text_columns):
+    """Dar a um bloco os tipos finais: Categorical nas colunas descritivas e de antibióticos, números nas
+    colunas só com números e texto nas restantes.
+
+    Com `schema` (o do primeiro bloco) cada coluna segue o tipo já gravado.
+    """
+    import pyarrow as pa
+    antibiotics = set(detect_antibiotic_columns(chunk))
+    for col in chunk.columns:
+        values = chunk[col]
+        if col in antibiotics:
+            chunk[col] = normalise_results(values)
+        elif col in CATEGORICAL_COLUMNS:
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                chunk[col] = _as_text(values.astype(object)).astype('category')
+        elif col in text_columns or (schema is not None and pa.types.is_string(schema.field(col).type)):
+            chunk[col] = _as_text(values.astype(object))
+        else:
+            try:
+                chunk[col] = pd.to_numeric(values).astype(float)
+            except (ValueError, TypeError):
+                if schema is not None:
+                    raise _NumericColumnChanged(col)
+                chunk[col] = _as_text(values.astype(object))
+    return chunk
+
+
+def _stream_schema(chunk, metadata):
+    """Esquema Arrow do ficheiro a partir do primeiro bloco já com os tipos finais."""
+    import pyarrow as pa
+    def arrow_type(values):
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            return pa.dictionary(pa.int32(), pa.string())
+        return pa.float64() if values.dtype.kind == 'f' else pa.string()
+    return pa.schema([(col, arrow_type(chunk[col])) for col in chunk.columns], metadata=metadata)
+
+
+def _stream_batch(chunk, schema, dictionaries):
+    """Tabela Arrow de um bloco; os dicionários das colunas Categorical acumulam as categorias de todos os
+    blocos (as novas no fim), para serem gravados como deltas do anterior."""
+    import pyarrow as pa
+    arrays = []
+    for field in schema:
+        values = chunk[field.name]
+        if pa.types.is_dictionary(field.type):
+            categories = values.cat.categories
+            known = dictionaries.get(field.name, pd.Index([], dtype=object))
+            known = known.append(categories.difference(known, sort=False))
+            dictionaries[field.name] = known
+            codes = np.append(known.get_indexer(categories), -1)[values.cat.codes]
+            arrays.append(pa.DictionaryArray.from_arrays(pa.array(codes, mask=codes < 0, type=pa.int32()),
+                                                         pa.array(known.astype(str), type=pa.string())))
+        else:
+            arrays.append(pa.array(values, type=field.type, from_pandas=True))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def _finish_streamed(df):
+    """Acertar os tipos de uma cópia do modo streaming com os da leitura normal: vazios como NaN, inteiros
+    sem vazios como int64 e categorias ordenadas (as S/I/R primeiro nos antibióticos)."""
+    antibiotics = set(detect_antibiotic_columns(df))
+    for col in df.columns:
+        values = df[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            categories = list(values.cat.categories)
+            if col in antibiotics:
+                order = RESULT_CATEGORIES + sorted(set(categories) - set(RESULT_CATEGORIES))
+            else:
+                order = sorted(categories)
+            if categories != order:
+                df[col] = values.cat.reorder_categories(order)
+        elif values.dtype == object:
+            # o Arrow devolve None nos valores em falta; o read_excel usa NaN
+            df[col] = values.fillna(np.nan)
+        elif values.dtype.kind == 'f' and values.notna().all() and (values % 1 == 0).all():
+            df[col] = values.astype('int64')
+    return df
+
+
+def stream_to_store(source, name, store, key, chunksize=STREAM_CHUNK_ROWS, progress=None):
+    """Converter um CSV ou .xlsx na cópia colunar bloco a bloco, com memória limitada ao tamanho do bloco.
+
+    Cada bloco é normalizado (colunas e microorganismos) e escrito logo em disco já com os tipos finais
+    (colunas Categorical como dicionários do Arrow), para que a cópia seja carregada sem passar por texto.
+    Se uma coluna numérica nos primeiros blocos tiver texto num bloco seguinte, o ficheiro é convertido
+    de novo com essa coluna como texto. Devolve o número de linhas escritas.
+    """
+    text_columns = set(STREAM_TEXT_COLUMNS)
+    while True:
+        try:
+            return _stream_file(source, name, store, key, chunksize, progress, text_columns)
+        except _NumericColumnChanged as e:
+            text_columns.add(e.column)
+            source.seek(0)
+
+
+def _stream_file(source, name, store, key, chunksize, progress, text_columns):
+    import pyarrow as pa
+    chunks = iter_csv_chunks(source, chunksize) if is_csv(name) else iter_excel_chunks(source, chunksize)
+    path = store.path(key)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    private_dir(store.root)
+
+    sink = writer = schema = None
+    dictionaries = {}
+    rows = 0
+    try:
+        for chunk in chunks:
+            chunk = normalise_columns(chunk)
+            chunk['Microorganismo'] = map_organisms(chunk['Microorganismo'])
+            chunk[SOURCE_COLUMN] = name
+            chunk = _typed_chunk(chunk, schema, text_columns)
+            if writer is None:
+                schema = _stream_schema(chunk, {
+                    'resis.schema_version': str(STORE_SCHEMA_VERSION),
+                    'resis.source_sha256': key,
+                    'resis.streamed': '2',
+                })
+                sink = pa.OSFile(tmp_path, 'wb')
+                writer = pa.ipc.new_file(sink, schema, options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+            writer.write_table(_stream_batch(chunk, schema, dictionaries))
+            rows += len(chunk)
+            if progress:
+                progress(f"{name}: {rows} linhas", rows)
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            sink.close()
+            os.remove(tmp_path)
+        raise
+    if writer is None:
+        raise ValueError(f"{name} não tem dados")
+    writer.close()
+    sink.close()
+    publish_file(tmp_path, path)
+    store.prune(keep={key})
+    return rows
+
+
+@TIMINGS.stage
+def stream_files(files, store, progress=None):
+    """Ler ficheiros grandes pelo modo streaming, um de cada vez, e juntar as cópias colunares.
+
+    `files` é uma lista de (nome, ficheiro binário, hash). Os .xls (não suportados pelo openpyxl)
+    são lidos da forma habitual. Devolve (df, erros) como read_workbooks.
+    """
+    frames = []
+    errors = []
+    for done, (name, source, key) in enumerate(files, start=1):
+        df = store.load(key)
+        if df is None:
+            try:
+                if name.lower().endswith('.xls'):
+                    df, read_errors = read_workbooks([(name, source.read())])
+                    errors.extend(read_errors)
+                    if df is not None:
+                        store.save(key, df)
+                else:
+                    stream_to_store(source, name, store, key,
+                                    progress=lambda text, rows: progress(text, done - 1, len(files)) if progress else None)
+                    df = store.load(key)
+            except Exception as e:
+                errors.append(f"{name}: {e}")
+                continue
+        if df is not None:
+            frames.append(df)
+        if progress:
+            progress(name, done, len(files))
+
+    if not frames:
+        return None, errors
+    return concat_frames(frames), errors
+
+
+#Código separado em definitions para facilitar o processo e entrecruzamento na seleção de páginas
+#Primeiro definição de constantes e de informações relevantes
+RELEVANT_MICROORGANISMS = [
+    "Acinetobacter baumannii", "Citrobacter species", "Enterobacter species",
+    "Escherichia coli", "Klebsiella oxytoca", "Klebsiella pneumoniae",
+    "Morganella morganii", "Pseudomonas aeruginosa", "Proteus mirabilis",
+    "Serratia marcescens", "Salmonella species", "Providencia species",
+    "Haemophilus influenzae", "Enterococcus faecalis", "Enterococcus faecium",
+    "Streptococcus agalactiae", "Staphylococcus aureus", "Staphylococcus epidermidis",
+    "Streptococcus pneumoniae", "Staphylococcus saprophyticus"
+]
+
+GRAM_POSITIVO = [
+    "Enterococcus faecalis", "Enterococcus faecium", "Streptococcus agalactiae",
+    "Staphylococcus aureus", "Staphylococcus epidermidis", "Streptococcus pneumoniae",
+    "Staphylococcus saprophyticus"
+]
+
+GRAM_NEGATIVO = [
+    "Acinetobacter baumannii", "Citrobacter species", "Enterobacter species",
+    "Escherichia coli", "Klebsiella oxytoca", "Klebsiella pneumoniae",
+    "Morganella morganii", "Pseudomonas aeruginosa", "Proteus mirabilis",
+    "Serratia marcescens", "Salmonella species", "Providencia species",
+    "Haemophilus influenzae"
+]
+
+
+eskape_microorganisms = ["Enterococcus faecium", "Staphylococcus aureus", "Klebsiella pneumoniae", 
+                             "Acinetobacter baumannii", "Pseudomonas aeruginosa", "Enterobacter spp."]
+
+CARBAPENEMES = [
+    'Imipenem',
+    'Meropenem',
+    'Ertapenem',
+    'Doripenem'
+]
+
+MRSA = [
+    'Vancomicina',
+    'Linezolid',
+    'Daptomicina',
+    'Ceftarolina',
+    'Tigeciclina'
+]
+
+POLIMIXINAS = [
+    'Polimixina B',
+    'Colistina']
+
+CEFALOSPORINAS_3A_4A = [
+    'Cefotaxima',
+    'Ceftriaxona',
+    'Ceftazidima',
+    'Cefepima'
+]
+
+AMOXICILINA_ACIDO_CLAVULANICO = [
+    'Amoxicilina + Ácido clavulânico',
+    'Amoxicilina'
+]
+
+FLUOROQUINOLONAS = [
+    'Ciprofloxacina',
+    'Levofloxacina',
+    'Moxifloxacina']
+
+FLUOROQUINOLONAS = [
+    'Ciprofloxacina',
+    'Levofloxacina',
+    'Moxifloxacina'
+]
+
+AMINOGLICOSIDEOS = [
+    'Amicacina',
+    'Gentamicina',
+    'Gentamicina (alta concentr.)',
+    'Tobramicina'
+]
+
+BETA_LACTAMICOS_INIBIDORES = [
+    'Amoxicillina/Ac. Clavulânico',
+    'Ampicillina/sulbactam',
+    'Piperacillina/Tazobactam',
+    'Ceftolozane/Tazobactam',
+    'Ceftazidime/Avibactam',
+    'Imipenem/Relebactam'
+]
+
+
+
+
+ANTIBIOTIC_CLASSES = {
+    "Aminoglicosídeos": ["Amicacina", "Gentamicina", "Gentamicina (alta concentr.)", "Tobramicina"],
+    "Beta-lactâmicos": ["Amoxicillina/Ac. Clavulânico", "Ampicillina", "Ampicillina/sulbactam", "Aztreonam",
+                        "Cefepima", "Cefotaxima", "Ceftazidima", "Ceftriaxona", "Cefuroxima", "Cefuroxima - Axetil",
+                        "Cefuroxima - Sódica", "Oxacillin MIC", "Oxacillina", "Penicillina", "Piperacillina/Tazobactam",
+                        "Imipenem", "Meropenem", "Ertapenem", "Ceftolozane/Tazobactam", "Ceftazidime/Avibactam",
+                        "Imipenem/Relebactam"],
+    "Glicopeptídeos": ["Teicoplanina", "Vancomicina"],
+    "Lincosamidas": ["Clindamicina"],
+    "Macrolídeos": ["Eritromicina"],
+    "Quinolonas": ["Ciprofloxacina", "Levofloxacina", "Moxifloxacina"],
+    "Sulfamidas": ["Cotrimoxazol"],
+    "Tetraciclinas": ["Tetraciclina", "Doxycycline"],
+    "Outros": ["Cloranfenicol", "Fosfomicina", "Ácido Fusídico", "Rifampicina", "Estreptomicina (alta concentr.)",
+               "Linezolid", "Tigeciclina", "Fluconazol", "Anfotericina B", "Mupirocina", "Colistina", "Caspofungina",
+               "Voricanazol", "Micafungina", "Etambutol", "Isoniazida", "Estreptomicina", "Pirazinamida", "Daptomicina"],
+    **{antibiotic: 'Carbapenemes' for antibiotic in CARBAPENEMES},
+    **{antibiotic: 'MRSA' for antibiotic in MRSA},
+    **{antibiotic: 'Polimixina' for antibiotic in POLIMIXINAS},
+    **{antibiotic: 'Cefalosporina (3ª/4ª Geração)' for antibiotic in CEFALOSPORINAS_3A_4A},
+    **{antibiotic: 'Amoxicilina/Ácido Clavulânico' for antibiotic in AMOXICILINA_ACIDO_CLAVULANICO},
+    **{antibiotic: 'Fluoroquinolona' for antibiotic in FLUOROQUINOLONAS}
+}
+
+# Classes usadas nos perfis de resistência, por ordem de prioridade: um antibiótico presente
+# em mais do que uma lista fica com a primeira classe
+ANTIBIOTIC_PROFILE_CLASSES = [
+    ('Carbapenemes', CARBAPENEMES),
+    ('MRSA', MRSA),
+    ('Polimixina', POLIMIXINAS),
+    ('Cefalosporina (3ª/4ª Geração)', CEFALOSPORINAS_3A_4A),
+    ('Amoxicilina/Ácido Clavulânico', AMOXICILINA_ACIDO_CLAVULANICO),
+    ('Fluoroquinolona', FLUOROQUINOLONAS),
+    ('Aminoglicosídeo', AMINOGLICOSIDEOS),
+    ('Beta-lactâmico com Inibidor de Beta-lactamase', BETA_LACTAMICOS_INIBIDORES),
+]
+
+# Índices construídos uma só vez: consulta em O(1) e aplicação com map sobre colunas inteiras
+GRAM_STAIN_INDEX = MappingProxyType({
+    **{organism: 'Gram-Negativo' for organism in GRAM_NEGATIVO},
+    **{organism: 'Gram-Positivo' for organism in GRAM_POSITIVO},
+})
+ANTIBIOTIC_CLASS_INDEX = MappingProxyType({
+    antibiotic: category
+    for category, antibiotics in reversed(ANTIBIOTIC_PROFILE_CLASSES)
+    for antibiotic in antibiotics
+})
+
+
+def observed_value_counts(series):
+    """value_counts sem as categorias que não aparecem nos dados."""
+    counts = series.value_counts()
+    return counts[counts > 0]
+
+
+def antibiotic_fingerprint(frame):
+    """Hash por linha dos resultados de antibióticos.
+
+    Duas linhas têm o mesmo hash quando os valores, convertidos em texto e com vazios iguais a '',
+    coincidem coluna a coluna (o mesmo critério da antiga junção com '_'). Cada coluna é
+    factorizada e só os valores únicos são convertidos em texto e hashed.
+    """
+    fingerprint = np.zeros(len(frame), dtype=np.uint64)
+    empty_hash = hash_array(np.array([''], dtype=object))
+    for _, col in frame.items():
+        codes, uniques = pd.factorize(col)
+        # O código -1 (vazio) aponta para o último elemento, o hash de ''
+        value_hashes = np.append(hash_array(np.asarray(uniques.astype(str), dtype=object)), empty_hash)
+        fingerprint = fingerprint * np.uint64(1099511628211) ^ value_hashes[codes]
+    return fingerprint
+
+
+def result_columns(df):
+    """Colunas dos resultados de antibióticos usadas para identificar duplicados (da 24ª em diante)."""
+    return df.iloc[:, 23:].drop(columns=[SOURCE_COLUMN], errors='ignore')
+
+
+def dedup_isolates(df):
+    """Ordenar, calcular a diferença de dias e separar os duplicados do mesmo processo e microorganismo."""
+    df.sort_values(by=['Nº Processo', 'Microorganismo', 'Data Colheita'], inplace=True)
+
+    # Calculando a diferença de dias entre as colheitas
+    df['Difference'] = df.groupby(['Nº Processo', 'Microorganismo'], observed=True)['Data Colheita'].diff().abs().dt.days
+
+    # Máscara para identificar duplicados
+    mask = (df['Difference'] <= 15) & df.duplicated(['Nº Processo', 'Microorganismo', 'Antibiotics'], keep=False)
+
+    # DataFrame de duplicados
+    df_duplicates = df.loc[mask]
+
+    # Mantendo apenas uma ocorrência de cada duplicado
+    # take em vez de drop_duplicates: o resultado é um DataFrame próprio (sem SettingWithCopyWarning
+    # quando se acrescentam colunas, p.ex. Gram_Stain)
+    keep = ~df.duplicated(subset=['Nº Processo', 'Microorganismo', 'Antibiotics', 'Data Colheita'], keep='first')
+    df_no_duplicates = df.take(np.flatnonzero(keep.to_numpy()))
+
+    return df_no_duplicates, df_duplicates
+
+
+@TIMINGS.stage
+def df_clean(df, report_error=logging.error):
+    """Limpar e dispor os dados retirando as colunas com informação privada, modificar as datas, disposição e expor filtros.
+
+    Em caso de erro chama `report_error` com a mensagem e devolve os dados sem limpeza.
+    """
+    try:
+        # Convertendo a coluna 'Data Colheita' para datetime
+        df['Data Colheita'] = pd.to_datetime(df['Data Colheita'], format='%d/%m/%Y', errors='coerce')
+
+        # Impressão digital dos resultados de antibióticos de cada isolado
+        df['Antibiotics'] = antibiotic_fingerprint(result_columns(df))
+
+        return dedup_isolates(df)
+    except Exception as e:
+        report_error(f"Erro durante a limpeza dos dados: {e}")
+        return df, pd.DataFrame()
+
+
+def _plain_index(index):
+    """Índice com os níveis Categorical em texto, para somar contagens de lotes com categorias diferentes."""
+    if isinstance(index, pd.MultiIndex):
+        return pd.MultiIndex.from_arrays([_plain_index(index.get_level_values(i)) for i in range(index.nlevels)],
+                                         names=index.names)
+    return index.astype(str) if isinstance(index, pd.CategoricalIndex) else index
+
+
+def add_count_table(table, delta):
+    """Somar uma tabela (ou série) de contagens de um lote novo à acumulada; células novas partem de zero."""
+    table, delta = table.copy(), delta.copy()
+    table.index, delta.index = _plain_index(table.index), _plain_index(delta.index)
+    return table.add(delta, fill_value=0).fillna(0).astype(int)
+
+
+def add_counts(counts, delta):
+    """Somar as contagens de resistência de um novo lote às contagens acumuladas."""
+    return tuple(add_count_table(table, part) for table, part in zip(counts, delta))
+
+
+def pair_hashes(frame):
+    """Hash do par Nº Processo/Microorganismo de cada linha (números comparados como float, como no isin)."""
+    pairs = frame[['Nº Processo', 'Microorganismo']].copy()
+    if pd.api.types.is_numeric_dtype(pairs['Nº Processo']):
+        pairs['Nº Processo'] = pairs['Nº Processo'].astype('float64')
+    return pd.util.hash_pandas_object(pairs, index=False).to_numpy()
+
+
+@TIMINGS.stage
+def new_dataset(df):
+    """Criar um conjunto acumulado a partir do primeiro ficheiro (já lido por read_data)."""
+    cleaned, duplicates = df_clean(df)
+    results = SparseResults(cleaned)
+    return {
+        'cleaned': cleaned,
+        'duplicates': duplicates,
+        # linhas removidas por serem cópias, necessárias para reavaliar a janela de 15 dias
+        'dropped': df.drop(index=cleaned.index),
+        'counts': resistance_counts(cleaned, results=results),
+        'cube': build_cube(cleaned, results),
+        'period_counts': period_counts(cleaned, results),
+    }
+
+
+@TIMINGS.stage
+def append_export(dataset, df):
+    """Juntar um novo ficheiro (já lido por read_data) a um conjunto acumulado.
+
+    A janela de 15 dias só é reavaliada nos pares Nº Processo/Microorganismo presentes no
+    novo ficheiro; as contagens de resistência, o cubo e as contagens mensais são atualizados
+    somando os do lote novo. Os dados limpos ficam com as linhas mantidas (`retained`, máscara
+    sobre os anteriores) seguidas das linhas reavaliadas (`appended`).
+    """
+    df['Data Colheita'] = pd.to_datetime(df['Data Colheita'], format='%d/%m/%Y', errors='coerce')
+    df['Antibiotics'] = antibiotic_fingerprint(result_columns(df))
+
+    # comparação por hash: uma colisão só faz reavaliar mais um par, com o mesmo resultado
+    new_pairs = np.unique(pair_hashes(df))
+    def affected(frame):
+        return np.isin(pair_hashes(frame), new_pairs)
+
+    cleaned, duplicates, dropped = dataset['cleaned'], dataset['duplicates'], dataset['dropped']
+    cleaned_affected, dropped_affected = affected(cleaned), affected(dropped)
+    boundary = cleaned[cleaned_affected]
+    n_existing = len(boundary) + dropped_affected.sum()
+
+    # linhas existentes primeiro: num empate ficam as já guardadas
+    combined = concat_frames([boundary, dropped[dropped_affected], df])
+    kept, boundary_duplicates = dedup_isolates(combined)
+    kept_new = kept[kept.index >= n_existing]
+    delta = SparseResults(kept_new)
+
+    return {
+        'cleaned': concat_frames([cleaned[~cleaned_affected], kept]),
+        'duplicates': concat_frames([duplicates[~affected(duplicates)], boundary_duplicates]),
+        'dropped': concat_frames([dropped[~dropped_affected], combined.drop(index=kept.index)]),
+        'counts': add_counts(dataset['counts'], resistance_counts(kept_new, results=delta)),
+        'cube': merge_cube(dataset['cube'], build_cube(kept_new, delta)),
+        'period_counts': add_counts(dataset['period_counts'], period_counts(kept_new, delta)),
+        'retained': ~cleaned_affected,
+        'appended': kept,
+    }
+
+
+def cleaning_summary(df, df_no_duplicates):
+    """Contagens antes e depois da remoção de duplicados."""
+    return {
+        'before_count': df.shape[0],
+        'after_count': df_no_duplicates.shape[0],
+        'unique_microorganisms_before': df['Microorganismo'].nunique(),
+        'unique_microorganisms_after': df_no_duplicates['Microorganismo'].nunique(),
+    }
+
+
+def gram_stains(organisms):
+    """Coloração Gram de uma coluna (ou índice) de microorganismos."""
+    return organisms.map(GRAM_STAIN_INDEX).fillna('Unknown')
+
+
+def antibiotic_classes(antibiotics):
+    """Classe de cada antibiótico de uma coluna."""
+    return antibiotics.map(ANTIBIOTIC_CLASS_INDEX).fillna('Outros')
+
+
+class SparseResults:
+    """Resultados dos antibióticos em formato longo esparso (COO): um registo (linha, antibiótico,
+    resultado) com códigos inteiros por cada teste realizado.
+
+    Criado uma vez na ingestão a partir dos códigos das colunas Categorical; as contagens de todas
+    as páginas saem daqui com np.bincount, sem percorrer as colunas largas. A memória cresce com o
+    número de testes e não com isolados × antibióticos.
+    """
+
+    def __init__(self, df):
+        self.n_rows = len(df)
+        self.antibiotics = pd.Index(detect_antibiotic_columns(df))
+        columns = [df[col].array if isinstance(df[col].dtype, pd.CategoricalDtype) else pd.Categorical(df[col])
+                   for col in self.antibiotics]
+        extra = sorted({str(value) for col in columns for value in col.categories} - set(RESULT_CATEGORIES))
+        self.categories = pd.Index(RESULT_CATEGORIES + extra)
+
+        antibiotic_dtype = np.min_scalar_type(max(len(self.antibiotics) - 1, 0))
+        rows, antibiotics, results = [], [], []
+        for i, col in enumerate(columns):
+            present = np.flatnonzero(col.codes >= 0)
+            remap = self.categories.get_indexer(col.categories.astype(str))
+            rows.append(present.astype(np.int32))
+            antibiotics.append(np.full(len(present), i, dtype=antibiotic_dtype))
+            results.append(remap[col.codes[present]].astype(np.int8))
+        self.rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int32)
+        self.antibiotic = np.concatenate(antibiotics) if antibiotics else np.empty(0, dtype=antibiotic_dtype)
+        self.result = np.concatenate(results) if results else np.empty(0, dtype=np.int8)
+
+    def extend(self, retained, other, antibiotics):
+        """Resultados de concat([df[retained], df_other]) a partir destes (de df) e dos de `other`, sem reler
+        as colunas: os testes das linhas retiradas saem e os restantes mudam de posição.
+
+        `antibiotics` são as colunas de antibióticos do conjunto concatenado.
+        """
+        new_rows = np.where(retained, np.cumsum(retained) - 1, -1).astype(np.int32)
+        offset = int(retained.sum())
+        kept = retained[self.rows]
+        combined = SparseResults.__new__(SparseResults)
+        combined.n_rows = offset + other.n_rows
+        combined.antibiotics = pd.Index(antibiotics)
+        labels = set(map(str, self.categories)) | set(map(str, other.categories))
+        combined.categories = pd.Index(RESULT_CATEGORIES + sorted(labels - set(RESULT_CATEGORIES)))
+        antibiotic_dtype = np.min_scalar_type(max(len(combined.antibiotics) - 1, 0))
+        parts = ((new_rows[self.rows[kept]], self.antibiotic[kept], self.result[kept], self),
+                 (other.rows + offset, other.antibiotic, other.result, other))
+        combined.rows = np.concatenate([rows.astype(np.int32) for rows, *_ in parts])
+        combined.antibiotic = np.concatenate([
+            combined.antibiotics.get_indexer(source.antibiotics)[antibiotic].astype(antibiotic_dtype)
+            for _, antibiotic, _, source in parts])
+        combined.result = np.concatenate([
+            combined.categories.get_indexer(source.categories.astype(str))[result].astype(np.int8)
+            for _, _, result, source in parts])
+        return combined
+
+    @property
+    def nbytes(self):
+        return self.rows.nbytes + self.antibiotic.nbytes + self.result.nbytes
+
+    def _selected(self, positions):
+        """Máscara dos testes das linhas `positions` (todos quando é None)."""
+        if positions is None:
+            return None
+        rows = np.zeros(self.n_rows, dtype=bool)
+        rows[positions] = True
+        return rows[self.rows]
+
+    def counts(self, keys, positions=None):
+        """Isolados testados e resistentes por grupo e antibiótico, como resistance_counts.
+
+        `keys` é uma Series (ou lista de Series) alinhada com as linhas do conjunto; com `positions`
+        só entram essas linhas. Devolve (tested, resistant, isolates).
+        """
+        keys = keys if isinstance(keys, list) else [keys]
+        if positions is not None:
+            keys = [key.iloc[positions] for key in keys]
+        groups = keys[0].groupby(keys, observed=True)
+        isolates = groups.size().rename(None)
+        group = groups.ngroup().to_numpy()
+        if group.dtype.kind == 'f':  # grupos com chave em falta
+            group = np.where(np.isnan(group), -1, group)
+        n_antibiotics = len(self.antibiotics)
+        size = len(isolates) * n_antibiotics
+        cell_dtype = np.int32 if size < 2 ** 31 else np.int64
+        row_group = np.full(self.n_rows, -1, dtype=cell_dtype)
+        row_group[slice(None) if positions is None else positions] = group
+
+        # célula (grupo × antibiótico) de cada teste; os testes de linhas sem grupo ficam de fora
+        cells = row_group[self.rows]
+        if positions is not None or (group < 0).any():
+            valid = cells >= 0
+            cells, result = cells[valid], self.result[valid]
+            cells *= n_antibiotics
+            cells += self.antibiotic[valid]
+        else:
+            result = self.result
+            cells *= n_antibiotics
+            cells += self.antibiotic
+        def table(counts):
+            return pd.DataFrame(counts.reshape(len(isolates), n_antibiotics), index=isolates.index,
+                                columns=self.antibiotics)
+        tested = table(np.bincount(cells, minlength=size))
+        resistant = table(np.bincount(cells[result == self.categories.get_loc(RESISTENTE)], minlength=size))
+        return tested, resistant, isolates
+
+    def result_counts(self, values, positions=None):
+        """Número de resultados iguais a cada um de `values` por antibiótico (colunas = valores)."""
+        selected = self._selected(positions)
+        antibiotic, result = (self.antibiotic, self.result) if selected is None else \
+            (self.antibiotic[selected], self.result[selected])
+        n_antibiotics = len(self.antibiotics)
+        return pd.DataFrame({
+            value: np.bincount(antibiotic[result == code], minlength=n_antibiotics) if code >= 0
+            else np.zeros(n_antibiotics, dtype=np.int64)
+            for value, code in zip(values, self.categories.get_indexer(values))
+        }, index=self.antibiotics)
+
+
+def resistance_counts(df, by='Microorganismo', results=None):
+    """Contar, numa só passagem, os isolados testados e resistentes por grupo e antibiótico.
+
+    Devolve (tested, resistant, isolates): duas tabelas grupo × antibiótico e o número de isolados por grupo.
+    `results` (SparseResults de `df`) evita reconstruir o formato esparso.
+    """
+    keys = [df[col] for col in by] if isinstance(by, list) else df[by]
+    return (results or SparseResults(df)).counts(keys)
+
+
+# Mínimo de isolados testados para apresentar uma percentagem (CLSI M39: 30); 0 ou 1 não suprime nada
+MIN_ISOLATES = int(os.environ.get("RESIS_MIN_ISOLATES", 30))
+
+
+def resistance_percentages(tested, resistant, isolates, min_isolates=MIN_ISOLATES):
+    """Percentagem de resistência (numérica) por Gram e microorganismo relevante, a partir das contagens.
+
+    As células com menos de `min_isolates` isolados testados ficam vazias.
+    """
+    relevant = [m for m in RELEVANT_MICROORGANISMS if m in tested.index]
+    tested = tested.loc[relevant]
+    percentages = (resistant.loc[relevant] / tested.where(tested >= max(min_isolates, 1)) * 100).round(1)
+    # só antibióticos e microorganismos com resultados
+    percentages = percentages.dropna(how='all', axis=1).dropna(how='all', axis=0)
+    if percentages.empty:
+        return pd.DataFrame()
+
+    organisms = percentages.index
+    percentages.index = pd.MultiIndex.from_arrays(
+        [gram_stains(organisms), [f"{m} (n={isolates.get(m, 0)})" for m in organisms]],
+        names=['Gram_Stain', 'Microorganismo'])
+    percentages.columns.name = 'Antibiotic'
+    return percentages.sort_index().sort_index(axis=1)
+
+
+def resistance_statistics(tested, resistant, min_isolates=MIN_ISOLATES):
+    """Tabela longa (microorganismo relevante × antibiótico testado) com os isolados testados e
+    resistentes, a percentagem e o IC 95% de Wilson, calculados de uma vez para todas as células.
+
+    Nas células com menos de `min_isolates` testados a percentagem e o intervalo ficam vazios.
+    """
+    relevant = [m for m in RELEVANT_MICROORGANISMS if m in tested.index]
+    n_tested = tested.loc[relevant].to_numpy(dtype=float)
+    n_resistant = resistant.loc[relevant].to_numpy(dtype=float)
+    lower, upper = wilson_interval(n_resistant, n_tested)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percentages = n_resistant / n_tested * 100
+    suppressed = n_tested < max(min_isolates, 1)
+
+    cells = n_tested.ravel() > 0
+    def column(values):
+        return np.where(suppressed, np.nan, values).ravel()[cells].round(1)
+    organisms = pd.Series(np.repeat(np.array(relevant, dtype=object), n_tested.shape[1])[cells])
+    return pd.DataFrame({
+        'Gram_Stain': gram_stains(organisms),
+        'Microorganismo': organisms,
+        'Antibiotic': np.tile(np.asarray(tested.columns, dtype=object), len(relevant))[cells],
+        'Testados': n_tested.ravel()[cells].astype(int),
+        'Resistentes': n_resistant.ravel()[cells].astype(int),
+        'Resistência (%)': column(percentages),
+        'IC 95% inf.': column(lower),
+        'IC 95% sup.': column(upper),
+        'Suprimido': suppressed.ravel()[cells],
+    })
+
+
+def format_resistance(percentages):
+    """Formatar as percentagens para apresentação (sem zeros decimais desnecessários)."""
+    return percentages.map(lambda x: '{:.1f}'.format(x).rstrip('0').rstrip('.') if pd.notnull(x) else x)
+
+
+def resistance_by_class(percentages):
+    """Tabela longa (Gram, microorganismo, antibiótico, classe, resistência) a partir das percentagens numéricas."""
+    if percentages.empty:
+        return pd.DataFrame(columns=['Gram_Stain', 'Microorganismo', 'Antibiotic', 'Class', 'Resistance'])
+    summary = percentages.reset_index().melt(id_vars=['Gram_Stain', 'Microorganismo'],
+                                             var_name='Antibiotic', value_name='Resistance')
+    summary = summary.dropna(subset=['Resistance'])
+    summary.insert(3, 'Class', antibiotic_classes(summary['Antibiotic']))
+    return summary.sort_values(['Class', 'Gram_Stain', 'Microorganismo', 'Antibiotic'], ignore_index=True)
+
+
+def gram_resistance_counts(df_cleaned, results=None):
+    """Contagens de resistance_counts por microorganismo; acrescenta a coluna Gram_Stain aos dados."""
+    df_cleaned.loc[:, 'Gram_Stain'] = gram_stains(df_cleaned['Microorganismo'])
+    return resistance_counts(df_cleaned, results=results)
+
+
+@TIMINGS.stage
+def resistance_table(df_cleaned, min_isolates=MIN_ISOLATES):
+    """Percentagens de resistência numéricas; acrescenta a coluna Gram_Stain aos dados."""
+    return resistance_percentages(*gram_resistance_counts(df_cleaned), min_isolates=min_isolates)
+
+
+def calculate_resistance(df_cleaned, min_isolates=MIN_ISOLATES):
+    percentages = resistance_table(df_cleaned, min_isolates)
+    if percentages.empty:
+        return percentages
+    return format_resistance(percentages)
+
+
+# Níveis do cubo de agregados usado na análise por Serviço e Produto
+CUBE_LEVELS = ['Serviço', 'Produto', 'Microorganismo']
+CUBE_PARTS = ('tested', 'resistant', 'isolates')
+
+
+@TIMINGS.stage
+def build_cube(df_cleaned, results=None):
+    """Contagens de testados/resistentes por (Serviço, Produto, Microorganismo) × antibiótico, calculadas uma vez.
+
+    Os serviços e produtos em falta ficam com a etiqueta 'Sem Identificação'; as listas ordenadas
+    dos seletores são guardadas com o cubo.
+    """
+    keys = [fill_missing_label(df_cleaned['Serviço']), fill_missing_label(df_cleaned['Produto']),
+            df_cleaned['Microorganismo']]
+    tested, resistant, isolates = (results or SparseResults(df_cleaned)).counts(keys)
+    return {'tested': tested, 'resistant': resistant, 'isolates': isolates, **cube_selectors(isolates)}
+
+
+def cube_selectors(isolates):
+    """Listas ordenadas dos serviços e dos produtos de cada serviço ('Total': todos) com isolados no cubo."""
+    cells = isolates.index.to_frame(index=False)[['Serviço', 'Produto']].astype(str)
+    products = cells.groupby('Serviço')['Produto'].agg(lambda p: sorted(p.unique())).to_dict()
+    products['Total'] = sorted(cells['Produto'].unique())
+    return {'services': sorted(cells['Serviço'].unique()), 'products': products}
+
+
+def merge_cube(cube, delta):
+    """Somar o cubo de um lote novo ao cubo acumulado."""
+    tested, resistant, isolates = (add_count_table(cube[part], delta[part]) for part in CUBE_PARTS)
+    return {'tested': tested, 'resistant': resistant, 'isolates': isolates, **cube_selectors(isolates)}
+
+
+def cube_slice(cube, service='Total', product='Total'):
+    """Somar as células do cubo de um serviço/produto ('Total' agrega todos) por microorganismo.
+
+    Devolve (tested, resistant, isolates) como resistance_counts.
+    """
+    index = cube['isolates'].index
+    mask = np.ones(len(index), dtype=bool)
+    if service != 'Total':
+        mask &= index.get_level_values('Serviço') == service
+    if product != 'Total':
+        mask &= index.get_level_values('Produto') == product
+    return tuple(
+        part[mask].groupby(level='Microorganismo', observed=True).sum()
+        for part in (cube['tested'], cube['resistant'], cube['isolates'])
+    )
+
+
+# Períodos disponíveis para as tendências (códigos de período do pandas)
+TREND_PERIODS = {'Mês': 'M', 'Trimestre': 'Q'}
+
+
+@TIMINGS.stage
+def period_counts(df_cleaned, results=None):
+    """Contagens mensais de testados/resistentes por (Microorganismo, Período) × antibiótico, numa só passagem.
+
+    As linhas sem Data Colheita não entram nas tendências.
+    """
+    keys = [df_cleaned['Microorganismo'], df_cleaned['Data Colheita'].dt.to_period('M').rename('Período')]
+    tested, resistant, _ = (results or SparseResults(df_cleaned)).counts(keys)
+    return tested, resistant
+
+
+def wilson_interval(resistant, tested, z=1.96):
+    """Intervalo de confiança de Wilson (em %) para a proporção resistant/tested; NaN quando tested é 0."""
+    resistant = np.asarray(resistant, dtype=float)
+    tested = np.asarray(tested, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = resistant / tested
+        denominator = 1 + z ** 2 / tested
+        centre = (p + z ** 2 / (2 * tested)) / denominator
+        half_width = z * np.sqrt(p * (1 - p) / tested + z ** 2 / (4 * tested ** 2)) / denominator
+    return np.clip((centre - half_width) * 100, 0, 100), np.clip((centre + half_width) * 100, 0, 100)
+
+
+def resistance_trend(counts, period='M', window=1, cumulative=False):
+    """Percentagem de resistência por microorganismo, período e antibiótico, com intervalo de confiança de 95%.
+
+    Parte das contagens mensais de period_counts: os trimestres são somas de meses e as janelas
+    móveis (ou acumuladas) são diferenças de somas acumuladas, sem voltar aos dados originais.
+    Devolve uma tabela longa com Testados, Resistentes, Resistência (%) e os limites do intervalo.
+    """
+    tested, resistant = counts
+    if tested.empty:
+        return pd.DataFrame()
+
+    tables = []
+    for table in (tested, resistant):
+        organisms = table.index.get_level_values('Microorganismo')
+        periods = table.index.get_level_values('Período').asfreq(period)
+        table = table.groupby([organisms, periods], observed=True).sum()
+        # períodos sem isolados contam como zero para as janelas móveis
+        full_index = pd.MultiIndex.from_product(
+            [table.index.get_level_values('Microorganismo').unique(), pd.period_range(periods.min(), periods.max(), freq=period)],
+            names=['Microorganismo', 'Período'])
+        table = table.reindex(full_index, fill_value=0)
+        running = table.groupby(level='Microorganismo', observed=True).cumsum()
+        if not cumulative and window > 1:
+            shifted = running.groupby(level='Microorganismo', observed=True).shift(window).fillna(0)
+            running = running - shifted
+        elif not cumulative:
+            running = table
+        tables.append(running.reset_index().melt(id_vars=['Microorganismo', 'Período'], var_name='Antibiotic'))
+
+    # as duas tabelas têm o mesmo índice e as mesmas colunas, logo as linhas estão alinhadas
+    trend = tables[0].rename(columns={'value': 'Testados'})
+    trend['Resistentes'] = tables[1]['value']
+    trend = trend[trend['Testados'] > 0].astype({'Testados': int, 'Resistentes': int})
+    trend['Resistência (%)'] = (trend['Resistentes'] / trend['Testados'] * 100).round(1)
+    lower, upper = wilson_interval(trend['Resistentes'], trend['Testados'])
+    trend['IC 95% inf.'] = lower.round(1)
+    trend['IC 95% sup.'] = upper.round(1)
+    return trend.reset_index(drop=True)
+
+
+# Faixas da legenda de resistência: (cor, descrição)
+RESISTANCE_BANDS = [
+    ('lightblue', 'Menos de 40% de estirpes resistentes'),
+    ('lightgoldenrodyellow', '40% a 80% de estirpes resistentes'),
+    ('lightcoral', 'Mais de 80% de estirpes resistentes'),
+]
+
+
+def resistance_bands(percentages):
+    """Faixa de cada percentagem (0: <40%, 1: 40-80%, 2: >80%), NaN sem resultados."""
+    values = percentages.to_numpy(dtype=float)
+    bands = np.select([values < 40, values <= 80, values > 80], [0, 1, 2], default=np.nan)
+    return pd.DataFrame(bands, index=percentages.index, columns=percentages.columns)
+
+
+def fill_missing_label(col, label='Sem Identificação'):
+    """Substituir os valores em falta por uma etiqueta, mantendo o tipo Categorical."""
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        if label not in col.cat.categories:
+            col = col.cat.add_categories([label])
+        return col.fillna(label)
+    return col.fillna(label).astype(str)
+
+
+AGE_BAND_LABELS = [f'{i}-{i+9}' for i in range(0, 120, 10)]
+FILTER_DIMENSIONS = ['Microorganismo', 'Faixa Etária', 'Sexo', 'Serviço', 'Produto']
+
+
+def age_bands(ages):
+    """Faixa etária de 10 anos (0-9 ... 110-119) de cada idade."""
+    return pd.cut(pd.to_numeric(ages, errors='coerce'), bins=range(0, 121, 10), labels=AGE_BAND_LABELS, right=False)
+
+
+class FilterIndex:
+    """Índice invertido das dimensões de filtro: para cada valor, as posições (ordenadas) das suas linhas.
+
+    Construído uma vez na ingestão; uma combinação de filtros resolve-se juntando as posições dos
+    valores escolhidos em cada dimensão e intersetando as dimensões, a começar pela menor, sem
+    percorrer a tabela inteira.
+    """
+
+    def __init__(self, df, dimensions=FILTER_DIMENSIONS):
+        self.size = len(df)
+        self.age_band = age_bands(df['Idade']) if 'Faixa Etária' in dimensions else None
+        self.postings = {}
+        for dimension in dimensions:
+            col = self.age_band if dimension == 'Faixa Etária' else df[dimension]
+            codes, values = pd.factorize(col)
+            order = np.argsort(codes, kind='stable').astype(np.int32)
+            counts = np.bincount(codes[codes >= 0], minlength=len(values))
+            # os valores em falta (código -1) ficam no início e não entram no índice
+            order = order[len(codes) - counts.sum():]
+            self.postings[dimension] = dict(zip(values, np.split(order, np.cumsum(counts)[:-1])))
+
+    def extend(self, retained, other):
+        """Índice de concat([df[retained], df_other]) a partir deste (de df) e do de `other`, sem reler as colunas."""
+        new_positions = np.where(retained, np.cumsum(retained) - 1, -1).astype(np.int32)
+        offset = int(retained.sum())
+        index = FilterIndex.__new__(FilterIndex)
+        index.size = offset + other.size
+        index.age_band = None if self.age_band is None else \
+            pd.concat([self.age_band[retained], other.age_band], ignore_index=True)
+        index.postings = {}
+        for dimension, postings in self.postings.items():
+            merged = {}
+            for value, positions in postings.items():
+                # a renumeração mantém a ordem, logo as posições continuam ordenadas
+                positions = new_positions[positions]
+                positions = positions[positions >= 0]
+                if len(positions):
+                    merged[value] = positions
+            for value, positions in other.postings[dimension].items():
+                positions = positions + np.int32(offset)
+                merged[value] = np.concatenate([merged[value], positions]) if value in merged else positions
+            index.postings[dimension] = merged
+        return index
+
+    def positions(self, dimension, values):
+        """Posições das linhas com algum dos `values` na dimensão."""
+        postings = self.postings[dimension]
+        found = [postings[value] for value in values if value in postings]
+        if len(found) == 1:
+            return found[0]
+        return np.sort(np.concatenate(found)) if found else np.empty(0, dtype=np.int32)
+
+    def select(self, selection):
+        """Posições das linhas que cumprem todos os filtros {dimensão: valores}; None não filtra a dimensão."""
+        lists = sorted((self.positions(dimension, values) for dimension, values in selection.items()
+                        if values is not None), key=len)
+        if not lists:
+            return np.arange(self.size)
+        result = lists[0]
+        for other in lists[1:]:
+            if not len(result):
+                break
+            found = np.searchsorted(other, result)
+            result = result[other[np.minimum(found, len(other) - 1)] == result]
+        return result
+
+
+TABLE_PAGE_SIZES = [50, 200, 1000]
+
+
+def search_rows(df, query):
+    """Linhas com `query` (sem distinguir maiúsculas) em alguma coluna; nas categóricas compara só as categorias."""
+    query = query.casefold()
+    mask = np.zeros(len(df), dtype=bool)
+    for _, col in df.items():
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            hits = [i for i, value in enumerate(col.cat.categories) if query in str(value).casefold()]
+            mask |= np.isin(col.cat.codes.to_numpy(), hits)
+        else:
+            mask |= col.astype(str).str.casefold().str.contains(query, regex=False).to_numpy(dtype=bool)
+    return mask
+
+
+def sort_positions(col, ascending=True):
+    """Posições das linhas por ordem de `col` (valores em falta no fim); as categorias por ordem alfabética."""
+    col = col.reset_index(drop=True)
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        col = col.cat.set_categories(sorted(col.cat.categories, key=str))
+    try:
+        return col.sort_values(ascending=ascending, kind='stable', na_position='last').index.to_numpy()
+    except TypeError:  # tipos misturados numa coluna object
+        return col.astype(str).sort_values(ascending=ascending, kind='stable').index.to_numpy()
+
+
+def table_page(df, page=1, page_size=TABLE_PAGE_SIZES[0], sort_by=None, ascending=True, query=''):
+    """Filtrar, ordenar e cortar uma página de `df` no servidor.
+
+    Devolve (página, número de linhas depois do filtro); só a página é copiada. Uma página
+    para além do fim dá a última página.
+    """
+    if query:
+        df = df[search_rows(df, query)]
+    page = min(max(page, 1), max(1, -(-len(df) // page_size)))
+    start = (page - 1) * page_size
+    if sort_by is None:
+        return df.iloc[start:start + page_size], len(df)
+    positions = sort_positions(df[sort_by], ascending)
+    return df.iloc[positions[start:start + page_size]], len(df)
+
+
+class LRUCache:
+    """Cache limitada com remoção do elemento usado há mais tempo (LRU) e contagem de hits/misses.
+
+    Com `max_bytes`, o tamanho de cada valor é medido por `sizeof` e os elementos mais antigos
+    saem também quando o total ultrapassa o limite; um valor maior que o limite não é guardado.
+    """
+
+    def __init__(self, max_entries, max_bytes=None, sizeof=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._sizes = {}
+        # partilhada entre sessões (st.cache_resource)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def peek(self, key):
+        """Valor guardado, sem contar como acesso (hits/misses e ordem inalterados)."""
+        with self._lock:
+            return self._entries.get(key)
+
+    def put(self, key, value):
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            self.bytes -= self._sizes.pop(key, 0)
+            self._entries.pop(key, None)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._entries[key] = value
+            self._sizes[key] = size
+            self.bytes += size
+            while len(self._entries) > self.max_entries or (self.max_bytes is not None and self.bytes > self.max_bytes):
+                old_key, _ = self._entries.popitem(last=False)
+                self.bytes -= self._sizes.pop(old_key)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries), 'max_entries': self.max_entries,
+                'bytes': self.bytes, 'max_bytes': self.max_bytes}
+
+
+# Número máximo de ficheiros processados mantidos em memória
+INGEST_CACHE_SIZE = 4
+
+# Figuras plotly já construídas mantidas em memória (número e tamanho total da especificação JSON)
+FIGURE_CACHE_SIZE = 256
+FIGURE_CACHE_MB = float(os.environ.get("RESIS_FIGURE_CACHE_MB", 64))
+
+
+# Incrementar quando a limpeza (df_clean, colunas acrescentadas) mudar: os conjuntos limpos partilhados
+# gravados por versões anteriores deixam de ser usados
+CLEAN_VERSION = 1
+
+
+def cleaned_key(digest):
+    """Chave dos dados limpos de um ficheiro: o hash do conteúdo, a versão da limpeza e a dos sinónimos."""
+    return f"{digest}.v{STORE_SCHEMA_VERSION}-{CLEAN_VERSION}.{get_normaliser().version}"
+
+
+def file_digest(uploaded_files):
+    """Hash SHA-256 do conteúdo dos ficheiros carregados (independente da ordem)."""
+    digests = sorted(hashlib.sha256(f.getvalue()).hexdigest() for f in uploaded_files)
+    if len(digests) == 1:
+        return digests[0]
+    return hashlib.sha256(''.join(digests).encode()).hexdigest()
+
+
+@TIMINGS.stage
+def load_data(uploaded_files, key, store=None, progress=None, streaming=False):
+    """Ler os dados da cópia colunar quando existe; caso contrário ler os livros Excel e guardar a cópia.
+
+    No modo streaming cada ficheiro é convertido bloco a bloco para a sua própria cópia colunar.
+    Devolve (df, erros); df é None se nenhuma folha puder ser lida.
+    """
+    if store is not None:
+        df = store.load(key)
+        if df is not None:
+            return df, []
+
+    if streaming:
+        files = []
+        for f in uploaded_files:
+            f.seek(0)
+            files.append((f.name, f, hashlib.sha256(f.getvalue()).hexdigest()))
+        return stream_files(files, store, progress)
+
+    df, errors = read_workbooks([(f.name, f.getvalue()) for f in uploaded_files], progress=progress)
+    if df is None or store is None:
+        return df, errors
+
+    try:
+        store.save(key, df)
+    except store_errors() as e:
+        logging.warning(f"Não foi possível guardar a cópia colunar: {e}")
+    return df, errors
+
+
+def store_errors():
+    """Exceções de escrita das cópias colunares (o pyarrow só é importado por quem usa as cópias)."""
+    import pyarrow as pa
+    return OSError, pa.ArrowException
+
+
+def share_frames(shared, key, frames):
+    """Gravar as partes no armazenamento partilhado e devolvê-las mapeadas em memória (sem cópia).
+
+    Se a gravação falhar, devolve as partes originais.
+    """
+    try:
+        shared.save(key, frames, frames['summary'])
+    except store_errors() as e:
+        logging.warning(f"Não foi possível partilhar o conjunto limpo: {e}")
+        return frames
+    return shared.open(key) or frames
+
+
+@TIMINGS.stage
+def ingest_file(uploaded_files, cache, store=None, progress=None, streaming=False, report_error=logging.error,
+                shared=None):
+    """Ler, limpar e calcular as resistências, reutilizando o resultado em cache para o mesmo conteúdo.
+
+    Com `shared` (SharedDatasetStore), os dados limpos por outra sessão ou processo são abertos
+    diretamente e os novos são gravados lá, ficando a entrada com vistas dos ficheiros mapeados.
+    A chave (cleaned_key) inclui as versões da limpeza e dos sinónimos, para não reutilizar dados
+    limpos com regras antigas.
+    """
+    digest = file_digest(uploaded_files)
+    # com sinónimos novos a chave muda e o ficheiro volta a ser limpo
+    key = cleaned_key(digest)
+    entry = cache.get(key)
+    if entry is not None:
+        return entry, None
+
+    frames = shared.open(key) if shared is not None else None
+    errors = []
+    if frames is None:
+        df, errors = load_data(uploaded_files, digest, store, progress, streaming)
+        if df is None:
+            return None, '; '.join(errors)
+
+        df_cleaned, df_duplicates = df_clean(df, report_error)
+        results = SparseResults(df_cleaned)
+        # a coluna Gram_Stain acrescentada aqui também fica no conjunto partilhado
+        counts = gram_resistance_counts(df_cleaned, results)
+        frames = {'df': df, 'df_cleaned': df_cleaned, 'df_duplicates': df_duplicates,
+                  'summary': cleaning_summary(df, df_cleaned)}
+        if shared is not None:
+            frames = share_frames(shared, key, frames)
+    else:
+        # a coluna Gram_Stain foi gravada com as partes; as partes abertas nunca são alteradas,
+        # porque outras sessões e as threads do pré-cálculo podem estar a lê-las
+        results = SparseResults(frames['df_cleaned'])
+        counts = resistance_counts(frames['df_cleaned'], results=results)
+
+    df, df_cleaned = frames['df'], frames['df_cleaned']
+    entry = {
+        'key': key,
+        'df': df,
+        'df_cleaned': df_cleaned,
+        'df_duplicates': frames['df_duplicates'],
+        'summary': frames['summary'],
+        'results': results,
+        'resistance_counts': counts,
+        'cube': build_cube(df_cleaned, results),
+        'trend_counts': period_counts(df_cleaned, results),
+        'filter_index': FilterIndex(df_cleaned),
+        'organism_index': FilterIndex(df, ['Microorganismo']),
+        'warnings': errors,
+    }
+    cache.put(key, entry)
+    return entry, None
+
+
+@TIMINGS.stage
+def dataset_state_key(name, sources):
+    """Chave do estado de um conjunto acumulado: o nome e os ficheiros de origem, pela ordem em que foram juntos."""
+    return f"{name}:{hashlib.sha256(json.dumps(sources).encode()).hexdigest()}"
+
+
+def ingest_incremental(uploaded_files, name, store, cache, progress=None, streaming=False):
+    """Juntar os ficheiros ao conjunto acumulado `name` (uma só vez por conteúdo) e devolver o conjunto atual.
+
+    A entrada em cache é a do estado do conjunto (todos os ficheiros de origem), não a do ficheiro
+    carregado: voltar a carregar um ficheiro já junto devolve o conjunto com os ficheiros juntos depois.
+    """
+    key = file_digest(uploaded_files)
+    sources = store.dataset_sources(name) or []
+    entry = cache.get(dataset_state_key(name, sources if key in sources else sources + [key]))
+    if entry is not None:
+        return entry, None
+
+    dataset = store.load_dataset(name)
+    if dataset is not None and ('cube' not in dataset or 'period_counts' not in dataset):
+        results = SparseResults(dataset['cleaned'])
+        dataset.update(cube=build_cube(dataset['cleaned'], results),
+                       period_counts=period_counts(dataset['cleaned'], results))
+    previous = None
+    if dataset is None or key not in dataset['sources']:
+        if dataset is not None:
+            # entrada do estado anterior ainda em memória: o índice e os resultados esparsos são estendidos
+            previous = cache.peek(dataset_state_key(name, dataset['sources']))
+            if previous is not None and previous.get('sources') != dataset['sources']:
+                previous = None
+        df, errors = load_data(uploaded_files, key, store, progress, streaming)
+        if df is None:
+            return None, '; '.join(errors)
+
+        rows_read = len(df)
+        organisms_read = set(df['Microorganismo'].dropna().astype(str))
+        if dataset is None:
+            updated = new_dataset(df)
+            sources, summary = [], {'before_count': 0, 'organisms_read': []}
+        else:
+            updated = append_export(dataset, df)
+            sources, summary = dataset['sources'], dataset['summary']
+
+        organisms_read.update(summary['organisms_read'])
+        dataset = dict(updated, sources=sources + [key], summary={
+            'before_count': summary['before_count'] + rows_read,
+            'after_count': len(updated['cleaned']),
+            'unique_microorganisms_before': len(organisms_read),
+            'unique_microorganisms_after': updated['cleaned']['Microorganismo'].nunique(),
+            'organisms_read': sorted(organisms_read),
+        })
+        try:
+            store.save_dataset(name, dataset)
+        except store_errors() as e:
+            logging.warning(f"Não foi possível guardar o conjunto acumulado {name}: {e}")
+
+    if previous is not None and 'retained' in dataset:
+        appended = dataset['appended']
+        results = previous['results'].extend(dataset['retained'], SparseResults(appended),
+                                              detect_antibiotic_columns(dataset['cleaned']))
+        filter_index = previous['filter_index'].extend(dataset['retained'], FilterIndex(appended))
+    else:
+        results = SparseResults(dataset['cleaned'])
+        filter_index = FilterIndex(dataset['cleaned'])
+    cache_key = dataset_state_key(name, dataset['sources'])
+    entry = {
+        'key': cache_key,
+        'sources': dataset['sources'],
+        'df': dataset['cleaned'],
+        'df_cleaned': dataset['cleaned'],
+        'df_duplicates': dataset['duplicates'],
+        'summary': dataset['summary'],
+        'results': results,
+        'resistance_counts': dataset['counts'],
+        'cube': dataset['cube'],
+        'trend_counts': dataset['period_counts'],
+        'filter_index': filter_index,
+        'organism_index': filter_index,
+        'warnings': [],
+    }
+    cache.put(cache_key, entry)
+    return entry, None
+
+
+# Grupos de microorganismos das opções da página de distribuição
+DISTRIBUTION_GROUPS = MappingProxyType({
+    'Gram-positivo': GRAM_POSITIVO,
+    'Gram-negativo': GRAM_NEGATIVO,
+    'ESKAPE': RELEVANT_MICROORGANISMS,
+})
+# Opções fixas da página de distribuição (as restantes são as colunas do ficheiro)
+DISTRIBUTION_OPTIONS = ['Microorganismo', *DISTRIBUTION_GROUPS, 'Sexo', 'Idade']
+
+
+def distribution_aggregates(df_cleaned, groupby_column, groups=DISTRIBUTION_GROUPS, results=None):
+    """Agregados da página de distribuição para uma opção: contagem por grupo, número de resultados
+    resistentes/sensíveis por antibiótico e isolados testados/resistentes por microorganismo e antibiótico.
+
+    As contagens por antibiótico saem de `results` (SparseResults de `df_cleaned`).
+    """
+    if groupby_column == 'Microorganismo':
+        positions = None
+    elif groupby_column in groups:
+        positions = np.flatnonzero(df_cleaned['Microorganismo'].isin(groups[groupby_column]))
+    else:
+        positions = np.flatnonzero(df_cleaned[groupby_column].notnull())
+
+    key = 'Microorganismo' if groupby_column == 'Microorganismo' or groupby_column in groups else groupby_column
+    column = df_cleaned[key] if positions is None else df_cleaned[key].iloc[positions]
+    data_counts = observed_value_counts(column).reset_index()
+    data_counts.columns = [key, 'Contagem']
+    results = results or SparseResults(df_cleaned)
+    tested, resistant, _ = results.counts(df_cleaned['Microorganismo'], positions)
+    return {
+        'data_counts': data_counts,
+        'result_counts': results.result_counts([RESISTENTE, SENSIVEL], positions),
+        'tested': tested,
+        'resistant': resistant,
+    }
+
+
+def demographic_counts(df_cleaned, by):
+    """Isolados por `by` (Sexo ou Idade): no total, por microorganismo, e o total de cada microorganismo."""
+    return {
+        'all': df_cleaned.groupby(by, observed=True).size(),
+        'by_organism': df_cleaned.groupby(['Microorganismo', by], observed=True).size(),
+        'organisms': df_cleaned.groupby('Microorganismo', observed=True).size(),
+    }
+
+
+def organism_summary(df_cleaned):
+    """Por microorganismo: número de casos e o serviço e o produto mais frequentes, com os casos de cada um."""
+    summary = df_cleaned.groupby('Microorganismo', observed=True).size().to_frame('Casos')
+    for col in ('Serviço', 'Produto'):
+        if col not in df_cleaned.columns:
+            continue
+        counts = df_cleaned.groupby(['Microorganismo', col], observed=True).size()
+        # em caso de empate fica o primeiro valor, como em Series.mode
+        top = counts.groupby(level='Microorganismo', observed=True).idxmax()
+        summary[col] = pd.Series([value for _, value in top], index=top.index)
+        summary[f'Casos ({col})'] = pd.Series(counts.loc[top.to_list()].to_numpy(), index=top.index)
+    return summary
+
+
+class PageAggregates:
+    """Agregados das páginas calculados em segundo plano (thread pool) e memorizados pelo nome.
+
+    `get` devolve o resultado já calculado, espera pelo cálculo em curso ou, se ainda estiver na fila,
+    calcula-o logo na thread que o pede: a página que está no ecrã passa à frente das restantes.
+    Sem executor, `get` calcula e memoriza na primeira chamada.
+    """
+
+    def __init__(self, executor=None):
+        self._executor = executor
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def submit(self, name, func, *args):
+        with self._lock:
+            if name not in self._futures and self._executor is not None:
+                self._futures[name] = self._executor.submit(func, *args)
+
+    def get(self, name, func, *args):
+        with self._lock:
+            future = self._futures.get(name)
+            inline = future is None or future.cancel()
+            if inline:
+                future = self._futures[name] = Future()
+                future.set_running_or_notify_cancel()
+        if inline:
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+    def progress(self):
+        """(concluídos, total) dos agregados pedidos."""
+        with self._lock:
+            futures = list(self._futures.values())
+        return sum(future.done() for future in futures), len(futures)
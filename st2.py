@@ -1,17 +1,10 @@
 import os
 import sys
-import subprocess
-import webbrowser
+import json
 import time
-import requests
-import socket
-import psutil
-import streamlit as st
-import pandas as pd
-import plotly.express as px
-import matplotlib.pyplot as plt
-import numpy as np
 import logging
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -27,332 +20,272 @@ def resource_path(relative_path):
 
     return os.path.join(base_path, relative_path)
 
-# Carregar  config.toml
-config_path = resource_path("config.toml")
-os.environ["STREAMLIT_CONFIG_FILE"] = config_path  
 # encontrar uma porta livre
 def find_free_port():
     """Find a free port automatically."""
+    import socket
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.bind(("", 0))  
         return s.getsockname()[1]
 
-STREAMLIT_PORT = find_free_port()
-STREAMLIT_URL = f"http://localhost:{STREAMLIT_PORT}"
-
-def is_port_in_use(port):
-    """Check if a specific port is already in use."""
+def is_port_in_use(port, timeout=0.1):
+    """Check if a server accepts connections on the port (connect with a short timeout, no HTTP request)."""
+    import socket
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        return s.connect_ex(('localhost', port)) == 0
+        s.settimeout(timeout)
+        return s.connect_ex(('127.0.0.1', port)) == 0
 
 
-def is_streamlit_running():
-    """Check if Streamlit is already running using psutil."""
-    for proc in psutil.process_iter(attrs=['pid', 'name', 'cmdline']):
-        try:
-            cmdline = proc.info.get('cmdline')
-            if cmdline and 'streamlit' in cmdline:
-                return True
-        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-            continue
-    return False
+# Ficheiro de bloqueio por utilizador com a porta e o PID da instância em execução
+LOCK_FILE = os.environ.get("RESIS_LOCK_FILE", os.path.join(os.path.expanduser("~"), ".resis", "st2.lock"))
+# segundos até o servidor aceitar ligações; o orçamento conta desde o início do processo (inclui o
+# desempacotamento da versão PyInstaller)
+STARTUP_TIMEOUT = 30
+COLD_START_BUDGET = float(os.environ.get("RESIS_COLD_START_BUDGET", 8))
 
 
-def open_browser_once():
-    """Opens the browser only once after the server is ready."""
-    try:
-        # tempo para servidor iniciar (máximo de 15 segundos)
-        for _ in range(15):
-            try:
-                response = requests.get(STREAMLIT_URL)
-                if response.status_code == 200:
-                    webbrowser.open(STREAMLIT_URL, new=2)  
-                    logging.info("Navegador aberto com sucesso.")
-                    return
-            except requests.ConnectionError:
-                time.sleep(1)  
-        logging.warning(f"Servidor não está pronto a tempo. Aceda manualmente: {STREAMLIT_URL}")
-    except Exception as e:
-        logging.error(f"Erro ao abrir o navegador: {e}")
+def wait_until(condition, timeout=STARTUP_TIMEOUT):
+    """Repetir `condition` com intervalos crescentes (0,05 s a 1 s) até devolver um valor ou acabar o tempo."""
+    deadline = time.monotonic() + timeout
+    delay = 0.05
+    while True:
+        result = condition()
+        if result or time.monotonic() >= deadline:
+            return result
+        time.sleep(delay)
+        delay = min(delay * 2, 1.0)
 
-#  evitar múltiplas janelas
-if __name__ == "__main__":
-    if not is_streamlit_running():
-        # Iniciar  Streamlit
-        subprocess.Popen(
-            [sys.executable, "-m", "streamlit", "run", os.path.abspath(__file__), "--server.port", str(STREAMLIT_PORT)]
-        )
-        open_browser_once()
-    else:
-        logging.info("O Streamlit já está em execução. Não é necessário iniciar outra instância.")
-        
-#Código separado em definitions para facilitar o processo e entrecruzamento na seleção de páginas
-#Primeiro definição de constantes e de informações relevantes
-RELEVANT_MICROORGANISMS = [
-    "Acinetobacter baumannii", "Citrobacter species", "Enterobacter species",
-    "Escherichia coli", "Klebsiella oxytoca", "Klebsiella pneumoniae",
-    "Morganella morganii", "Pseudomonas aeruginosa", "Proteus mirabilis",
-    "Serratia marcescens", "Salmonella species", "Providencia species",
-    "Haemophilus influenzae", "Enterococcus faecalis", "Enterococcus faecium",
-    "Streptococcus agalactiae", "Staphylococcus aureus", "Staphylococcus epidermidis",
-    "Streptococcus pneumoniae", "Staphylococcus saprophyticus"
-]
-
-GRAM_POSITIVO = [
-    "Enterococcus faecalis", "Enterococcus faecium", "Streptococcus agalactiae",
-    "Staphylococcus aureus", "Staphylococcus epidermidis", "Streptococcus pneumoniae",
-    "Staphylococcus saprophyticus"
-]
-
-GRAM_NEGATIVO = [
-    "Acinetobacter baumannii", "Citrobacter species", "Enterobacter species",
-    "Escherichia coli", "Klebsiella oxytoca", "Klebsiella pneumoniae",
-    "Morganella morganii", "Pseudomonas aeruginosa", "Proteus mirabilis",
-    "Serratia marcescens", "Salmonella species", "Providencia species",
-    "Haemophilus influenzae"
-]
-
-# Original list of antibiotics
-ANTIBIOTICS = [
-    "Amicacina", "Amoxicillina/Ac. Clavulânico", "Ampicillina", "Ampicillina/sulbactam",
-    "Aztreonam", "Cefepima", "Cefotaxima", "Ceftazidima", "Ceftriaxone", "Cefuroxima",
-    "Cefuroxima - Axetil", "Cefuroxima - Sódica", "Cloranfenicol", "Ciprofloxacina",
-    "Clindamicina", "Doxycycline", "Eritromicina", "Fosfomicina", "Ácido Fusídico",
-    "Gentamicina", "Gentamicina (alta concentr.)", "Imipenem", "Meropenem",
-    "Nitrofurantoína", "Oxacillin MIC", "Penicillina", "Piperacillina/Tazobactam",
-    "Rifampicina", "Estreptomicina (alta concentr.)", "Teicoplanina", "Tetraciclina",
-    "Tobramicina", "Cotrimoxazol", "Vancomicina", "Levofloxacina",
-    "Quinupristina/Dalfopristina", "Oxacillina", "Mupirocina", "Linezolid",
-    "Tigeciclina", "Ertapenem", "Fluconazol", "Anfotericina B", "Amoxicilina",
-    "Moxifloxacina", "ESBL", "Beta Lactamase", "Colistina", "Caspofungina",
-    "Voricanazol", "Micafungina", "Benzylpenicilina", "Ceftolozane/Tazobactam",
-    "Etambutol", "Isoniazida", "Estreptomicina", "Pirazinamida", "Daptomicina",
-    "ESBL (Neg)", "tericin B", "Ceftazidime/Avibactam",
-    "Amoxicillina/Ac. Clavulânico (oral)", "Amoxicillina/Ac. Clavulânico (intravenoso)",
-    "Gentamicina (tópico)", "Imipenem/Relebactam"
-]
-
-# mudar "Amphotericin B" com "Anfotericina"
-ANTIBIOTICS = ["Anfotericina B" if ab == "Amphotericin B" else ab for ab in ANTIBIOTICS]
-
-
-eskape_microorganisms = ["Enterococcus faecium", "Staphylococcus aureus", "Klebsiella pneumoniae", 
-                             "Acinetobacter baumannii", "Pseudomonas aeruginosa", "Enterobacter spp."]
-
-CARBAPENEMES = [
-    'Imipenem',
-    'Meropenem',
-    'Ertapenem',
-    'Doripenem'
-]
-
-MRSA = [
-    'Vancomicina',
-    'Linezolid',
-    'Daptomicina',
-    'Ceftarolina',
-    'Tigeciclina'
-]
-
-POLIMIXINAS = [
-    'Polimixina B',
-    'Colistina']
-
-CEFALOSPORINAS_3A_4A = [
-    'Cefotaxima',
-    'Ceftriaxona',
-    'Ceftazidima',
-    'Cefepima'
-]
-
-AMOXICILINA_ACIDO_CLAVULANICO = [
-    'Amoxicilina + Ácido clavulânico',
-    'Amoxicilina'
-]
-
-FLUOROQUINOLONAS = [
-    'Ciprofloxacina',
-    'Levofloxacina',
-    'Moxifloxacina']
-
-FLUOROQUINOLONAS = [
-    'Ciprofloxacina',
-    'Levofloxacina',
-    'Moxifloxacina'
-]
-
-AMINOGLICOSIDEOS = [
-    'Amicacina',
-    'Gentamicina',
-    'Gentamicina (alta concentr.)',
-    'Tobramicina'
-]
-
-BETA_LACTAMICOS_INIBIDORES = [
-    'Amoxicillina/Ac. Clavulânico',
-    'Ampicillina/sulbactam',
-    'Piperacillina/Tazobactam',
-    'Ceftolozane/Tazobactam',
-    'Ceftazidime/Avibactam',
-    'Imipenem/Relebactam'
-]
-
-
-
-
-ANTIBIOTIC_CLASSES = {
-    "Aminoglicosídeos": ["Amicacina", "Gentamicina", "Gentamicina (alta concentr.)", "Tobramicina"],
-    "Beta-lactâmicos": ["Amoxicillina/Ac. Clavulânico", "Ampicillina", "Ampicillina/sulbactam", "Aztreonam",
-                        "Cefepima", "Cefotaxima", "Ceftazidima", "Ceftriaxona", "Cefuroxima", "Cefuroxima - Axetil",
-                        "Cefuroxima - Sódica", "Oxacillin MIC", "Oxacillina", "Penicillina", "Piperacillina/Tazobactam",
-                        "Imipenem", "Meropenem", "Ertapenem", "Ceftolozane/Tazobactam", "Ceftazidime/Avibactam",
-                        "Imipenem/Relebactam"],
-    "Glicopeptídeos": ["Teicoplanina", "Vancomicina"],
-    "Lincosamidas": ["Clindamicina"],
-    "Macrolídeos": ["Eritromicina"],
-    "Quinolonas": ["Ciprofloxacina", "Levofloxacina", "Moxifloxacina"],
-    "Sulfamidas": ["Cotrimoxazol"],
-    "Tetraciclinas": ["Tetraciclina", "Doxycycline"],
-    "Outros": ["Cloranfenicol", "Fosfomicina", "Ácido Fusídico", "Rifampicina", "Estreptomicina (alta concentr.)",
-               "Linezolid", "Tigeciclina", "Fluconazol", "Anfotericina B", "Mupirocina", "Colistina", "Caspofungina",
-               "Voricanazol", "Micafungina", "Etambutol", "Isoniazida", "Estreptomicina", "Pirazinamida", "Daptomicina"],
-    **{antibiotic: 'Carbapenemes' for antibiotic in CARBAPENEMES},
-    **{antibiotic: 'MRSA' for antibiotic in MRSA},
-    **{antibiotic: 'Polimixina' for antibiotic in POLIMIXINAS},
-    **{antibiotic: 'Cefalosporina (3ª/4ª Geração)' for antibiotic in CEFALOSPORINAS_3A_4A},
-    **{antibiotic: 'Amoxicilina/Ácido Clavulânico' for antibiotic in AMOXICILINA_ACIDO_CLAVULANICO},
-    **{antibiotic: 'Fluoroquinolona' for antibiotic in FLUOROQUINOLONAS}
-}
-
-def read_data(uploaded_file):
-    """Ler e processar dados do Excel."""
+
+def read_lock():
+    """Conteúdo do ficheiro de bloqueio, ou None se não existir ou ainda estiver a ser escrito."""
     try:
-        df = pd.read_excel(uploaded_file)
+        with open(LOCK_FILE, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
 
-        COLUMN_MAPPING = {}
 
-        for col in df.columns:
-                if "Piperacillina" in col:
-                    COLUMN_MAPPING[col] = "Piperacillina/Tazobactam"
+def write_lock(info):
+    # escrita atómica: quem lê nunca vê o ficheiro a meio
+    temp = f"{LOCK_FILE}.{os.getpid()}.tmp"
+    with open(temp, 'w', encoding='utf-8') as f:
+        json.dump(info, f)
+    os.replace(temp, LOCK_FILE)
 
-                if "Ceftriax" in col:
-                    COLUMN_MAPPING[col] = "Ceftriaxona"
 
-        df.rename(columns=COLUMN_MAPPING, inplace=True)
-        # Limpeza dos nomes das colunas
-        df.columns = (df.columns.str.strip().str.replace(r'\s+', ' ', regex=True).str.replace(';', '', regex=False).str.replace('\n', '', regex=False))
-       
+def acquire_lock():
+    """Criar o ficheiro de bloqueio de forma atómica; False se outra instância já o tiver."""
+    os.makedirs(os.path.dirname(LOCK_FILE), exist_ok=True)
+    try:
+        os.close(os.open(LOCK_FILE, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600))
+    except FileExistsError:
+        return False
+    return True
 
-        sensitive_columns = ['Nº Benef.', 'Nº SNS', 'Data Nasc.', 'Nome']
-        df.drop(columns=sensitive_columns, errors='ignore', inplace=True)
 
-        name_mapping = {
-            r'Enterococcus faecium.*': 'Enterococcus faecium',
-            r'Enterococcus faecalis.*': 'Enterococcus faecalis',
-            r'Staphylococcus aureus.*': 'Staphylococcus aureus',
-            r'Staphylococcus epidermidis.*': 'Staphylococcus epidermidis',
-            r'Klebsiella pneumoniae.*': 'Klebsiella pneumoniae',
-            r'Escherichia coli.*': 'Escherichia coli',
-            r'Pseudomonas aeruginosa.*': 'Pseudomonas aeruginosa',
-            r'Acinetobacter baumannii.*': 'Acinetobacter baumannii',
-            r'Enterobacter.*': 'Enterobacter species',
-            r'Citrobacter.*': 'Citrobacter species',
-            r'Salmonella.*': 'Salmonella species',
-            r'Providencia.*': 'Providencia species',
-        }
+def lock_identity():
+    """Versão atual do ficheiro de bloqueio (inode e data de modificação), ou None se não existir."""
+    try:
+        stat = os.stat(LOCK_FILE)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
 
-        for pattern, replacement in name_mapping.items():
-            df['Microorganismo'] = df['Microorganismo'].str.replace(
-                pattern, replacement, regex=True, case=False
-            )
 
-        return df, None
+def take_over_lock(stale):
+    """Ficar com o bloqueio abandonado `stale` (a versão vista por `lock_identity`); False se outro lançador
+    o tiver substituído entretanto.
 
-    except Exception as e:
-        return None, str(e)
+    O ficheiro é primeiro movido para um nome só deste processo (só um lançador consegue movê-lo) e só é
+    apagado se ainda for a versão abandonada; um bloqueio novo movido por engano é reposto.
+    """
+    if stale is not None:
+        moved = f"{LOCK_FILE}.{os.getpid()}.stale"
+        try:
+            os.replace(LOCK_FILE, moved)
+        except FileNotFoundError:
+            pass
+        else:
+            stat = os.stat(moved)
+            if (stat.st_ino, stat.st_mtime_ns) != stale:
+                try:
+                    os.link(moved, LOCK_FILE)
+                except FileExistsError:
+                    pass
+                os.remove(moved)
+                return False
+            os.remove(moved)
+    return acquire_lock()
+
+
+def release_lock(pid):
+    """Apagar o ficheiro de bloqueio se ainda for o do servidor `pid`."""
+    lock = read_lock()
+    if lock is not None and lock['pid'] == pid:
+        try:
+            os.remove(LOCK_FILE)
+        except FileNotFoundError:
+            pass
 
 
-def df_clean(df):
-    """Limpar e dispor os dados retirando as colunas com informação privada, modificar as datas, disposição e expor filtros."""
-    try:
-        # Convertendo a coluna 'Data Colheita' para datetime
-        df['Data Colheita'] = pd.to_datetime(df['Data Colheita'], format='%d/%m/%Y', errors='coerce')
-        df.sort_values(by=['Nº Processo', 'Microorganismo', 'Data Colheita'], inplace=True)
-        
-        # Combinando colunas de antibióticos em uma única string
-        
-        df['Antibiotics'] = df.iloc[:, 23:].apply(lambda row: '_'.join(row.fillna('').astype(str)), axis=1
+def running_instance():
+    """URL da instância registada no ficheiro de bloqueio, esperando se ainda estiver a arrancar.
+
+    Devolve (url, None), ou (None, versão do bloqueio) quando está abandonado (processo terminado ou sem
+    resposta a tempo), para ser retomado com `take_over_lock`.
+    """
+    import psutil
+    seen = [None]
+
+    def check():
+        seen[0] = lock_identity()
+        lock = read_lock()
+        if lock is None:
+            try:
+                # ficheiro acabado de criar por outro lançador, ainda sem conteúdo
+                starting = time.time() - os.path.getmtime(LOCK_FILE) < STARTUP_TIMEOUT
+            except OSError:
+                return 'stale'
+            return None if starting else 'stale'
+        if not psutil.pid_exists(lock['pid']):
+            return 'stale'
+        if is_port_in_use(lock['port']):
+            return lock['url']
+        return None if time.time() - lock['started'] < STARTUP_TIMEOUT else 'stale'
+
+    result = wait_until(check)
+    return (result, None) if result and result != 'stale' else (None, seen[0])
+
+
+def launch():
+    """Iniciar o servidor Streamlit com esta aplicação e abrir o navegador (uma só instância por utilizador)."""
+    import subprocess
+    import webbrowser
+    import psutil
+    # Carregar  config.toml
+    os.environ["STREAMLIT_CONFIG_FILE"] = resource_path("config.toml")
+
+    if not acquire_lock():
+        url, stale = running_instance()
+        if url:
+            logging.info(f"O Streamlit já está em execução em {url}. Não é necessário iniciar outra instância.")
+            webbrowser.open(url, new=2)
+            return
+        # bloqueio abandonado por uma instância que terminou
+        if not take_over_lock(stale):
+            logging.error(f"Outra instância está a arrancar. Se não abrir, apague {LOCK_FILE}")
+            return
+
+    port = find_free_port()
+    url = f"http://localhost:{port}"
+    # Iniciar  Streamlit (sem abrir o navegador: é aberto abaixo, quando a porta responder)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", os.path.abspath(__file__),
+         "--server.port", str(port), "--server.headless", "true"]
+    )
+    write_lock({'pid': server.pid, 'port': port, 'url': url, 'started': time.time()})
+
+    ready = wait_until(lambda: is_port_in_use(port) or server.poll() is not None)
+    if server.poll() is not None:
+        release_lock(server.pid)
+        logging.error(f"O servidor Streamlit terminou ao arrancar (código {server.returncode}).")
+        return
+    if not ready:
+        logging.warning(f"Servidor não está pronto a tempo. Aceda manualmente: {url}")
+        return
+
+    cold_start = time.time() - psutil.Process().create_time()
+    logging.info(f"Servidor pronto em {cold_start:.1f} s desde o arranque (orçamento: {COLD_START_BUDGET:.0f} s).")
+    if cold_start > COLD_START_BUDGET:
+        logging.warning(f"Arranque acima do orçamento de {COLD_START_BUDGET:.0f} s.")
+    webbrowser.open(url, new=2)
+    logging.info("Navegador aberto com sucesso.")
+
+#  evitar múltiplas janelas
+if __name__ == "__main__":
+    # necessário para os processos de leitura em paralelo na versão PyInstaller
+    multiprocessing.freeze_support()
+    # Dentro do servidor o script também corre como __main__, mas com o streamlit já importado
+    if "streamlit" not in sys.modules:
+        launch()
+        sys.exit(0)
+
+# Só a interface: o cálculo está em resis.py, que se importa sem streamlit nem plotly
+import streamlit as st
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+from resis import (
+    SENSIVEL, SENSIVEL_MAIOR_EXPOSICAO, RESISTENTE, RESULT_CATEGORIES, SYNONYMS_FILE, RELEVANT_MICROORGANISMS,
+    GRAM_POSITIVO, GRAM_NEGATIVO, ANTIBIOTIC_CLASSES, RESISTANCE_BANDS, TREND_PERIODS, INGEST_CACHE_SIZE,
+    FIGURE_CACHE_SIZE, FIGURE_CACHE_MB, MIN_ISOLATES, TABLE_PAGE_SIZES, AGE_BAND_LABELS, TIMINGS, ColumnarStore,
+    FilterIndex, LRUCache, SharedDatasetStore, SparseResults, PageAggregates, DISTRIBUTION_GROUPS,
+    DISTRIBUTION_OPTIONS, distribution_aggregates, demographic_counts, organism_summary,
+    detect_antibiotic_columns, get_normaliser, ingest_file, ingest_incremental, observed_value_counts,
+    antibiotic_classes, resistance_percentages, resistance_statistics, format_resistance, calculate_resistance,
+    cube_slice, resistance_trend, resistance_bands, table_page,
 )
-        # Calculando a diferença de dias entre as colheitas
-        df['Difference'] = df.groupby(['Nº Processo', 'Microorganismo'])['Data Colheita'].diff().abs().dt.days
-        
-        # Máscara para identificar duplicados
-        mask = (df['Difference'] <= 15) & df.duplicated(['Nº Processo', 'Microorganismo', 'Antibiotics'], keep=False)
-        
-        # DataFrame de duplicados
-        df_duplicates = df.loc[mask]
-        
-        # Mantendo apenas uma ocorrência de cada duplicado
-        df_no_duplicates = df.drop_duplicates(subset=['Nº Processo', 'Microorganismo', 'Antibiotics', 'Data Colheita'], keep='first')
-        
-        # Contagem antes e depois da remoção de duplicados
-        before_count = df.shape[0]
-        after_count = df_no_duplicates.shape[0]
-        unique_microorganisms_before = df['Microorganismo'].nunique()
-        unique_microorganisms_after = df_no_duplicates['Microorganismo'].nunique()
-        
-        st.write(f"Número de casos antes da remoção de duplicados: {before_count}")
-        st.write(f"Número de casos após a remoção de duplicados com o mesmo número de processo, num intervalo de 15 dias: {after_count}")
-        st.write(f"Número de duplicados removidos: {before_count - after_count}")
-        st.write(f"Quantidade de microorganismos antes da remoção de duplicados: {unique_microorganisms_before}")
-        st.write(f"Quantidade de microorganismos depois da remoção de duplicados: {unique_microorganisms_after}")
-
-        # Criar e exibir a legenda
-        legend_html = """
-        <div style="display: inline-block; margin-top: 10px;">
-            <div style="background-color: lightblue; width: 15px; height: 15px; display: inline-block; margin-right: 5px;"></div>
-            <span>Menos de 40% de estirpes resistentes</span>
-        </div><br>
-        <div style="display: inline-block; margin-top: 10px;">
-            <div style="background-color: lightgoldenrodyellow; width: 15px; height: 15px; display: inline-block; margin-right: 5px;"></div>
-            <span>40% a 80% de estirpes resistentes</span>
-        </div><br>
-        <div style="display: inline-block; margin-top: 10px;">
-            <div style="background-color: lightcoral; width: 15px; height: 15px; display: inline-block; margin-right: 5px;"></div>
-            <span>Mais de 80% de estirpes resistentes</span>
-        </div>
-        """
-
-        st.write(" Legenda de Resistência :")
-        st.markdown(legend_html, unsafe_allow_html=True)
-
-        return df_no_duplicates, df_duplicates
-    except Exception as e:
-        st.error(f"Erro durante a limpeza dos dados: {e}")
-        return df, pd.DataFrame()
-    
+
+def show_cleaning_summary(summary):
+    """Exibir as contagens da limpeza e a legenda de resistência."""
+    before_count = summary['before_count']
+    after_count = summary['after_count']
+
+    st.write(f"Número de casos antes da remoção de duplicados: {before_count}")
+    st.write(f"Número de casos após a remoção de duplicados com o mesmo número de processo, num intervalo de 15 dias: {after_count}")
+    st.write(f"Número de duplicados removidos: {before_count - after_count}")
+    st.write(f"Quantidade de microorganismos antes da remoção de duplicados: {summary['unique_microorganisms_before']}")
+    st.write(f"Quantidade de microorganismos depois da remoção de duplicados: {summary['unique_microorganisms_after']}")
+
+    # Criar e exibir a legenda
+    legend_html = "<br>".join(
+        f"""<div style="display: inline-block; margin-top: 10px;">
+        <div style="background-color: {colour}; width: 15px; height: 15px; display: inline-block; margin-right: 5px;"></div>
+        <span>{label}</span>
+    </div>"""
+        for colour, label in RESISTANCE_BANDS
+    )
+
+    st.write(" Legenda de Resistência :")
+    st.markdown(legend_html, unsafe_allow_html=True)
+
+
+def show_unmapped_organisms(df):
+    """Listar os nomes de microorganismos sem sinónimo nem padrão, para completar a tabela de sinónimos."""
+    unmapped = get_normaliser().unmapped(df['Microorganismo'])
+    if unmapped.empty:
+        return
+    with st.expander(f"Nomes de microorganismos sem correspondência ({len(unmapped)})"):
+        st.caption(f"Acrescente sinónimos em {SYNONYMS_FILE} (colunas nome;canonico).")
+        st.dataframe(unmapped.rename('Ocorrências'))
+
+
+def paginated_table(df, key):
+    """Tabela paginada: a pesquisa, a ordenação e o corte da página são feitos no servidor e só a
+    página visível é enviada ao browser."""
+    search_col, sort_col, order_col, size_col, page_col = st.columns([3, 2, 1, 1, 1])
+    query = search_col.text_input("Procurar", key=f"{key}_query")
+    sort_by = sort_col.selectbox("Ordenar por", [None] + list(df.columns), key=f"{key}_sort",
+                                 format_func=lambda col: "—" if col is None else str(col))
+    ascending = order_col.selectbox("Ordem", ["Crescente", "Decrescente"], key=f"{key}_order") == "Crescente"
+    page_size = size_col.selectbox("Linhas por página", TABLE_PAGE_SIZES, key=f"{key}_size")
+    page = page_col.number_input("Página", min_value=1, step=1, key=f"{key}_page")
+
+    view, total = table_page(df, page, page_size, sort_by, ascending, query.strip())
+    pages = max(1, -(-total // page_size))
+    page = min(page, pages)
+    st.dataframe(view)
+    first = (page - 1) * page_size
+    st.caption(f"Linhas {first + 1 if total else 0}–{first + len(view)} de {total} · página {page} de {pages}")
+    st.download_button("Exportar página (CSV)", view.to_csv(index=False).encode('utf-8-sig'),
+                       file_name=f"{key}_pagina_{page}.csv", mime='text/csv', key=f"{key}_download")
+
 
 def check_duplicates(df):
     """Permitir o utilizador rever os duplicados aquando da sua existência."""
     if not df.empty:
         if st.checkbox("Revisão dos duplicados"):
-            st.write(df[df.duplicated(['Nº Processo', 'Microorganismo', 'Antibiotics'], keep=False)])
-
-def classify_gram_stain(microorganismo):
-    """Classificar microorganismos como Gram-positivo ou Gram-negativo."""
-    if microorganismo in GRAM_POSITIVO:
-        return 'Gram-Positivo'
-    elif microorganismo in GRAM_NEGATIVO:
-        return 'Gram-Negativo'
-    else:
-        return 'Unknown'
-
-def detect_antibiotic_columns(df):
-    """Dynamically identify columns that are likely to contain antibiotic data based on a predefined list."""
-    return [col for col in df.columns if col in ANTIBIOTICS]
-
-
-
+            paginated_table(df[df.duplicated(['Nº Processo', 'Microorganismo', 'Antibiotics'], keep=False)], 'duplicados')
 
 def create_antibiotic_legend():
     """Legenda para os antibióticos e as suas classes."""
@@ -366,169 +299,105 @@ def create_antibiotic_legend():
 
 
 def show_resistance_profile(df_cleaned):
-    """Exibir o perfil de resistências com base na seleção do Gram e do microorganimo."""
+    """Exibir o perfil de resistências (percentagens numéricas) com base na seleção do Gram e do microorganimo."""
     gram_stains = df_cleaned.index.get_level_values('Gram_Stain').unique()
     selected_gram = st.selectbox('Selecionar Coloração Gram :', gram_stains)
     microorganisms = df_cleaned.loc[selected_gram].index.get_level_values('Microorganismo').unique()
     selected_microorganism = st.selectbox('Selecionar Microorganismo:', microorganisms)
-    filtered_df = df_cleaned.loc[(selected_gram, selected_microorganism)]
+    filtered_df = df_cleaned.loc[[(selected_gram, selected_microorganism)]].dropna(how='all', axis=1)
 
     st.write(f"Perfil de Resistência para {selected_microorganism} ({selected_gram}):")
     if not filtered_df.empty:
-        st.dataframe(filtered_df.style.applymap(highlight_resistance))
+        show_resistance_heatmap(filtered_df)
     else:
         st.write("No data available for the selected microorganism.")
 
-def classify_resistance(value):
-    """Classifica a percentagem da resistência em categorias."""
-    if value < 40:
-        return 'Menos de 40% de estirpes resistentes'
-    elif value > 80:
-        return 'Mais de 80% de estirpes resistentes'
-    elif 40 <= value <= 80:
-        return '40% a 80% de estirpes resistentes'
+def resistance_heatmap(percentages):
+    """Mapa de calor com as três faixas de resistência e a percentagem escrita em cada célula."""
+    bands = resistance_bands(percentages)
+    colorscale = []
+    for i, (colour, _) in enumerate(RESISTANCE_BANDS):
+        colorscale += [[i / len(RESISTANCE_BANDS), colour], [(i + 1) / len(RESISTANCE_BANDS), colour]]
+    labels = [' | '.join(map(str, row)) if isinstance(row, tuple) else str(row) for row in percentages.index]
+    text = format_resistance(percentages).fillna('')
+
+    fig = go.Figure(go.Heatmap(
+        z=bands.to_numpy(), x=list(percentages.columns), y=labels, text=text.to_numpy(),
+        texttemplate='%{text}', colorscale=colorscale, zmin=-0.5, zmax=len(RESISTANCE_BANDS) - 0.5,
+        showscale=False, xgap=1, ygap=1, hovertemplate='%{y}<br>%{x}: %{text}%<extra></extra>',
+    ))
+    fig.update_layout(height=120 + 24 * len(labels), margin=dict(l=0, r=0, t=100, b=0),
+                      plot_bgcolor='white', font=dict(color='black'))
+    fig.update_xaxes(side='top', tickangle=-45)
+    fig.update_yaxes(autorange='reversed')
+    return fig
+
+
+def show_resistance_heatmap(percentages, key=None):
+    if key is None:
+        st.plotly_chart(resistance_heatmap(percentages), width="stretch")
     else:
-        return 'Resistências naturais'
+        show_figure(key, lambda: resistance_heatmap(percentages), width="stretch")
 
 
-def classify_antibiotic(antibiotic):
-    """ Classificar o antibiótico nas classes."""
-    for category, antibiotics in ANTIBIOTIC_CLASSES.items():
-        if antibiotic in antibiotics:
-            return category
-
-def intrinsic_resistance(microorganismo, antibiotic):
-    """Verificar se um antibiótico é intrinsicamente resistente para um microorganismo."""
-    intrinsic_resistance_dict = {
-        "Acinetobacter baumannii": ["Ampicillina", "Amoxicilina", "Cefuroxima", "Cefuroxima - Axetil", "Cefuroxima - Sódica"],
-        "Citrobacter species": ["Ampicillina", "Cefuroxima"],
-        "Enterobacter species": ["Ampicillina", "Cefuroxima", "Cefuroxima - Axetil", "Cefuroxima - Sódica"],
-        "Escherichia coli": ["Penicillina", "Vancomicina"],
-        "Klebsiella oxytoca": ["Ampicillina", "Amoxicilina"],
-        "Klebsiella pneumoniae": ["Ampicillina", "Amoxicilina"],
-        "Morganella morganii": ["Ampicillina", "Amoxicilina", "Cefuroxima"],
-        "Pseudomonas aeruginosa": ["A maioria dos Beta-lactâmicos", "Cotrimoxazol", "Tetraciclina", "Cloranfenicol", "Colistina"],
-        "Proteus mirabilis": ["Tetraciclina", "Nitrofurantoína", "Polimixinas", "Tigeciclina"],
-        "Serratia marcescens": ["Ampicillina", "Amoxicilina", "Cefuroxima"],
-        "Providencia species": ["Ampicillina", "Amoxicilina", "Cefuroxima", "Nitrofurantoína"],
-        "Haemophilus influenzae": ["Vancomicina", "Clindamicina", "Cefuroxima", "Cefuroxima - Axetil", "Cefuroxima - Sódica"],
-        "Enterococcus faecalis": ["Cefalosporinas", "Clindamicina", "Aminoglicosídeos"],
-        "Enterococcus faecium": ["Cefalosporinas", "Clindamicina", "Aminoglicosídeos"],
-        "Streptococcus agalactiae": ["Aminoglicosídeos", "Cotrimoxazol"],
-        "Staphylococcus aureus": [],  # MRSA specifics can be handled separately
-        "Staphylococcus epidermidis": [],  # MRSE specifics can be handled separately
-        "Streptococcus pneumoniae": ["Aminoglicosídeos", "Clindamicina"],
-        "Staphylococcus saprophyticus": ["Novobiocina"]
-    }
+# bytes estimados de cada série além dos dados (tipo, cores, hovertemplate, ...)
+TRACE_OVERHEAD = 512
 
-    return 'x' if antibiotic in intrinsic_resistance_dict.get(microorganismo, []) else ''
 
+def figure_size(fig):
+    """Estimativa barata do tamanho da figura: bytes dos arrays de dados de cada série, sem a serializar."""
+    def data_bytes(value):
+        if hasattr(value, 'nbytes'):
+            return value.nbytes
+        if isinstance(value, (list, tuple)):
+            return 8 * len(value)
+        if isinstance(value, dict):
+            return sum(data_bytes(v) for v in value.values())
+        return 0
+    return sum(TRACE_OVERHEAD + data_bytes(trace.to_plotly_json()) for trace in fig.data)
 
 
+def show_figure(key, build, **kwargs):
+    """Mostrar a figura de `build()`, reutilizando a já construída para o mesmo conjunto de dados e estado dos filtros.
 
+    `key` identifica a página e o estado normalizado dos filtros; o conjunto de dados vem da sessão.
+    """
+    cache = get_figure_cache()
+    key = (st.session_state.get('dataset_key'), *key)
+    fig = cache.get(key)
+    if fig is None:
+        fig = build()
+        cache.put(key, fig)
+    st.plotly_chart(fig, **kwargs)
 
-def calculate_resistance(df_cleaned):
-    df_cleaned.loc[:, 'Gram_Stain'] = df_cleaned['Microorganismo'].apply(classify_gram_stain)
-    antibiotic_columns = detect_antibiotic_columns(df_cleaned)
-    results = []
-    microorganism_counts = df_cleaned['Microorganismo'].value_counts().to_dict()
 
-    for microorganismo in RELEVANT_MICROORGANISMS:
-        micro_df = df_cleaned[df_cleaned['Microorganismo'] == microorganismo]
-        for col in antibiotic_columns:
-            count = micro_df[col].count()
-            if count > 0:  # só antibióticos com resultados
-                resistant = micro_df[micro_df[col] == 'Resistente'].shape[0]
-                resistance = (resistant / count) * 100 if count else 0
-                resistance = round(resistance, 1)  
-                results.append({
-                    'Microorganismo': f"{microorganismo} (n={microorganism_counts.get(microorganismo, 0)})",
-                    'Antibiotic': col,
-                    'Resistance': resistance,
-                    'Gram_Stain': classify_gram_stain(microorganismo),
-                    'Category': classify_resistance(resistance),
-                    'Class': classify_antibiotic(col),
-                    'Intrinsic_Resistance': intrinsic_resistance(microorganismo, col)
-                })
+def show_product_service_chart(cube, min_isolates=MIN_ISOLATES, aggregates=None):
+    services_list = ['Total'] + cube['services']
 
-    result_df = pd.DataFrame(results)
-    
-    if not result_df.empty:
-        result_df = result_df.pivot(index=['Gram_Stain', 'Microorganismo'], columns='Antibiotic', values='Resistance')
-        
-        result_df = result_df.map(lambda x: '{:.1f}'.format(x).rstrip('0').rstrip('.') if pd.notnull(x) else x)
-    return result_df
-
-def highlight_resistance(val):
-    """Identificar os valores e associar com as cores específicas."""
-    if isinstance(val, str) and val != '':
-        val = float(val)
-        if val < 40:
-            return 'background-color: lightblue; color: black'
-        elif val > 80:
-            return 'background-color: lightcoral; color: black'
-        elif 40 <= val <= 80:
-            return 'background-color: lightgoldenrodyellow; color: black'
-    return ''
-
-def detect_antibiotic_columns(df):
-    """Identificar as colunas de antibióticos."""
-    return [col for col in df.columns if col in ANTIBIOTICS]
-
-# Definição da função classify_antibiotiC
-def classify_antibiotic(antibiotic):
-    if antibiotic in CARBAPENEMES:
-        return 'Carbapenemes'
-    elif antibiotic in MRSA:
-        return 'MRSA'
-    elif antibiotic in POLIMIXINAS:
-        return 'Polimixina'
-    elif antibiotic in CEFALOSPORINAS_3A_4A:
-        return 'Cefalosporina (3ª/4ª Geração)'
-    elif antibiotic in AMOXICILINA_ACIDO_CLAVULANICO:
-        return 'Amoxicilina/Ácido Clavulânico'
-    elif antibiotic in FLUOROQUINOLONAS:
-        return 'Fluoroquinolona'
-    elif antibiotic in AMINOGLICOSIDEOS:
-        return 'Aminoglicosídeo'
-    elif antibiotic in BETA_LACTAMICOS_INIBIDORES:
-        return 'Beta-lactâmico com Inibidor de Beta-lactamase'
-    else:
-        return 'Outros'
-        
-def show_product_service_chart(df_cleaned):
-    df_cleaned['Serviço'] = df_cleaned['Serviço'].astype(str).fillna('Sem Identificação')
-    df_cleaned['Produto'] = df_cleaned['Produto'].astype(str).fillna('Sem Identificação')
-    services_list = ['Total'] + sorted(df_cleaned['Serviço'].unique())
-    products_list = ['Total'] + sorted(df_cleaned['Produto'].unique())
-    
     selected_service = st.selectbox("Selecionar Serviço:", services_list)
-    if selected_service == 'Total':
-        selected_product = st.selectbox("Selecionar Produto:", products_list)
-        filtered_data = df_cleaned if selected_product == 'Total' else df_cleaned[df_cleaned['Produto'] == selected_product]
-    else:
-        filtered_data = df_cleaned[df_cleaned['Serviço'] == selected_service]
-        selected_product = st.selectbox("Selecionar Produto:", ['Total'] + sorted(filtered_data['Produto'].unique()))
-        filtered_data = filtered_data if selected_product == 'Total' else filtered_data[filtered_data['Produto'] == selected_product]
-    
-    microorganism_counts = filtered_data['Microorganismo'].value_counts().reset_index()
+    selected_product = st.selectbox("Selecionar Produto:", ['Total'] + cube['products'].get(selected_service, []))
+    aggregates = aggregates or PageAggregates()
+    tested, resistant, isolates = aggregates.get(('cube', selected_service, selected_product), cube_slice,
+                                                 cube, selected_service, selected_product)
+
+    microorganism_counts = isolates[isolates > 0].sort_values(ascending=False).reset_index()
     microorganism_counts.columns = ['Microorganismo', 'Counts']
     top_microorganisms = microorganism_counts.head(10)
-    fig = px.bar(top_microorganisms, x='Microorganismo', y='Counts',
-                 title=f'Top 10 Microorganisms in {selected_product} for {selected_service}',
-                 color='Microorganismo', color_continuous_scale=px.colors.qualitative.Pastel)
-    st.plotly_chart(fig)
+    show_figure(('classes', selected_service, selected_product),
+                lambda: px.bar(top_microorganisms, x='Microorganismo', y='Counts',
+                               title=f'Top 10 Microorganisms in {selected_product} for {selected_service}',
+                               color='Microorganismo', color_continuous_scale=px.colors.qualitative.Pastel))
     
     # Exibir resistências
     st.write("### Perfil de Resistências")
-    if not filtered_data.empty:
-        resistance_df = calculate_resistance(filtered_data)
-        antibiotic_columns = detect_antibiotic_columns(filtered_data)
+    percentages = resistance_percentages(tested, resistant, isolates, min_isolates) if isolates.sum() > 0 else pd.DataFrame()
+    if not percentages.empty:
+        resistance_df = format_resistance(percentages)
         resistance_summary_df = resistance_df.reset_index().melt(id_vars=['Microorganismo', 'Gram_Stain'], var_name='Antibiotic', value_name='Resistance')
         resistance_summary_df = resistance_summary_df[resistance_summary_df['Resistance'].notna()]
         
         # Adicionar a coluna de classe de antibióticos
-        resistance_summary_df['Class'] = resistance_summary_df['Antibiotic'].apply(classify_antibiotic)
+        resistance_summary_df['Class'] = antibiotic_classes(resistance_summary_df['Antibiotic'])
         
         # Filtrar os microorganismos do gráfico anterior
         top_microorganisms_list = top_microorganisms['Microorganismo'].tolist()
@@ -546,289 +415,174 @@ def show_product_service_chart(df_cleaned):
             class_df = filtered_resistance_summary_df[filtered_resistance_summary_df['Class'] == antibiotic_class]
             if not class_df.empty:
                 st.write(f"#### {antibiotic_class}")
-                fig = px.bar(class_df, x='Resistance', y='Antibiotic', color='Antibiotic', orientation='h',
-                             title=f'Perfil de Resistência para {antibiotic_class}',
-                             labels={'Resistance': 'Resistência (%)', 'Antibiotic': 'Antibiótico'})
-                st.plotly_chart(fig)
+                show_figure(('classes', selected_service, selected_product, min_isolates, antibiotic_class),
+                            lambda: px.bar(class_df, x='Resistance', y='Antibiotic', color='Antibiotic', orientation='h',
+                                           title=f'Perfil de Resistência para {antibiotic_class}',
+                                           labels={'Resistance': 'Resistência (%)', 'Antibiotic': 'Antibiótico'}))
     else:
         st.write("No resistance data available for the selected criteria.")
 
 
-def process_and_plot_data(df_clean, gram_positivo, gram_negativo, eskape_microorganisms):
-    st.header("Análise exploratória dos dados")
-
-    # Selecionar a opção para filtrar os dados, ignorando as primeiras nove colunas
-    options = ['Microorganismo', 'Gram-positivo', 'Gram-negativo', 'ESKAPE', 'Sexo', 'Idade'] + list(df_clean.columns[10:])
-    groupby_column = st.selectbox('Que deseja verificar?', options)
-    st.write(f"Seleção atual: {groupby_column}")
-
-    # Filtrar o DataFrame com base na opção selecionada
-    if groupby_column == 'Microorganismo':
-        df_filtered = df_clean
-    elif groupby_column in ['Gram-positivo', 'Gram-negativo', 'ESKAPE']:
-        if groupby_column == 'Gram-positivo':
-            relevant_microorganisms = gram_positivo
-        elif groupby_column == 'Gram-negativo':
-            relevant_microorganisms = gram_negativo
-        else:
-            relevant_microorganisms = eskape_microorganisms
-        df_filtered = df_clean[df_clean['Microorganismo'].isin(relevant_microorganisms)]
-    else:
-        df_filtered = df_clean[df_clean[groupby_column].notnull()]
-
-    # Número de ocorrências para cada grupo
-    if groupby_column in ['Microorganismo', 'Gram-positivo', 'Gram-negativo', 'ESKAPE']:
-        data_counts = df_filtered['Microorganismo'].value_counts().reset_index()
-        data_counts.columns = ['Microorganismo', 'Contagem']
-    else:
-        data_counts = df_filtered[groupby_column].value_counts().reset_index()
-        data_counts.columns = [groupby_column, 'Contagem']
-
-    # Plot da distribuição de microorganismos com cores 
-    fig = px.bar(data_counts, x=data_counts.columns[0], y='Contagem', title='Distribuição de Microorganismos',
-                 color=data_counts.columns[0], color_continuous_scale=px.colors.sequential.Viridis)
-    st.plotly_chart(fig)
-
-    # Listar as colunas de antibióticos
-    colunas_antibioticos = detect_antibiotic_columns(df_clean)
-
-    # Escolher a opção de visualizar 'Resistente' ou 'Sensível'
-    opcao_visualizacao = st.radio("Escolha o que deseja visualizar:", ('Resistente', 'Sensível'))
-    contagens = {coluna: df_filtered[coluna].value_counts().get(opcao_visualizacao, 0) for coluna in colunas_antibioticos}
-    contagens_df = pd.DataFrame(list(contagens.items()), columns=['Antibiótico', 'Contagem'])
-    contagens_df.sort_values(by='Contagem', ascending=False, inplace=True)
-
-    # Plot das contagens de antibióticos com cores 
-    fig = px.bar(contagens_df, x='Antibiótico', y='Contagem', color='Contagem',
-                 color_continuous_scale=px.colors.sequential.Plasma,
-                 labels={'Contagem': f'Quantidade de {opcao_visualizacao}'},
-                 title=f'Quantidade de Antibióticos {opcao_visualizacao}')
-    st.plotly_chart(fig)
-
-    # percentagem de isolados por sexo e idade , por espécie bacteriana 
-    st.subheader("Percentagem de isolados por sexo e grupo etário")
-    microorganismo_filter = st.selectbox('Escolha o Microorganismo para detalhar (ou Todos):', ['Todos'] + df_clean['Microorganismo'].unique().tolist())
-    
-    if microorganismo_filter == 'Todos':
-        df_sex_age = df_clean
-    else:
-        df_sex_age = df_clean[df_clean['Microorganismo'] == microorganismo_filter]
-
-    groupby_sex_age = st.selectbox('Selecione um grupo para analisar:', ['Sexo', 'Idade'])
-    if groupby_sex_age:
-        grouped_sex_age = df_sex_age.groupby(groupby_sex_age).size().reset_index()
-        grouped_sex_age.columns = [groupby_sex_age, 'count']
-        total_sex_age = df_sex_age.shape[0]
-        grouped_sex_age['percentage'] = (grouped_sex_age['count'] / total_sex_age) * 100
-
-        fig_sex_age = px.bar(grouped_sex_age, x=groupby_sex_age, y='percentage', color=groupby_sex_age,
-                             title=f'Percentagem de isolados por {groupby_sex_age} ({microorganismo_filter})',
-                             labels={'percentage': 'Percentagem'})
-        st.plotly_chart(fig_sex_age)
-
-    # Nova seção para o número total de isolados invasivos testados e percentagem de isolados com fenótipo de resistência
-    st.subheader("Número total de isolados invasivos testados e percentagem de isolados com fenótipo de resistência")
-
-    # Transformar os dados para calcular a resistência
-    grouped_resistance = df_filtered.melt(id_vars=['Microorganismo'], value_vars=colunas_antibioticos, 
-                                        var_name='Antimicrobial Class', value_name='Resistance Phenotype')
-
-    # Filtrar apenas os fenotipos de resistência
-    grouped_resistance = grouped_resistance[grouped_resistance['Resistance Phenotype'] == 'Resistente']
-
-    # Contagem dos isolados resistentes por classe antimicrobiana e microorganismo
-    grouped_resistance = grouped_resistance.groupby(['Microorganismo', 'Antimicrobial Class']).size().reset_index(name='count')
-
-    # Contagem total de isolados testados por classe antimicrobiana e microorganismo
-    total_resistance = grouped_resistance.groupby(['Microorganismo', 'Antimicrobial Class'])['count'].sum().reset_index()
-    total_resistance.columns = ['Microorganismo', 'Antimicrobial Class', 'total']
-
-    # Calcular a percentagem de isolados resistentes
-    percent_resistance = pd.merge(grouped_resistance, total_resistance, on=['Microorganismo', 'Antimicrobial Class'])
-    percent_resistance['percentage'] = (percent_resistance['count'] / percent_resistance['total']) * 100
-
-    # Criar o gráfico de barras
-    fig_resistance = px.bar(percent_resistance, x='Antimicrobial Class', y='percentage', color='Microorganismo',
-                            title='Percentagem de isolados com fenótipo de resistência',
-                            labels={'percentage': 'Percentagem', 'Antimicrobial Class': 'Classe Antimicrobiana', 'Microorganismo': 'Microorganismo'})
-
-    # Exibir o gráfico
-    st.plotly_chart(fig_resistance)
-
-    df_clean['Faixa Etária'] = pd.cut(df_clean['Idade'], 
-                                      bins=[0, 12, 18, 60, 120], 
-                                      labels=['Pediátrico', 'Adolescente', 'Adulto', 'Idoso'], 
-                                      right=False)
-
-    st.subheader("Filtrar detalhes específicos")
-
-    # Microorganismo
-    microorganismos = ['Todos'] + list(df_clean['Microorganismo'].unique())
-    microorganismo = st.selectbox('Escolha o Microorganismo:', microorganismos)
-
-    # Idade
-    faixas_etarias = ['Todas'] + ['Pediátrico', 'Adolescente', 'Adulto', 'Idoso']
-    faixa_etaria = st.selectbox('Escolha a Faixa Etária:', faixas_etarias)
-
-    # Sexo
-    sexos = ['Todos'] + list(df_clean['Sexo'].unique())
-    sexo = st.selectbox('Escolha o Sexo:', sexos)
-
-    # Serviço
-    servicos = ['Todos'] + list(df_clean['Serviço'].unique())
-    servico = st.selectbox('Escolha o Serviço:', servicos)
-
-    # Produto
-    produtos = ['Todos'] + list(df_clean['Produto'].unique())
-    produto = st.selectbox('Escolha o Produto:', produtos)
-
-    # Filtrando o DataFrame
-    df_specific = df_clean[
-        ((df_clean['Microorganismo'] == microorganismo) | (microorganismo == 'Todos')) &
-        ((df_clean['Faixa Etária'] == faixa_etaria) | (faixa_etaria == 'Todas')) &
-        ((df_clean['Sexo'] == sexo) | (sexo == 'Todos')) &
-        ((df_clean['Serviço'] == servico) | (servico == 'Todos')) &
-        ((df_clean['Produto'] == produto) | (produto == 'Todos'))
-    ]
-
-    if not df_specific.empty:
-        st.write(f"Detalhes para {microorganismo}, {faixa_etaria}, {sexo}, {servico}, {produto}:")
-        st.dataframe(df_specific)
-    else:
-        st.write(f"Nenhum dado encontrado para {microorganismo}, {faixa_etaria}, {sexo}, {servico}, {produto}.")
-
-def process_and_plot_data(df_clean, gram_positivo, gram_negativo, eskape_microorganisms):
+def show_trends(counts):
+    """Evolução da resistência por período, com janelas móveis e intervalos de confiança."""
+    st.header("Tendências de resistência")
+    if counts[0].empty:
+        st.write("Sem datas de colheita válidas para calcular tendências.")
+        return
+
+    period_label = st.selectbox("Período:", list(TREND_PERIODS))
+    window = st.selectbox("Janela móvel (períodos):", [1, 3, 6, 12])
+    cumulative = st.checkbox("Acumulado desde o início")
+    trend = resistance_trend(counts, TREND_PERIODS[period_label], window, cumulative)
+
+    organisms = trend.groupby('Microorganismo', observed=True)['Testados'].sum().sort_values(ascending=False).index
+    selected_microorganism = st.selectbox("Selecionar Microorganismo:", organisms)
+    organism_trend = trend[trend['Microorganismo'] == selected_microorganism]
+    antibiotics = sorted(organism_trend['Antibiotic'].unique())
+    selected_antibiotics = st.multiselect("Selecionar Antibióticos:", antibiotics, default=antibiotics[:3])
+
+    plot_data = organism_trend[organism_trend['Antibiotic'].isin(selected_antibiotics)].copy()
+    if not plot_data.empty:
+        def build():
+            plot_data['Período'] = plot_data['Período'].dt.start_time
+            plot_data['erro_sup'] = plot_data['IC 95% sup.'] - plot_data['Resistência (%)']
+            plot_data['erro_inf'] = plot_data['Resistência (%)'] - plot_data['IC 95% inf.']
+            fig = px.line(plot_data, x='Período', y='Resistência (%)', color='Antibiotic', markers=True,
+                          error_y='erro_sup', error_y_minus='erro_inf',
+                          hover_data=['Testados', 'Resistentes', 'IC 95% inf.', 'IC 95% sup.'],
+                          title=f'Resistência de {selected_microorganism} por {period_label.lower()}')
+            fig.update_yaxes(range=[0, 100])
+            return fig
+
+        # a ordem da seleção não muda o gráfico
+        show_figure(('tendências', period_label, window, cumulative, selected_microorganism,
+                     tuple(sorted(selected_antibiotics))), build)
+
+    # Relatório de vigilância: todos os microorganismos e antibióticos, calculado numa só passagem
+    report = trend.assign(Período=trend['Período'].astype(str))
+    st.dataframe(report[report['Microorganismo'] == selected_microorganism])
+    st.download_button("Descarregar relatório (CSV)", report.to_csv(index=False).encode('utf-8-sig'),
+                       file_name=f"tendencias_{TREND_PERIODS[period_label]}.csv", mime='text/csv')
+
+
+def process_and_plot_data(df_clean, gram_positivo, gram_negativo, eskape_microorganisms, filter_index=None,
+                          min_isolates=MIN_ISOLATES, aggregates=None, results=None):
     st.header("Análise exploratória dos dados")
+    aggregates = aggregates or PageAggregates()
+    # resultados em formato esparso, normalmente já criados na ingestão
+    if results is None:
+        results = SparseResults(df_clean)
 
     # Selecionar a opção para filtrar os dados, ignorando as primeiras nove colunas
-    options = ['Microorganismo', 'Gram-positivo', 'Gram-negativo', 'ESKAPE', 'Sexo', 'Idade'] + list(df_clean.columns[10:])
+    options = DISTRIBUTION_OPTIONS + list(df_clean.columns[10:])
     groupby_column = st.selectbox('Que deseja verificar?', options)
     st.write(f"Seleção atual: {groupby_column}")
 
-    # Filtrar o DataFrame com base na opção selecionada
-    if groupby_column == 'Microorganismo':
-        df_filtered = df_clean
-    elif groupby_column in ['Gram-positivo', 'Gram-negativo', 'ESKAPE']:
-        if groupby_column == 'Gram-positivo':
-            relevant_microorganisms = gram_positivo
-        elif groupby_column == 'Gram-negativo':
-            relevant_microorganisms = gram_negativo
-        else:
-            relevant_microorganisms = eskape_microorganisms
-        df_filtered = df_clean[df_clean['Microorganismo'].isin(relevant_microorganisms)]
-    else:
-        df_filtered = df_clean[df_clean[groupby_column].notnull()]
+    # Agregados da opção selecionada (normalmente já calculados em segundo plano)
+    groups = {'Gram-positivo': gram_positivo, 'Gram-negativo': gram_negativo, 'ESKAPE': eskape_microorganisms}
+    distribution = aggregates.get(('distribution', groupby_column), distribution_aggregates, df_clean, groupby_column, groups,
+                                  results)
 
     # Número de ocorrências para cada grupo
-    if groupby_column in ['Microorganismo', 'Gram-positivo', 'Gram-negativo', 'ESKAPE']:
-        data_counts = df_filtered['Microorganismo'].value_counts().reset_index()
-        data_counts.columns = ['Microorganismo', 'Contagem']
-    else:
-        data_counts = df_filtered[groupby_column].value_counts().reset_index()
-        data_counts.columns = [groupby_column, 'Contagem']
+    data_counts = distribution['data_counts']
 
     # Plot da distribuição de microorganismos com cores suaves
-    fig = px.bar(data_counts, x=data_counts.columns[0], y='Contagem', title='Distribuição de Microorganismos',
-                 color=data_counts.columns[0], color_discrete_sequence=px.colors.qualitative.Pastel)
-    st.plotly_chart(fig)
-
-    # Listar as colunas de antibióticos
-    colunas_antibioticos = detect_antibiotic_columns(df_clean)
+    show_figure(('distribuição', groupby_column),
+                lambda: px.bar(data_counts, x=data_counts.columns[0], y='Contagem', title='Distribuição de Microorganismos',
+                               color=data_counts.columns[0], color_discrete_sequence=px.colors.qualitative.Pastel))
 
     # Escolher a opção de visualizar 'Resistente' ou 'Sensível'
-    opcao_visualizacao = st.radio("Escolha o que deseja visualizar:", ('Resistente', 'Sensível'))
-    contagens = {coluna: df_filtered[coluna].value_counts().get(opcao_visualizacao, 0) for coluna in colunas_antibioticos}
-    contagens_df = pd.DataFrame(list(contagens.items()), columns=['Antibiótico', 'Contagem'])
+    opcao_visualizacao = st.radio("Escolha o que deseja visualizar:", (RESISTENTE, SENSIVEL))
+    contagens_df = distribution['result_counts'][opcao_visualizacao].rename_axis('Antibiótico').reset_index(name='Contagem')
     contagens_df.sort_values(by='Contagem', ascending=False, inplace=True)
 
     # Plot das contagens de antibióticos com cores suaves
-    fig = px.bar(contagens_df, x='Antibiótico', y='Contagem', color='Antibiótico',
-                 color_discrete_sequence=px.colors.qualitative.Pastel,
-                 labels={'Contagem': f'Quantidade de {opcao_visualizacao}'},
-                 title=f'Quantidade de Antibióticos {opcao_visualizacao}')
-    st.plotly_chart(fig)
+    show_figure(('distribuição', groupby_column, opcao_visualizacao),
+                lambda: px.bar(contagens_df, x='Antibiótico', y='Contagem', color='Antibiótico',
+                               color_discrete_sequence=px.colors.qualitative.Pastel,
+                               labels={'Contagem': f'Quantidade de {opcao_visualizacao}'},
+                               title=f'Quantidade de Antibióticos {opcao_visualizacao}'))
 
     # Secção nova para a percentagem de isolados por sexo e grupo , por espécie bacteriana 
     st.subheader("Percentagem e total de isolados por sexo e grupo etário")
     microorganismo_filter = st.selectbox('Escolha o Microorganismo para detalhar (ou Todos):', ['Todos'] + df_clean['Microorganismo'].unique().tolist())
     
-    if microorganismo_filter == 'Todos':
-        df_sex_age = df_clean
-    else:
-        df_sex_age = df_clean[df_clean['Microorganismo'] == microorganismo_filter]
-
     groupby_sex_age = st.selectbox('Selecione um grupo para analisar:', ['Sexo', 'Idade'])
     if groupby_sex_age:
-        grouped_sex_age = df_sex_age.groupby(groupby_sex_age).size().reset_index()
+        demographics = aggregates.get(('demographics', groupby_sex_age), demographic_counts, df_clean, groupby_sex_age)
+        if microorganismo_filter == 'Todos':
+            counts, total_sex_age = demographics['all'], df_clean.shape[0]
+        elif microorganismo_filter in demographics['organisms'].index:
+            counts = demographics['by_organism'].xs(microorganismo_filter, level='Microorganismo')
+            total_sex_age = demographics['organisms'][microorganismo_filter]
+        else:
+            counts, total_sex_age = demographics['all'].iloc[:0], 0
+        grouped_sex_age = counts.reset_index()
         grouped_sex_age.columns = [groupby_sex_age, 'count']
-        total_sex_age = df_sex_age.shape[0]
         grouped_sex_age['percentage'] = (grouped_sex_age['count'] / total_sex_age) * 100
 
-        fig_sex_age = px.bar(grouped_sex_age, x=groupby_sex_age, y='percentage', color=groupby_sex_age,
-                             title=f'Percentagem de isolados por {groupby_sex_age} ({microorganismo_filter})',
-                             labels={'percentage': 'Percentagem'}, color_discrete_sequence=px.colors.qualitative.Pastel)
-        fig_sex_age.update_layout(yaxis_title='Percentagem', xaxis_title=groupby_sex_age)
-        fig_sex_age.update_traces(texttemplate='%{text:.2s}%', textposition='outside')
-        
-        # Adiciona as contagens totais ao gráfico
-        fig_sex_age.update_traces(text=grouped_sex_age['count'])
+        def build_sex_age():
+            fig_sex_age = px.bar(grouped_sex_age, x=groupby_sex_age, y='percentage', color=groupby_sex_age,
+                                 title=f'Percentagem de isolados por {groupby_sex_age} ({microorganismo_filter})',
+                                 labels={'percentage': 'Percentagem'}, color_discrete_sequence=px.colors.qualitative.Pastel)
+            fig_sex_age.update_layout(yaxis_title='Percentagem', xaxis_title=groupby_sex_age)
+            fig_sex_age.update_traces(texttemplate='%{text:.2s}%', textposition='outside')
+
+            # Adiciona as contagens totais ao gráfico
+            fig_sex_age.update_traces(text=grouped_sex_age['count'])
+            return fig_sex_age
 
-        st.plotly_chart(fig_sex_age)
+        show_figure(('distribuição', 'demografia', groupby_sex_age, microorganismo_filter), build_sex_age)
         st.write(grouped_sex_age)
 
     # Nova seção para o número total de isolados invasivos testados e percentagem de isolados com fenótipo de resistência
     st.subheader("Número total de isolados invasivos testados e percentagem de isolados com fenótipo de resistência")
 
-    # Transformar os dados para calcular a resistência
-    grouped_resistance = df_filtered.melt(id_vars=['Microorganismo'], value_vars=colunas_antibioticos, 
-                                        var_name='Antibiotic', value_name='Resistance Phenotype')
+    # Isolados testados e resistentes por antibiótico e microorganismo
+    tested, resistant = distribution['tested'], distribution['resistant']
+    # as duas tabelas têm o mesmo índice e as mesmas colunas, logo as linhas estão alinhadas
+    percent_resistance = resistant.rename_axis('Microorganismo').reset_index().melt(
+        id_vars='Microorganismo', var_name='Antibiotic', value_name='count')
+    percent_resistance['total'] = tested.reset_index().melt(id_vars=tested.index.name)['value']
 
-    # Filtrar apenas os fenotipos de resistência
-    grouped_resistance = grouped_resistance[grouped_resistance['Resistance Phenotype'] == 'Resistente']
-
-    # Contagem dos isolados resistentes por antibiótico e microorganismo
-    grouped_resistance = grouped_resistance.groupby(['Microorganismo', 'Antibiotic']).size().reset_index(name='count')
-
-    # Contagem total de isolados testados por antibiótico e microorganismo
-    total_resistance = grouped_resistance.groupby(['Microorganismo', 'Antibiotic'])['count'].sum().reset_index()
-    total_resistance.columns = ['Microorganismo', 'Antibiotic', 'total']
-
-    # Calcular a percentagem de isolados resistentes
-    percent_resistance = pd.merge(grouped_resistance, total_resistance, on=['Microorganismo', 'Antibiotic'])
+    # Percentagem de isolados resistentes, só nas células com isolados testados suficientes
+    percent_resistance = percent_resistance[(percent_resistance['count'] > 0) &
+                                            (percent_resistance['total'] >= max(min_isolates, 1))]
     percent_resistance['percentage'] = (percent_resistance['count'] / percent_resistance['total']) * 100
 
     # Gráfico para fenotipos de resistência com 100% de resistência
     percent_resistance_100 = percent_resistance[percent_resistance['percentage'] == 100]
     if not percent_resistance_100.empty:
-        fig_resistance_100 = px.bar(percent_resistance_100, x='Antibiotic', y='percentage', color='Microorganismo',
-                                    title='Percentagem de isolados com fenótipo de resistência (100%)',
-                                    labels={'percentage': 'Percentagem', 'Antibiotic': 'Antibiótico', 'Microorganismo': 'Microorganismo'},
-                                    color_discrete_sequence=px.colors.qualitative.Pastel)
-        fig_resistance_100.update_layout(yaxis_title='Percentagem', xaxis_title='Antibiótico')
-        fig_resistance_100.update_traces(texttemplate='%{text:.2s}%', textposition='outside')
-        fig_resistance_100.update_traces(text=percent_resistance_100['count'])
-        st.plotly_chart(fig_resistance_100)
+        def build_resistance_100():
+            fig_resistance_100 = px.bar(percent_resistance_100, x='Antibiotic', y='percentage', color='Microorganismo',
+                                        title='Percentagem de isolados com fenótipo de resistência (100%)',
+                                        labels={'percentage': 'Percentagem', 'Antibiotic': 'Antibiótico', 'Microorganismo': 'Microorganismo'},
+                                        color_discrete_sequence=px.colors.qualitative.Pastel)
+            fig_resistance_100.update_layout(yaxis_title='Percentagem', xaxis_title='Antibiótico')
+            fig_resistance_100.update_traces(texttemplate='%{text:.2s}%', textposition='outside')
+            fig_resistance_100.update_traces(text=percent_resistance_100['count'])
+            return fig_resistance_100
+
+        show_figure(('distribuição', groupby_column, min_isolates, '100%'), build_resistance_100)
 
     # Gráfico para fenotipos de resistência entre 80% e 100%
     percent_resistance_80_100 = percent_resistance[(percent_resistance['percentage'] >= 80) & (percent_resistance['percentage'] < 100)]
     if not percent_resistance_80_100.empty:
-        fig_resistance_80_100 = px.bar(percent_resistance_80_100, x='Antibiotic', y='percentage', color='Microorganismo',
-                                       title='Percentagem de isolados com fenótipo de resistência (80% a 100%)',
-                                       labels={'percentage': 'Percentagem', 'Antibiotic': 'Antibiótico', 'Microorganismo': 'Microorganismo'},
-                                       color_discrete_sequence=px.colors.qualitative.Pastel)
-        fig_resistance_80_100.update_layout(yaxis_title='Percentagem', xaxis_title='Antibiótico')
-        fig_resistance_80_100.update_traces(texttemplate='%{text:.2s}%', textposition='outside')
-        fig_resistance_80_100.update_traces(text=percent_resistance_80_100['count'])
-        st.plotly_chart(fig_resistance_80_100)
-
-    # Certificar-se de que a coluna 'Idade' contém apenas valores numéricos
-    df_clean['Idade'] = pd.to_numeric(df_clean['Idade'], errors='coerce')
-
-    # Adicionar colunas para categorizar as idades em intervalos de 10 anos
-    df_clean['Faixa Etária'] = pd.cut(df_clean['Idade'], 
-                                      bins=range(0, 121, 10), 
-                                      labels=[f'{i}-{i+9}' for i in range(0, 120, 10)], 
-                                      right=False)
+        def build_resistance_80_100():
+            fig_resistance_80_100 = px.bar(percent_resistance_80_100, x='Antibiotic', y='percentage', color='Microorganismo',
+                                           title='Percentagem de isolados com fenótipo de resistência (80% a 100%)',
+                                           labels={'percentage': 'Percentagem', 'Antibiotic': 'Antibiótico', 'Microorganismo': 'Microorganismo'},
+                                           color_discrete_sequence=px.colors.qualitative.Pastel)
+            fig_resistance_80_100.update_layout(yaxis_title='Percentagem', xaxis_title='Antibiótico')
+            fig_resistance_80_100.update_traces(texttemplate='%{text:.2s}%', textposition='outside')
+            fig_resistance_80_100.update_traces(text=percent_resistance_80_100['count'])
+            return fig_resistance_80_100
+
+        show_figure(('distribuição', groupby_column, min_isolates, '80-100%'), build_resistance_80_100)
+
+    # Índice dos filtros (faixas etárias de 10 anos incluídas), normalmente já criado na ingestão
+    if filter_index is None:
+        filter_index = FilterIndex(df_clean)
 
     st.subheader("Filtrar detalhes específicos")
 
@@ -837,7 +591,7 @@ def process_and_plot_data(df_clean, gram_positivo, gram_negativo, eskape_microor
     microorganismo = st.selectbox('Escolha o Microorganismo:', microorganismos)
 
     # Idade (intervalos de 10 anos)
-    faixas_etarias = ['Todas'] + [f'{i}-{i+9}' for i in range(0, 120, 10)]
+    faixas_etarias = ['Todas'] + AGE_BAND_LABELS
     faixa_etaria = st.multiselect('Escolha os intervalos de idade:', faixas_etarias, default=['Todas'])
 
     # Sexo
@@ -852,18 +606,19 @@ def process_and_plot_data(df_clean, gram_positivo, gram_negativo, eskape_microor
     produtos = ['Todos'] + list(df_clean['Produto'].unique())
     produto = st.selectbox('Escolha o Produto:', produtos)
 
-    # Filtrando o DataFrame
-    df_specific = df_clean[
-        ((df_clean['Microorganismo'] == microorganismo) | (microorganismo == 'Todos')) &
-        ((df_clean['Faixa Etária'].isin(faixa_etaria)) | ('Todas' in faixa_etaria)) &
-        ((df_clean['Sexo'] == sexo) | (sexo == 'Todos')) &
-        ((df_clean['Serviço'] == servico) | (servico == 'Todos')) &
-        ((df_clean['Produto'] == produto) | (produto == 'Todos'))
-    ]
+    # Filtrando o DataFrame pelo índice
+    positions = filter_index.select({
+        'Microorganismo': None if microorganismo == 'Todos' else [microorganismo],
+        'Faixa Etária': None if 'Todas' in faixa_etaria else faixa_etaria,
+        'Sexo': None if sexo == 'Todos' else [sexo],
+        'Serviço': None if servico == 'Todos' else [servico],
+        'Produto': None if produto == 'Todos' else [produto],
+    })
+    df_specific = df_clean.iloc[positions].assign(**{'Faixa Etária': filter_index.age_band.array[positions]})
 
     if not df_specific.empty:
         st.write(f"Detalhes para {microorganismo}, {faixa_etaria}, {sexo}, {servico}, {produto}:")
-        st.dataframe(df_specific)
+        paginated_table(df_specific, 'detalhes')
     else:
         st.write(f"Nenhum dado encontrado para {microorganismo}, {faixa_etaria}, {sexo}, {servico}, {produto}.")
 
@@ -883,11 +638,11 @@ def summarize_microorganism(df, microorganismo_selecionado):
     sensitive_exposure_antibiotics = []
 
     for antibiotic in antibiotic_columns:
-        if (filtered_df[antibiotic] == 'sensível').all():
+        if (filtered_df[antibiotic] == SENSIVEL).all():
             sensitive_antibiotics.append(antibiotic)
-        elif (filtered_df[antibiotic] == 'resistente').all():
+        elif (filtered_df[antibiotic] == RESISTENTE).all():
             resistant_antibiotics.append(antibiotic)
-        elif (filtered_df[antibiotic] == 'sensível com maior exposição').all():
+        elif (filtered_df[antibiotic] == SENSIVEL_MAIOR_EXPOSICAO).all():
             sensitive_exposure_antibiotics.append(antibiotic)
 
     summary_counts = {
@@ -909,7 +664,7 @@ def summarize_microorganism(df, microorganismo_selecionado):
 
 
 
-def show_microorganism_chart(df_cleaned):
+def show_microorganism_chart(df_cleaned, min_isolates=MIN_ISOLATES, counts=None, aggregates=None):
     # Usar uma chave única para o selectbox para evitar erro DuplicateWidgetID
     microorganismos = df_cleaned['Microorganismo'].unique()
     microorganismo_selecionado = st.selectbox('Selecione um microorganismo:', sorted(microorganismos), key='microorganismo_selectbox_chart_final')
@@ -920,8 +675,14 @@ def show_microorganism_chart(df_cleaned):
         if not filtered_df.empty:
             antibiotic_columns = detect_antibiotic_columns(filtered_df)
             
-            # Calcular perfil de resistência para o treemap
-            resistance_df = calculate_resistance(filtered_df)
+            # Calcular perfil de resistência para o treemap, a partir das contagens da ingestão se existirem
+            if counts is None:
+                resistance_df = calculate_resistance(filtered_df, min_isolates)
+            else:
+                tested, resistant, isolates = (part[part.index.isin([microorganismo_selecionado])] for part in counts)
+                resistance_df = resistance_percentages(tested, resistant, isolates, min_isolates)
+                if not resistance_df.empty:
+                    resistance_df = format_resistance(resistance_df)
             
             if not resistance_df.empty:
                 # Garantir que o DataFrame tenha a estrutura correta para o treemap
@@ -930,18 +691,18 @@ def show_microorganism_chart(df_cleaned):
                 resistance_df['Resistance'] = pd.to_numeric(resistance_df['Resistance'], errors='coerce')
                 
                 # Adicionar a coluna 'Class' com as classes dos antibióticos
-                resistance_df['Class'] = resistance_df['Antibiotic'].apply(classify_antibiotic)
+                resistance_df['Class'] = antibiotic_classes(resistance_df['Antibiotic'])
                 
                 # Adicionar um valor mínimo não-zero para evitar divisão por zero
                 resistance_df['Resistance'] = resistance_df['Resistance'].apply(lambda x: x if x > 0 else 0.0001)
                 
                 # Gráfico de treemap para todos os antibióticos
                 st.write(f"Perfil de resistência para {microorganismo_selecionado}")
-                fig = px.treemap(resistance_df, path=['Microorganismo', 'Antibiotic'], values='Resistance',
-                                 color='Resistance', hover_data={'Resistance': ':.2f'},
-                                 color_continuous_scale=px.colors.sequential.BuGn,  # Paleta de cores agradável
-                                 title=f"Resistência aos antibióticos para {microorganismo_selecionado}")
-                st.plotly_chart(fig)
+                show_figure(('microorganismos', microorganismo_selecionado, min_isolates),
+                            lambda: px.treemap(resistance_df, path=['Microorganismo', 'Antibiotic'], values='Resistance',
+                                               color='Resistance', hover_data={'Resistance': ':.2f'},
+                                               color_continuous_scale=px.colors.sequential.BuGn,  # Paleta de cores agradável
+                                               title=f"Resistência aos antibióticos para {microorganismo_selecionado}"))
 
                 # Criar um DataFrame com microorganismo no eixo x e classes de antibióticos no eixo y
                 resistance_summary_df = resistance_df.pivot_table(index='Microorganismo', columns='Class', values='Resistance', aggfunc='mean').fillna(0)
@@ -954,17 +715,18 @@ def show_microorganism_chart(df_cleaned):
             
             # Informações adicionais sobre o microorganismo
             st.write("### Informações Adicionais")
-            num_cases = filtered_df.shape[0]
-            if 'Serviço' in filtered_df.columns:
-                common_service = filtered_df['Serviço'].mode()[0]
-                service_count = filtered_df[filtered_df['Serviço'] == common_service].shape[0]
+            summary = (aggregates or PageAggregates()).get('organisms', organism_summary, df_cleaned).loc[microorganismo_selecionado]
+            num_cases = summary['Casos']
+            if pd.notna(summary.get('Serviço')):
+                common_service = summary['Serviço']
+                service_count = summary['Casos (Serviço)']
                 st.write(f"Este microorganismo apresentou {num_cases} casos, dos quais {service_count} casos no serviço de {common_service}.")
             else:
                 st.write(f"Este microorganismo apresentou {num_cases} casos.")
             
-            if 'Produto' in filtered_df.columns:
-                common_product = filtered_df['Produto'].mode()[0]
-                product_count = filtered_df[filtered_df['Produto'] == common_product].shape[0]
+            if pd.notna(summary.get('Produto')):
+                common_product = summary['Produto']
+                product_count = summary['Casos (Produto)']
                 st.write(f"O produto {common_product} é o que apresenta maior número de identificações , {product_count} identificações.")
             
             if not resistance_df.empty:
@@ -974,14 +736,14 @@ def show_microorganism_chart(df_cleaned):
             # Exibir os antibióticos relevantes
             relevant_antibiotics_df = filtered_df[['Microorganismo'] + antibiotic_columns]
             relevant_antibiotics_df = relevant_antibiotics_df.dropna(how='all', subset=antibiotic_columns)
-            relevant_antibiotics_df = relevant_antibiotics_df.loc[:, relevant_antibiotics_df.isin(['Resistente', 'Sensível', 'Sensível, com maior exposição.']).any()]
+            relevant_antibiotics_df = relevant_antibiotics_df.loc[:, relevant_antibiotics_df.isin(RESULT_CATEGORIES).any()]
             st.write(f"Antibióticos para {microorganismo_selecionado} com resultados de resistência")
-            st.write(relevant_antibiotics_df)
+            paginated_table(relevant_antibiotics_df, 'antibioticos')
         else:
             st.write("Sem dados disponíveis para o microorganismo selecionado.")
 
 
-def multi_selection_filter(df):
+def multi_selection_filter(df, organism_index=None):
     st.subheader("Filtro Multisseleção para Microorganismos e Antibióticos")
 
     # Seleção de Microorganismos
@@ -1004,15 +766,19 @@ def multi_selection_filter(df):
 
     # Filtrar DataFrame
     if selected_microorganisms and selected_antibiotics:
-        filtered_df = df[df['Microorganismo'].isin(selected_microorganisms)][['Microorganismo'] + selected_antibiotics]
-        st.write(filtered_df)
+        if organism_index is None:
+            organism_index = FilterIndex(df, ['Microorganismo'])
+        positions = organism_index.positions('Microorganismo', selected_microorganisms)
+        filtered_df = df[['Microorganismo'] + selected_antibiotics].iloc[positions]
+        paginated_table(filtered_df, 'filtro')
         
         # Plot Gráficos círculo
         for antibiotic in selected_antibiotics:
-            counts = filtered_df[antibiotic].value_counts().reset_index()
+            counts = observed_value_counts(filtered_df[antibiotic]).reset_index()
             counts.columns = ['Resposta', 'Contagem']
-            fig = px.pie(counts, values='Contagem', names='Resposta', title=f'Distribuição de Respostas para {antibiotic}')
-            st.plotly_chart(fig)
+            show_figure(('filtros', tuple(sorted(selected_microorganisms)), antibiotic),
+                        lambda: px.pie(counts, values='Contagem', names='Resposta',
+                                       title=f'Distribuição de Respostas para {antibiotic}'))
     else:
         st.write("Selecione pelo menos um Microorganismo e um Antibiótico.")
 
@@ -1023,40 +789,160 @@ st.set_page_config(layout='wide', initial_sidebar_state='expanded')
 st.title('🧫Ferramenta de apoio à Microbiologia do ULSRA')
 st.header("💊 Uso exclusivo do Serviço ")
 
-uploaded_file = st.sidebar.file_uploader("Upload your Excel file here", type=['xlsx', 'xls'])
+def show_diagnostics(records):
+    """Painel lateral com o tempo, as linhas e a variação de memória de cada etapa desta execução."""
+    with st.sidebar.expander("Diagnóstico de desempenho", expanded=True):
+        if not records:
+            st.caption("Sem etapas medidas nesta execução.")
+            return
+        table = pd.DataFrame(records)
+        table['stage'] = ['\u2003' * depth + stage for depth, stage in zip(table['depth'], table['stage'])]
+        columns = {'stage': 'Etapa', 'seconds': 'Tempo (s)', 'rows_in': 'Linhas (entrada)',
+                   'rows_out': 'Linhas (saída)', 'rss_delta_mb': 'Δ RSS (MB)'}
+        st.dataframe(table[list(columns)].rename(columns=columns), hide_index=True)
+
+
+@st.cache_resource
+def get_ingest_cache():
+    """Cache partilhada entre reruns com os dados já processados."""
+    return LRUCache(INGEST_CACHE_SIZE)
+
+
+@st.cache_resource
+def get_figure_cache():
+    """Figuras plotly já construídas, partilhadas por todas as sessões e limitadas em número e em memória."""
+    return LRUCache(FIGURE_CACHE_SIZE, max_bytes=int(FIGURE_CACHE_MB * 2 ** 20), sizeof=figure_size)
+
+
+@st.cache_resource
+def get_precompute_executor():
+    """Threads partilhadas por todas as sessões para o pré-cálculo dos agregados das páginas."""
+    return ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1), thread_name_prefix='agregados')
+
+
+def start_precompute(entry, first_page=None):
+    """Pedir em segundo plano os agregados de todas as páginas, a começar pela página atual."""
+    aggregates = entry.setdefault('aggregates', PageAggregates(get_precompute_executor()))
+    df_cleaned = entry['df_cleaned']
+    tasks = {
+        "Microorganismos": [('organisms', organism_summary, df_cleaned)],
+        "Análise exploratória com Classes": [(('cube', 'Total', 'Total'), cube_slice, entry['cube'], 'Total', 'Total')],
+        "Distribuição e Frequência":
+            [(('distribution', option), distribution_aggregates, df_cleaned, option, DISTRIBUTION_GROUPS, entry['results'])
+             for option in DISTRIBUTION_OPTIONS]
+            + [(('demographics', by), demographic_counts, df_cleaned, by) for by in ('Sexo', 'Idade')],
+    }
+    for page in sorted(tasks, key=lambda page: page != first_page):
+        for name, func, *args in tasks[page]:
+            aggregates.submit(name, func, *args)
+    return aggregates
+
+
+@st.fragment(run_every=1)
+def show_precompute_progress(aggregates):
+    done, total = aggregates.progress()
+    st.progress(done / total if total else 1.0, text=f"Agregados das páginas: {done}/{total}")
+
+
+@st.cache_resource
+def get_shared_store():
+    """Armazenamento dos dados limpos partilhado por todas as sessões deste servidor (e por outros processos)."""
+    return SharedDatasetStore()
+
+
+diagnostics = st.sidebar.checkbox("Diagnóstico de desempenho")
+TIMINGS.begin(diagnostics)
+
+uploaded_files = st.sidebar.file_uploader("Upload your Excel files here", type=['xlsx', 'xls', 'csv'], accept_multiple_files=True)
+use_store = st.sidebar.checkbox("Guardar cópia colunar para carregamento rápido", value=True)
+# o modo streaming escreve sempre na cópia colunar, bloco a bloco
+streaming = st.sidebar.checkbox("Modo streaming (ficheiros muito grandes)")
+share = st.sidebar.checkbox("Partilhar os dados limpos entre sessões (memória partilhada)", value=True)
+incremental = st.sidebar.checkbox("Modo incremental (juntar ao conjunto acumulado)")
+if incremental:
+    dataset_name = st.sidebar.text_input("Nome do conjunto acumulado", value="acumulado")
+min_isolates = st.sidebar.number_input("Mínimo de isolados testados por percentagem", min_value=0, value=MIN_ISOLATES,
+                                       step=1, help="Células com menos isolados testados não são apresentadas (CLSI M39: 30).")
 
 df = pd.DataFrame()
 df_cleaned = pd.DataFrame()
 
-if uploaded_file is not None:
-    df, error = read_data(uploaded_file)
+if uploaded_files:
+    ingest_cache = get_ingest_cache()
+    read_progress = st.progress(0.0)
+
+    def show_read_progress(source, done, total):
+        read_progress.progress(done / total, text=f"Lido: {source} ({done}/{total})")
+
+    if incremental:
+        entry, error = ingest_incremental(uploaded_files, dataset_name, ColumnarStore(), ingest_cache, show_read_progress,
+                                          streaming)
+    else:
+        store = ColumnarStore() if use_store or streaming else None
+        shared = get_shared_store() if share else None
+        entry, error = ingest_file(uploaded_files, ingest_cache, store, show_read_progress, streaming, shared=shared)
+    read_progress.empty()
     if error:
         st.error(f"Failed to read data: {error}")
     else:
-        df_cleaned, df_duplicates = df_clean(df)
+        for warning in entry['warnings']:
+            st.warning(f"Folha ignorada: {warning}")
+        df = entry['df']
+        df_cleaned = entry['df_cleaned']
+        df_duplicates = entry['df_duplicates']
+        resistance_counts_data = entry['resistance_counts']
+        cube = entry['cube']
+        trend_counts = entry['trend_counts']
+        filter_index = entry['filter_index']
+        organism_index = entry['organism_index']
+        st.session_state['dataset_key'] = entry['key']
+        aggregates = start_precompute(entry, st.session_state.get('page'))
+        show_cleaning_summary(entry['summary'])
+        show_unmapped_organisms(entry['df'])
+    cache_stats = ingest_cache.stats()
+    st.sidebar.caption(f"Cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+                       f"({cache_stats['entries']}/{cache_stats['max_entries']} ficheiros)")
+    figure_stats = get_figure_cache().stats()
+    st.sidebar.caption(f"Figuras: {figure_stats['hits']} hits / {figure_stats['misses']} misses "
+                       f"({figure_stats['entries']} figuras, {figure_stats['bytes'] / 2 ** 20:.1f} MB)")
+    if share and not incremental:
+        st.sidebar.caption(f"Partes partilhadas abertas: {get_shared_store().open_count()}")
 
 if not df_cleaned.empty:
-    resistance_data = calculate_resistance(df_cleaned)
     st.write("")
     st.write("Perfil de resistência por microorganismo e antibótico:")
     
+    resistance_data = resistance_percentages(*resistance_counts_data, min_isolates)
     if not resistance_data.empty:
-        styled_data = resistance_data.style.map(highlight_resistance)
-        st.dataframe(styled_data)
+        with TIMINGS.measure("mapa de resistências", len(resistance_data)):
+            show_resistance_heatmap(resistance_data, ('mapa', min_isolates))
+    if min_isolates > 1:
+        st.caption(f"Percentagens com menos de {min_isolates} isolados testados não são apresentadas.")
+    with st.expander("Isolados testados, resistentes e intervalos de confiança (95%, Wilson)"):
+        paginated_table(resistance_statistics(*resistance_counts_data[:2], min_isolates), 'estatisticas')
 
    
 
-    page = st.sidebar.selectbox("Select Page", ["Microorganismos", "Análise exploratória com Classes","Verificação de Duplicados","Distribuição e Frequência","Filtros"])
-
-    if page == "Microorganismos":
-        show_microorganism_chart(df_cleaned)
-    elif page == "Análise exploratória com Classes":
-        show_product_service_chart(df_cleaned)
-    elif page == "Verificação de Duplicados":
-        check_duplicates(df_duplicates)
-    elif page == "Distribuição e Frequência":
-        process_and_plot_data(df_cleaned, GRAM_POSITIVO, GRAM_NEGATIVO, RELEVANT_MICROORGANISMS)
-    elif page == "Filtros":
-        multi_selection_filter(df)
-
-
+    page = st.sidebar.selectbox("Select Page", ["Microorganismos", "Análise exploratória com Classes","Verificação de Duplicados","Distribuição e Frequência","Filtros","Tendências"], key='page')
+    done, total = aggregates.progress()
+    if done < total:
+        with st.sidebar:
+            show_precompute_progress(aggregates)
+
+    with TIMINGS.measure(f"página: {page}", len(df_cleaned)):
+        if page == "Microorganismos":
+            show_microorganism_chart(df_cleaned, min_isolates, resistance_counts_data, aggregates)
+        elif page == "Análise exploratória com Classes":
+            show_product_service_chart(cube, min_isolates, aggregates)
+        elif page == "Verificação de Duplicados":
+            check_duplicates(df_duplicates)
+        elif page == "Distribuição e Frequência":
+            process_and_plot_data(df_cleaned, GRAM_POSITIVO, GRAM_NEGATIVO, RELEVANT_MICROORGANISMS, filter_index, min_isolates,
+                                  aggregates, entry['results'])
+        elif page == "Filtros":
+            multi_selection_filter(df, organism_index)
+        elif page == "Tendências":
+            show_trends(trend_counts)
+
+if diagnostics:
+    show_diagnostics(TIMINGS.records)
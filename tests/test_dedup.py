@@ -0,0 +1,85 @@
+"""Remoção de duplicados: a impressão digital dos antibióticos (antibiotic_fingerprint) tem de manter e
+remover exatamente as mesmas linhas que a antiga chave em texto ('_'.join dos resultados)."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from bench import generate_export
+from resis import df_clean, normalise_frame, result_columns
+
+
+def string_key_dedup(df):
+    """Limpeza original: chave em texto com os resultados de cada linha unidos por '_'."""
+    df['Data Colheita'] = pd.to_datetime(df['Data Colheita'], format='%d/%m/%Y', errors='coerce')
+    df.sort_values(by=['Nº Processo', 'Microorganismo', 'Data Colheita'], inplace=True)
+    df['Antibiotics'] = result_columns(df).apply(lambda row: '_'.join(row.fillna('').astype(str)), axis=1)
+    df['Difference'] = df.groupby(['Nº Processo', 'Microorganismo'], observed=True)['Data Colheita'].diff().abs().dt.days
+    mask = (df['Difference'] <= 15) & df.duplicated(['Nº Processo', 'Microorganismo', 'Antibiotics'], keep=False)
+    df_duplicates = df.loc[mask]
+    df_no_duplicates = df.drop_duplicates(subset=['Nº Processo', 'Microorganismo', 'Antibiotics', 'Data Colheita'],
+                                          keep='first')
+    return df_no_duplicates, df_duplicates
+
+
+def edge_cases(template):
+    """Pares do mesmo doente nos limites da janela de 15 dias, com vazios '' e tipos misturados."""
+    antibiotics = list(template.columns[27:31])
+    rows = []
+    def add(patient, date, results):
+        row = template.iloc[0].copy()
+        row['Nº Processo'], row['Microorganismo'], row['Data Colheita'] = patient, 'Escherichia coli', date
+        row[antibiotics] = results
+        rows.append(row)
+
+    same = ['Resistente', 'Sensível', None, 'Sensível']
+    add(900001, '01/03/2024', same); add(900001, '16/03/2024', same)                    # 15 dias: duplicado
+    add(900002, '01/03/2024', same); add(900002, '17/03/2024', same)                    # 16 dias: mantido
+    add(900003, '01/03/2024', same); add(900003, '01/03/2024', same)                    # mesma data
+    add(900004, '01/03/2024', ['Resistente', 'Sensível', '', 'Sensível']); add(900004, '05/03/2024', same)  # '' = vazio
+    add(900005, '01/03/2024', ['Resistente', 1, '', 2.5]); add(900005, '03/03/2024', ['Resistente', '1', None, '2.5'])
+    add(900006, '01/03/2024', same); add(900006, '10/03/2024', ['Sensível'] * 4); add(900006, '20/03/2024', same)
+    for day in range(1, 29, 4):                                                          # doente repetido
+        add(900007, f'{day:02d}/02/2024', same)
+    return pd.DataFrame(rows)
+
+
+def synthetic_export(seed):
+    df = generate_export(3000, seed)
+    df = pd.concat([df, edge_cases(df)], ignore_index=True)
+    rng = np.random.default_rng(seed)
+    antibiotics = df.columns[27:]
+    # células vazias escritas como '' e colunas com números e texto misturados
+    for col in rng.choice(antibiotics, 6, replace=False):
+        df.loc[df[col].isna() & (rng.random(len(df)) < 0.5), col] = ''
+    mixed = antibiotics[-1]
+    df[mixed] = df[mixed].astype(object)
+    df.loc[rng.random(len(df)) < 0.2, mixed] = 1
+    df.loc[rng.random(len(df)) < 0.2, mixed] = '1'
+    return df
+
+
+@pytest.mark.parametrize('normalise', [False, True], ids=['exportacao', 'normalizada'])
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_fingerprint_matches_string_key(seed, normalise):
+    df = synthetic_export(seed)
+    if normalise:
+        df = normalise_frame(df)
+
+    expected_kept, expected_duplicates = string_key_dedup(df.copy())
+    kept, duplicates = df_clean(df.copy(), report_error=pytest.fail)
+
+    assert kept.index.tolist() == expected_kept.index.tolist()
+    assert duplicates.index.tolist() == expected_duplicates.index.tolist()
+
+
+def test_window_edges():
+    df = synthetic_export(0)
+    kept, duplicates = df_clean(df.copy(), report_error=pytest.fail)
+    duplicated_patients = set(duplicates['Nº Processo'])
+    kept_patients = kept['Nº Processo'].value_counts()
+
+    assert {900001, 900004, 900005, 900007} <= duplicated_patients
+    assert 900002 not in duplicated_patients
+    # a janela conta desde a colheita anterior do doente, mesmo que esta tenha outros resultados
+    assert 900006 in duplicated_patients
+    assert kept_patients[900003] == 1
@@ -0,0 +1,146 @@
+"""Modo incremental: juntar exportações a um conjunto acumulado (ingest_incremental / append_export)."""
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from bench import generate_export
+from resis import (
+    DISTRIBUTION_OPTIONS, ColumnarStore, FilterIndex, LRUCache, SparseResults, cube_slice, distribution_aggregates,
+    ingest_incremental, resistance_statistics, resistance_trend,
+)
+
+
+class Upload(io.BytesIO):
+    """Ficheiro carregado como o do Streamlit (conteúdo e nome)."""
+
+    def __init__(self, df, name):
+        buffer = io.StringIO()
+        df.to_csv(buffer, sep=';', index=False)
+        super().__init__(buffer.getvalue().encode('utf-8'))
+        self.name = name
+
+
+def split_uploads(df, parts, seed):
+    """Partes aleatórias (sem repetição) da exportação, cada uma como um ficheiro CSV."""
+    positions = np.array_split(np.random.default_rng(seed).permutation(len(df)), parts)
+    return [Upload(df.iloc[np.sort(p)], f'parte{i}.csv') for i, p in enumerate(positions)]
+
+
+def test_reupload_returns_current_dataset(tmp_path):
+    a, b = split_uploads(generate_export(2000, 0), 2, seed=0)
+    store, cache = ColumnarStore(root=str(tmp_path)), LRUCache(4)
+
+    first, _ = ingest_incremental([a], 'acc', store, cache)
+    second, _ = ingest_incremental([b], 'acc', store, cache)
+    again, error = ingest_incremental([a], 'acc', store, cache)
+
+    assert error is None
+    assert first['key'] != second['key']
+    # o ficheiro já estava no conjunto: devolve o estado atual, não o de quando foi junto
+    assert again['key'] == second['key']
+    assert len(again['df_cleaned']) == len(second['df_cleaned'])
+    assert len(again['sources']) == 2
+
+    # noutro processo (cache vazia) o resultado é o mesmo
+    reloaded, _ = ingest_incremental([a], 'acc', ColumnarStore(root=str(tmp_path)), LRUCache(4))
+    assert reloaded['key'] == second['key']
+    assert len(reloaded['df_cleaned']) == len(second['df_cleaned'])
+
+
+def plain(table):
+    """Tabela de contagens com os níveis do índice em texto, linhas e colunas ordenadas."""
+    table = table.copy()
+    index = table.index
+    levels = [index.get_level_values(i) for i in range(index.nlevels)]
+    table.index = pd.MultiIndex.from_arrays([level.astype(str) for level in levels], names=index.names) \
+        if index.nlevels > 1 else index.astype(str)
+    table = table.sort_index()
+    if isinstance(table, pd.DataFrame):
+        table = table[sorted(table.columns)]
+    return table.astype('int64')
+
+
+def assert_counts_equal(left, right):
+    left, right = plain(left), plain(right)
+    if isinstance(left, pd.DataFrame):
+        pd.testing.assert_frame_equal(left, right, check_names=False)
+    else:
+        pd.testing.assert_series_equal(left, right, check_names=False)
+
+
+def assert_long_equal(left, right, keys):
+    """Tabelas longas iguais linha a linha, depois de ordenadas pelas colunas `keys`."""
+    def ordered(table):
+        return table.astype({key: str for key in keys}).sort_values(keys).reset_index(drop=True)
+    pd.testing.assert_frame_equal(ordered(left), ordered(right))
+
+
+def rows(cleaned, columns):
+    """Linhas limpas como texto, ordenadas, para comparar conjuntos com ordens diferentes."""
+    frame = cleaned[columns].astype(object)
+    # vazios como None, seja qual for a origem (NaN na leitura, None ao juntar partes com colunas diferentes)
+    return frame.where(frame.notna(), None).astype(str).sort_values(columns).reset_index(drop=True)
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+@pytest.mark.parametrize('parts', [2, 4])
+def test_appended_parts_match_full_export(tmp_path, seed, parts):
+    df = generate_export(3000, seed)
+    store, cache = ColumnarStore(root=str(tmp_path)), LRUCache(8)
+    full, _ = ingest_incremental([Upload(df, 'completa.csv')], 'completa', store, cache)
+    for upload in split_uploads(df, parts, seed):
+        appended, error = ingest_incremental([upload], 'acumulado', store, cache)
+        assert error is None
+
+    cleaned, expected = appended['df_cleaned'], full['df_cleaned']
+    # 'Origem' é o ficheiro de cada linha e 'Difference' depende das colheitas vistas na reavaliação
+    columns = [column for column in expected.columns if column not in ('Origem', 'Difference')]
+    pd.testing.assert_frame_equal(rows(cleaned, columns), rows(expected, columns))
+    assert len(appended['df_duplicates']) == len(full['df_duplicates'])
+
+    for counts, expected_counts in zip(appended['resistance_counts'], full['resistance_counts']):
+        assert_counts_equal(counts, expected_counts)
+    for part in ('tested', 'resistant', 'isolates'):
+        assert_counts_equal(appended['cube'][part], full['cube'][part])
+    assert appended['cube']['services'] == full['cube']['services']
+    assert appended['cube']['products'] == full['cube']['products']
+    for counts, expected_counts in zip(appended['trend_counts'], full['trend_counts']):
+        assert_counts_equal(counts, expected_counts)
+    for window, cumulative in ((1, False), (3, False), (1, True)):
+        assert_long_equal(resistance_trend(appended['trend_counts'], window=window, cumulative=cumulative),
+                          resistance_trend(full['trend_counts'], window=window, cumulative=cumulative),
+                          ['Microorganismo', 'Período', 'Antibiotic'])
+
+    # resultados esparsos e índice de filtros estendidos = construídos de raiz sobre os dados acumulados
+    fresh = SparseResults(cleaned)
+    for counts, expected_counts in zip(appended['results'].counts(cleaned['Microorganismo']),
+                                       fresh.counts(cleaned['Microorganismo'])):
+        assert_counts_equal(counts, expected_counts)
+    index, fresh_index = appended['filter_index'], FilterIndex(cleaned)
+    assert index.age_band.astype(str).tolist() == fresh_index.age_band.astype(str).tolist()
+    for dimension, postings in fresh_index.postings.items():
+        assert {value: p.tolist() for value, p in index.postings[dimension].items()} == \
+            {value: p.tolist() for value, p in postings.items()}
+
+    for option in DISTRIBUTION_OPTIONS:
+        aggregates = distribution_aggregates(cleaned, option, results=appended['results'])
+        expected_aggregates = distribution_aggregates(expected, option, results=full['results'])
+        assert_counts_equal(aggregates['tested'], expected_aggregates['tested'])
+        assert_counts_equal(aggregates['resistant'], expected_aggregates['resistant'])
+        assert_counts_equal(aggregates['result_counts'], expected_aggregates['result_counts'])
+        data_counts = aggregates['data_counts']
+        assert_long_equal(data_counts, expected_aggregates['data_counts'], [data_counts.columns[0]])
+
+    tested, resistant, _ = cube_slice(appended['cube'], 'Total', 'Total')
+    expected_tested, expected_resistant, _ = cube_slice(full['cube'], 'Total', 'Total')
+    assert_long_equal(resistance_statistics(tested, resistant),
+                      resistance_statistics(expected_tested, expected_resistant), ['Microorganismo', 'Antibiotic'])
+
+    # o cubo e as contagens mensais gravados com o conjunto são os mesmos depois de lidos noutro processo
+    reloaded, _ = ingest_incremental([upload], 'acumulado', ColumnarStore(root=str(tmp_path)), LRUCache(8))
+    for part in ('tested', 'resistant', 'isolates'):
+        assert_counts_equal(reloaded['cube'][part], full['cube'][part])
+    for counts, expected_counts in zip(reloaded['trend_counts'], full['trend_counts']):
+        assert_counts_equal(counts, expected_counts)
@@ -0,0 +1,36 @@
+"""Leitura dos livros: no próprio processo (batch) o resultado tem de ser igual ao da leitura em paralelo."""
+import io
+from unittest import mock
+
+import pandas as pd
+
+import resis
+from bench import generate_export
+
+
+def workbook_bytes(sheets):
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer) as writer:
+        for name, df in sheets.items():
+            df.to_excel(writer, sheet_name=name, index=False)
+    return buffer.getvalue()
+
+
+def test_in_process_read_matches_pool():
+    df = generate_export(900, 6)
+    files = [
+        ('livro.xlsx', workbook_bytes({'A': df.iloc[:400], 'B': df.iloc[400:]})),
+        ('exportacao.csv', df.iloc[:200].to_csv(sep=';', index=False).encode('utf-8')),
+        ('estragado.xlsx', b'nada'),
+    ]
+    expected, expected_errors = resis.read_workbooks(files, max_workers=2)
+
+    # sem processos novos e com o livro aberto uma só vez para as duas folhas
+    with mock.patch.object(resis, 'ProcessPoolExecutor', side_effect=AssertionError), \
+            mock.patch.object(resis.pd, 'ExcelFile', wraps=pd.ExcelFile) as excel_file:
+        result, errors = resis.read_workbooks(files, max_workers=1)
+    assert excel_file.call_count == 2
+
+    pd.testing.assert_frame_equal(result, expected)
+    assert list(result[resis.SOURCE_COLUMN].cat.categories) == ['livro.xlsx [A]', 'livro.xlsx [B]', 'exportacao.csv']
+    assert sorted(errors) == sorted(expected_errors)